@@ -0,0 +1,664 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os.path
+import subprocess
+import sys
+import time
+
+from parsecache import parsers
+from visitor.interpreter import InterpreterVisitor, InspectorInterpreterVisitor
+from visitor.interpreter import INAME
+from visitor.machine import AbstractMachine, InspectorAbstractMachine
+from visitor.resolver import ScopeResolverVisitor
+from visitor.store import DictStore, ArrayStore
+
+
+# ==========
+# Benchmarks
+# ==========
+#
+# The corpus consists of Class programs that this module generates from a
+# size parameter, so every run measures exactly the same programs.  Each
+# workload runs in a process of its own; thus the peak memory of one
+# workload does not include the garbage of another.  The process parses
+# the program and runs it to completion once to count the steps and the
+# peak number of objects in the store, and then repeats parsing and running
+# without sampling.  The fastest repetition counts, since it is disturbed
+# the least by other activity on the machine.  A run includes creating the
+# engine.
+#
+# Results map each workload to its metrics; see measure().  Comparing them
+# with a baseline flags every metric that got worse by more than a
+# tolerance, and every change of the number of steps, which means that the
+# programs or the semantics changed.  Times vary between runs by more than
+# the differences worth reporting, so the flagged workloads are measured
+# again, and only the regressions that all measurements show count.
+
+engines = {
+	"tree": InterpreterVisitor,
+	"vm": AbstractMachine,
+}
+
+stores = {
+	"dict": DictStore,
+	"array": ArrayStore,
+}
+
+# Engines for checkReachability().
+inspectors = {
+	"tree": InspectorInterpreterVisitor,
+	"vm": InspectorAbstractMachine,
+}
+
+# Processor time on Unix, which other processes disturb less than wall
+# time; wall time on Windows.
+_clock = time.clock
+
+# Seconds that the repeated calls of a measurement must take at least; see
+# _averageTime().
+_minimumTime = 0.1
+
+# Metrics as pairs (name, whether larger values are better).
+metrics = [
+	("parseSeconds", False),
+	("stepsPerSecond", True),
+	("peakStore", False),
+	("peakMemory", False),
+]
+
+
+# Classes that several workloads share.  A Bit is one digit of a binary
+# counter whose lowest Bit counts the iterations of a loop;
+# increment() returns one if the counter overflowed and zero otherwise.
+_symbolClass = """
+class Symbol is begin
+	constructor() is skip;
+end;
+"""
+
+_bitClass = """
+class Bit is begin
+	var value; var next; var zero; var one; var stop;
+
+	constructor(z, o, n, s) is begin
+		zero := z; one := o; next := n; stop := s;
+		value := z
+	end;
+
+	method increment() is begin
+		var overflow;
+		if value = zero then begin
+			value := one;
+			return zero
+		end
+		else skip;
+
+		value := zero;
+		if next = stop then return one else skip;
+		overflow := next.increment();
+		return overflow
+	end;
+end;
+"""
+
+_cellClass = """
+class Cell is begin
+	var left_neighbour; var right_neighbour;
+	var content; var default;
+
+	constructor(default_content) is begin
+		left_neighbour := self;
+		right_neighbour := self;
+		content := default_content;
+		default := default_content
+	end;
+
+	method left() is begin
+		if left_neighbour = self then begin
+			left_neighbour := new Cell(default);
+			left_neighbour.set_right(self)
+		end
+		else skip;
+		return left_neighbour
+	end;
+
+	method set_left(l) is left_neighbour := l;
+
+	method right() is begin
+		if right_neighbour = self then begin
+			right_neighbour := new Cell(default);
+			right_neighbour.set_left(self)
+		end
+		else skip;
+		return right_neighbour
+	end;
+
+	method set_right(r) is right_neighbour := r;
+
+	method read() is return content;
+
+	method write(c) is content := c;
+end;
+"""
+
+
+def _main(variables, statements):
+	"""
+	A class Main whose constructor declares the given variables and
+	executes the given statements, followed by the program's initial
+	statement.
+	"""
+	return "class Main is begin\n" \
+		"\tconstructor() is begin\n%s\t\t%s\n\tend;\nend;\n\nnew Main()\n" % (
+			"".join([ "\t\tvar %s;\n" % x for x in variables ]),
+			";\n\t\t".join(statements)
+		)
+
+
+def _counter(bits):
+	"""
+	Variables and statements that make zero, one and stop Symbols and
+	low the lowest Bit of a counter with the given number of bits.
+	"""
+	variables = ["zero", "one", "stop", "low", "overflow"]
+	statements = [
+		"zero := new Symbol()",
+		"one := new Symbol()",
+		"stop := new Symbol()",
+		"low := stop",
+	]
+	for i in range(bits):
+		statements.append("low := new Bit(zero, one, low, stop)")
+	statements.append("overflow := zero")
+	return variables, statements
+
+
+def busyBeaver(table):
+	"""
+	A Turing machine as in busy.cls.  The table maps each state to the
+	actions for reading 0 and 1 as triples (symbol to write, "L" or "R",
+	next state or None to halt).  The machine starts in state "A".
+	"""
+	states = sorted(table)
+	variables = " ".join([ "var state_%s;" % s for s in states ])
+	constructor = "".join([
+		"\t\tstate_%s := new Symbol();\n" % s for s in states
+	])
+	cases = []
+	for state in states:
+		actions = []
+		for read, (write, move, next) in enumerate(table[state]):
+			body = [
+				"head.write(char_%i)" % write,
+				"head := head.%s()" % {"L": "left", "R": "right"}[move],
+			]
+			if next is None:
+				body.append("return true")
+			else:
+				body.append("current_state := state_%s" % next)
+				body.append("return false")
+			actions.append(
+				"\t\t\tif c = char_%i then begin\n\t\t\t\t%s\n"
+				"\t\t\tend\n\t\t\telse skip" % (read, ";\n\t\t\t\t".join(body))
+			)
+		cases.append(
+			"\t\tif current_state = state_%s then begin\n%s\n"
+			"\t\tend\n\t\telse skip;\n" % (state, ";\n".join(actions))
+		)
+
+	return _symbolClass + _cellClass + """
+class TuringMachine is begin
+	%s
+	var char_0; var char_1;
+	var head; var current_state;
+	var true; var false;
+
+	constructor() is begin
+%s		char_0 := new Symbol();
+		char_1 := new Symbol();
+		head := new Cell(char_0);
+		current_state := state_A;
+		true := new Symbol();
+		false := new Symbol();
+		self.run()
+	end;
+
+	method run() is begin
+		var stop;
+		stop := false;
+		while stop = false do
+			stop := self.step()
+	end;
+
+	method step() is begin
+		var c;
+		c := head.read();
+%s		return true
+	end;
+end;
+
+new TuringMachine()
+""" % (variables, constructor, "".join(cases))
+
+
+def loop(bits):
+	"""
+	A while loop that runs 2**bits times.
+	"""
+	variables, statements = _counter(bits)
+	statements.append(
+		"while overflow = zero do overflow := low.increment()"
+	)
+	return _symbolClass + _bitClass + _main(variables, statements)
+
+
+def recursion(bits):
+	"""
+	Recursion 2**bits calls deep along a list built by a loop.
+	"""
+	variables, statements = _counter(bits)
+	variables += ["list", "result"]
+	statements += [
+		"list := stop",
+		"while overflow = zero do begin\n"
+		"\t\t\tlist := new Node(list, stop);\n"
+		"\t\t\toverflow := low.increment()\n"
+		"\t\tend",
+		"result := list.depth()",
+	]
+	return _symbolClass + _bitClass + """
+class Node is begin
+	var next; var stop;
+
+	constructor(n, s) is begin
+		next := n;
+		stop := s
+	end;
+
+	method depth() is begin
+		var result;
+		if next = stop then return stop else skip;
+		result := next.depth();
+		return result
+	end;
+end;
+""" + _main(variables, statements)
+
+
+def wideObjects(width, bits=6):
+	"""
+	2**bits objects with the given number of variables and methods each,
+	every one referring to the previous one.
+	"""
+	names = [ "v%i" % i for i in range(width) ]
+	getters = "".join([
+		"\tmethod get_%s() is return %s;\n" % (x, x) for x in names
+	])
+	rotation = [ "first := %s" % names[0] ] + [
+		"%s := %s" % (x, y) for x, y in zip(names, names[1:])
+	] + [ "%s := first" % names[-1] ]
+
+	variables, statements = _counter(bits)
+	variables += ["wide", "value"]
+	statements += [
+		"wide := new Wide(stop, zero)",
+		"while overflow = zero do begin\n"
+		"\t\t\twide := new Wide(wide, one);\n"
+		"\t\t\twide.rotate();\n"
+		"\t\t\tvalue := wide.get_%s();\n"
+		"\t\t\toverflow := low.increment()\n"
+		"\t\tend" % names[-1],
+	]
+	return _symbolClass + _bitClass + """
+class Wide is begin
+	var previous;
+%s
+	constructor(p, seed) is begin
+		previous := p;
+		%s
+	end;
+
+	method rotate() is begin
+		var first;
+		%s
+	end;
+
+%send;
+""" % (
+		"".join([ "\tvar %s;\n" % x for x in names ]),
+		";\n\t\t".join([ "%s := seed" % x for x in names ]),
+		";\n\t\t".join(rotation),
+		getters
+	) + _main(variables, statements)
+
+
+def objectGraph(depth):
+	"""
+	A binary tree of the given depth whose nodes also refer to their
+	parents, built and then traversed recursively.
+	"""
+	variables = ["stop", "level", "root", "result"]
+	statements = ["stop := new Symbol()", "level := stop"]
+	for i in range(depth):
+		statements.append("level := new Level(level)")
+	statements += [
+		"root := new Tree(level, stop, stop)",
+		"result := root.visit()",
+	]
+	return _symbolClass + """
+class Level is begin
+	var below;
+
+	constructor(b) is below := b;
+
+	method below() is return below;
+end;
+
+
+class Tree is begin
+	var parent; var left; var right; var stop;
+
+	constructor(level, s, p) is begin
+		stop := s;
+		parent := p;
+		if level = stop then begin
+			left := stop;
+			right := stop
+		end
+		else begin
+			var below;
+			below := level.below();
+			left := new Tree(below, stop, self);
+			right := new Tree(below, stop, self)
+		end
+	end;
+
+	method visit() is begin
+		var result;
+		if left = stop then return parent else skip;
+		result := left.visit();
+		result := right.visit();
+		return result
+	end;
+end;
+""" + _main(variables, statements)
+
+
+# The corpus as pairs (name, function returning the source code).
+workloads = [
+	("busy-2", lambda: busyBeaver({
+		"A": [(1, "R", "B"), (1, "L", "B")],
+		"B": [(1, "L", "A"), (1, "R", None)],
+	})),
+	("busy-3", lambda: busyBeaver({
+		"A": [(1, "R", "B"), (1, "L", "C")],
+		"B": [(1, "L", "A"), (1, "R", "B")],
+		"C": [(1, "L", "B"), (1, "R", None)],
+	})),
+	("busy-4", lambda: busyBeaver({
+		"A": [(1, "R", "B"), (1, "L", "B")],
+		"B": [(1, "L", "A"), (0, "L", "C")],
+		"C": [(1, "R", None), (1, "L", "D")],
+		"D": [(1, "R", "D"), (0, "R", "A")],
+	})),
+	("loop", lambda: loop(10)),
+	("recursion", lambda: recursion(9)),
+	("wide-objects", lambda: wideObjects(48)),
+	("object-graph", lambda: objectGraph(8)),
+]
+
+workloadNames = [ name for name, source in workloads ]
+
+
+def source(name):
+	"""
+	The source code of the named workload.
+	"""
+	return dict(workloads)[name]()
+
+
+def measure(name, engine="tree", store="dict", parser="pymeta", repeat=3):
+	"""
+	Measure the named workload in this process and return its metrics:
+	the number of steps, the parse and run time in seconds, the steps
+	per second, the peak number of objects in the store, and the peak
+	memory of the process in KiB (None if unknown).  Times are in
+	processor seconds where the platform measures them.  Errors of the
+	parser and the interpreter propagate; run() reports them.
+	"""
+	sourceCode = source(name)
+	parse = parsers[parser][0]
+	# The first parse may build the grammar.
+	program = parse(sourceCode)
+	ScopeResolverVisitor().resolveProgram(program)
+	parseSeconds = min([
+		_averageTime(lambda: parse(sourceCode)) for i in range(repeat)
+	])
+
+	# Sampling the store slows the steps down; the timed runs skip it.
+	interpreter = engines[engine](program, stores[store]())
+	peakStore = len(interpreter._store)
+	while not interpreter.finished():
+		interpreter.step()
+		peakStore = max(peakStore, len(interpreter._store))
+	steps = interpreter.steps()
+
+	def run():
+		interpreter = engines[engine](program, stores[store]())
+		while not interpreter.finished():
+			interpreter.step()
+	runSeconds = min([ _averageTime(run) for i in range(repeat) ])
+	return {
+		"steps": steps,
+		"parseSeconds": parseSeconds,
+		"runSeconds": runSeconds,
+		"stepsPerSecond": runSeconds and steps / runSeconds or None,
+		"peakStore": peakStore,
+		"peakMemory": _peakMemory(),
+	}
+
+
+def _averageTime(function):
+	"""
+	The time of a single call of function.  Parsing or running the small
+	workloads takes a few milliseconds, too short to measure precisely;
+	so the calls repeat until they take long enough together, and the
+	average counts.
+	"""
+	count = 1
+	while True:
+		start = _clock()
+		for i in xrange(count):
+			function()
+		seconds = _clock() - start
+		if seconds >= _minimumTime:
+			return seconds / count
+		count *= 2
+
+
+def _peakMemory():
+	"""
+	The peak resident set size of this process in KiB, or None where
+	the resource module is not available.
+	"""
+	try:
+		import resource
+	except ImportError:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		# Bytes instead of KiB.
+		peak //= 1024
+	return peak
+
+
+def run(names, engine="tree", store="dict", parser="pymeta", repeat=3):
+	"""
+	Measure the named workloads, each in a process of its own, and
+	yield pairs of names and metrics.  Raises a RuntimeError if a
+	workload fails.
+	"""
+	for name in names:
+		child = subprocess.Popen(
+			[ sys.executable, os.path.abspath(__file__),
+				name, engine, store, parser, str(repeat) ],
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE
+		)
+		output, errors = child.communicate()
+		if child.returncode:
+			raise RuntimeError(
+				"Workload '%s' failed: %s" % (name, errors.strip())
+			)
+		yield name, json.loads(output)
+
+
+def compare(baseline, results, tolerance):
+	"""
+	Compare the workloads of results with those of the baseline and
+	return a list of triples (workload, metric, relative change) for
+	every metric that got worse by more than the tolerance, a fraction.
+	A different number of steps always counts, as change None.
+	Workloads that the baseline lacks are skipped.
+	"""
+	regressions = []
+	for name, new in sorted(results.iteritems()):
+		old = baseline.get(name)
+		if old is None:
+			continue
+		if old["steps"] != new["steps"]:
+			regressions.append( (name, "steps", None) )
+		for metric, largerIsBetter in metrics:
+			change = relativeChange(old.get(metric), new.get(metric))
+			if change is None:
+				continue
+			if largerIsBetter:
+				change = -change
+			if change > tolerance:
+				regressions.append( (name, metric, change) )
+	return regressions
+
+
+def confirm(baseline, regressions, tolerance, times, engine="tree",
+		store="dict", parser="pymeta", repeat=3):
+	"""
+	Measure the workloads of the given regressions the given number of
+	times again, and return the regressions that every measurement
+	shows, as compare() does.  Changed numbers of steps need no
+	confirmation.  Raises a RuntimeError if a workload fails.
+	"""
+	for i in range(times):
+		names = sorted(set([
+			name for name, metric, change in regressions
+			if change is not None
+		]))
+		if not names:
+			break
+		again = set([
+			(name, metric)
+			for name, metric, change in compare(
+				baseline, dict(run(names, engine, store, parser, repeat)),
+				tolerance
+			)
+		])
+		regressions = [
+			(name, metric, change)
+			for name, metric, change in regressions
+			if change is None or (name, metric) in again
+		]
+	return regressions
+
+
+def relativeChange(old, new):
+	"""
+	The change from old to new as a fraction of old, or None if either
+	is unknown or old is zero.
+	"""
+	if not old or new is None:
+		return None
+	return float(new - old) / old
+
+
+# ==================
+# Reachability check
+# ==================
+#
+# The Inspector updates the capabilities of watched labels and the objects
+# that reach tracked labels with every changed reference; see the module
+# visitor.reachability.  The check runs a workload, labels objects that the
+# current frame holds as the program goes, and compares the sets with a
+# search from scratch after every step.  The frames that hold labelled
+# objects reach them and are freed when they are popped, and the collector
+# frees garbage that reaches them; so the check covers removed objects as
+# well as changed references.
+
+def checkReachability(name, engine="tree", store="dict", parser="pymeta",
+		labels=8, every=50):
+	"""
+	Run the named workload, labelling one more object every given
+	number of steps up to the given number of labels, and watch and
+	track all labels.  Returns the number of steps and a list of pairs
+	(step, label) for each step after which the capabilities of a
+	label or the objects that reach it differed from a search from
+	scratch.
+	"""
+	program = parsers[parser][0]( source(name) )
+	ScopeResolverVisitor().resolveProgram(program)
+	interpreter = inspectors[engine](program, stores[store]())
+	interpreter.setCollectionPolicy(interval=7)
+	
+	mismatches = []
+	while not interpreter.finished():
+		interpreter.step()
+		count = len(interpreter.labels())
+		if interpreter.steps() % every == 0 and count < labels:
+			_labelHeldObject(interpreter, "l%i" % count)
+		for label in interpreter.staleReachability():
+			mismatches.append( (interpreter.steps(), label) )
+	return interpreter.steps(), mismatches
+
+
+def _labelHeldObject(interpreter, label):
+	"""
+	Label one of the objects that the current frame holds, if any, and
+	watch and track the label.
+	"""
+	frame = interpreter._store[interpreter._fop]
+	variables = sorted([
+		var for var in frame.variables()
+		if not var in (INAME.PREV, INAME.CLASS) and
+			frame.variable(var) is not None
+	])
+	if not variables:
+		return
+	var = variables[ len(interpreter.labels()) % len(variables) ]
+	interpreter.label([ (None, var) ], label)
+	interpreter.watch(label)
+	interpreter.trackReachable(label)
+
+
+if __name__ == "__main__":
+	# Child process of run().
+	name, engine, store, parser, repeat = sys.argv[1:]
+	try:
+		result = measure(name, engine, store, parser, int(repeat))
+	except Exception, e:
+		print >>sys.stderr, "%s: %s" % (e.__class__.__name__, e)
+		sys.exit(1)
+	print json.dumps(result)
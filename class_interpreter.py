@@ -21,20 +21,39 @@
 # Python built-in modules
 import cmd
 import codecs
+import json
 import locale
+import optparse
 import os
 import os.path
 import sys
 import textwrap
+import time
 import traceback
 
+# Start of the imports below; see printStartupTimes().
+_importStart = time.time()
+
 # PyMeta parser framework
 import pymeta.runtime
 
 # Class
-from grammar import classGrammar
+import descent
+import grammarcache
+from grammarcache import defaultCacheDirectory
+from parsecache import ParseCache, parsers
+from incremental import IncrementalParser
 from visitor.pprinter import PrettyPrintVisitor
-from visitor.interpreter import InspectorInterpreterVisitor
+from visitor.resolver import ScopeResolverVisitor
+from visitor.interpreter import InterpreterVisitor, InspectorInterpreterVisitor
+from visitor.interpreter import RULE, RULE_NAMES, INAME
+from visitor.machine import AbstractMachine, InspectorAbstractMachine
+from visitor.evaluator import BigStepEvaluator, InspectorBigStepEvaluator
+from visitor.store import DictStore, ArrayStore
+from visitor.recorder import TraceWriter, Replay
+from visitor.recorder import RecordingInterpreterVisitor, RecordingAbstractMachine
+
+_importTime = time.time() - _importStart
 
 
 class ClassInterpreterCmd(cmd.Cmd):
@@ -57,10 +76,57 @@ class ClassInterpreterCmd(cmd.Cmd):
 		depthSwitch		::= <switch 'd' 'depth'> <posint>:d <reqspaces>	=> d
 		pathList		::= <objpath>:phead (<reqspaces> <objpath>)*:ptail	=> [phead] + ptail
 		inspectArgs		::= <depthSwitch>?:depth <pathList>:paths => (paths, depth)
+		holdersArgs		::= <depthSwitch>?:depth <objpath>:path => (path, depth)
+		programArgs		::= <switch 'c' 'context'> <posint>
+					  | <end>				=> None
+		engineArgs		::= <label>?
+		parserArgs		::= <label>?
+		storeArgs		::= <label>?
+		gcPolicy		::= <token 'every'> <posint>:n		=> ("every", n)
+					  | <token 'threshold'> <posint>:n	=> ("threshold", n)
+					  | <token 'pop'>			=> ("pop", None)
+					  | <token 'off'>			=> ("off", None)
+					  | <token 'stats'>			=> ("stats", None)
+		gcArgs			::= <gcPolicy>?
+		untilCond		::= <token 'call'> <label>:m		=> ("call", m)
+					  | <token 'new'> <label>:c		=> ("new", c)
+					  | <token 'rule'> <label>:r		=> ("rule", r)
+					  | <token 'reachable'> <label>:l	=> ("reachable", l)
+					  | <token 'capability'>		=> ("capability", None)
+					  | <token 'step'> <posint>:n		=> ("step", n)
+					  | <token 'store'> <posint>:n		=> ("store", n)
+		untilConds		::= <untilCond>:chead (<token 'or'> <untilCond>)*:ctail	=> [chead] + ctail
+		runArgs			::= <token 'until'> <untilConds> | <end> => None
+		gotoArgs		::= <posint>
+		backArgs		::= <posint>?
+		checkpointPolicy	::= <token 'every'> <posint>:n		=> n
+					  | <token 'off'>			=> 0
+		checkpointArgs		::= <checkpointPolicy>?
+		statsCommand		::= <token 'on'>			=> ("on", None)
+					  | <token 'off'>			=> ("off", None)
+					  | <token 'reset'>			=> ("reset", None)
+					  | <token 'json'> <reqspaces> <anything>+:f	=> ("json", "".join(f))
+		statsArgs		::= <statsCommand>?
+		capabilitiesArgs	::= <token 'off'>			=> None
+					  | <label>*
 		""",
-		globals()
+		globals(),
+		name="Arguments"
 	)
 	
+	# Execution engines selectable with the 'engine' command.  All take
+	# the program to run as sole argument and provide the same interface.
+	_engines = {
+		"tree": InspectorInterpreterVisitor,
+		"vm": InspectorAbstractMachine,
+	}
+	
+	# Store implementations selectable with the 'store' command.
+	_stores = {
+		"dict": DictStore,
+		"array": ArrayStore,
+	}
+	
 	intro =	"\n" \
 		"Welcome to the Class Interpreter\n" \
 		"================================\n" \
@@ -68,11 +134,29 @@ class ClassInterpreterCmd(cmd.Cmd):
 		"Type 'help' to see a list of available commands.\n"
 
 	
-	def __init__(self):
+	def __init__(self, startupTimes=False):
 		cmd.Cmd.__init__(self)
 		self.prompt = "Class Interpreter> "
+		self._startupTimes = startupTimes
 		self._AST = None
 		self._interpreter = None
+		self._engine = "tree"
+		self._storeType = "dict"
+		# Collection interval, threshold and reclamation of popped
+		# frames; see do_gc().
+		self._collectionPolicy = (None, None, True)
+		# Steps between checkpoints; see do_checkpoint().
+		self._checkpointInterval = 1000
+		# Whether engines keep rule statistics; see do_stats().
+		self._statistics = False
+		# Number of capability events shown so far; see
+		# _reportCapabilities().
+		self._reportedEvents = 0
+		self._parseCache = ParseCache( defaultCacheDirectory() )
+		# The file loaded last and the previous version of its
+		# program; see do_reload().
+		self._fileName = None
+		self._incrementalParser = IncrementalParser()
 		self.__outputBuffer = []
 		
 		try:
@@ -85,6 +169,11 @@ class ClassInterpreterCmd(cmd.Cmd):
 			pass
 
 
+	def preloop(self):
+		if self._startupTimes:
+			printStartupTimes()
+	
+	
 	# ====================
 	# Interpreter Commands
 	# ====================
@@ -103,7 +192,8 @@ class ClassInterpreterCmd(cmd.Cmd):
 		try:
 			fileName = args.split()[0]
 			file = codecs.open(fileName, "r", locale.getpreferredencoding())
-			self._load(file)
+			if self._load(file):
+				self._fileName = fileName
 		
 		except IOError, e:
 			self._printError(
@@ -111,19 +201,76 @@ class ClassInterpreterCmd(cmd.Cmd):
 			)
 	
 	
+	def do_reload(self, args):
+		"""
+		Load the program file loaded last again, reparsing only the
+		class declarations that changed.
+		"""
+		if args.strip():
+			self._help_reloadSyntax()
+			return
+		if not self._fileName:
+			self._printWarning(
+				"Please load a program first (using 'load')."
+			)
+			return
+		
+		try:
+			file = codecs.open(
+				self._fileName, "r", locale.getpreferredencoding()
+			)
+			self._reload(file)
+		
+		except IOError, e:
+			self._printError(
+				"Could not open file '%s'. %s." % (self._fileName, e.args[1])
+			)
+	
+	
 	def do_program(self, args):
 		"""
-		Pretty print current configuration's program.
+		Pretty print current configuration's program, or the part of
+		it around the redex.
 		"""
+		try:
+			context = self.__parseArgs(args, "programArgs")
+		except ValueError:
+			self._help_programSyntax()
+			return
+		
 		if not self._AST:
 			self._printWarning(
 				"Please load a program first (using 'load')."
 			)
 			return
 		
-		ppv = PrettyPrintVisitor()
-		self._AST.accept(ppv)
-		self.stdout.write( "\n%s\n" % ppv )
+		statement = self._AST
+		path = [statement]
+		if self._interpreter:
+			if self._interpreter.finished():
+				self._finished()
+				return
+			
+			statement = self._interpreter.statement()
+			if not statement:
+				self._printWarning(
+					"The current engine does not keep the "
+					"program as a tree of constructs; use "
+					"engine 'tree' for printing the current "
+					"statement."
+				)
+				return
+			path = self._interpreter.redexPath()
+		
+		# The printer writes while it traverses the program; big
+		# programs never exist as a single string.
+		focus = None
+		if context is not None:
+			focus = path[-context-1:]
+			statement = focus[0]
+		self.stdout.write("\n")
+		statement.accept( PrettyPrintVisitor(self.stdout, focus) )
+		self.stdout.write("\n")
 
 
 	def do_step(self, args):
@@ -149,6 +296,184 @@ class ClassInterpreterCmd(cmd.Cmd):
 			self._help_stepSyntax()
 
 
+	def do_run(self, args):
+		"""
+		Execute the currently loaded program to its end.
+		
+		This method does input sanitation only; method _run() performs
+		the actual work.
+		"""
+		if not self._AST:
+			self._printWarning(
+				"Please load a program first (using 'load')."
+			)
+			return
+		
+		try:
+			conditions = self.__parseArgs(args, "runArgs")
+		except ValueError:
+			self._help_runSyntax()
+			return
+		
+		if conditions:
+			self._runUntil(conditions)
+		else:
+			self._run()
+
+
+	def do_goto(self, args):
+		"""
+		Return or advance the program to the given step.
+		
+		This method does input sanitation only; method _goto() performs
+		the actual work.
+		"""
+		if not self._AST:
+			self._printWarning(
+				"Please load a program first (using 'load')."
+			)
+			return
+		
+		try:
+			self._goto( self.__parseArgs(args, "gotoArgs") )
+		except ValueError:
+			self._help_gotoSyntax()
+
+
+	def do_back(self, args):
+		"""
+		Return the program by one or more steps.
+		"""
+		if not self._interpreter:
+			self._printWarning(
+				"Program execution has not started, yet. Please "
+				"use the 'step' command to execute the program."
+			)
+			return
+		
+		try:
+			steps = self.__parseArgs(args, "backArgs")
+			if steps is None: steps = 1
+			
+			self._goto( max(0, self._interpreter.steps() - steps) )
+		
+		except ValueError:
+			self._help_backSyntax()
+
+
+	def do_checkpoint(self, args):
+		"""
+		Configure how often checkpoints are taken, or list them.
+		"""
+		try:
+			interval = self.__parseArgs(args, "checkpointArgs")
+		except ValueError:
+			self._help_checkpointSyntax()
+			return
+		
+		if interval is not None:
+			self._checkpointInterval = interval or None
+			if self._interpreter:
+				self._interpreter.setCheckpointInterval(
+					self._checkpointInterval
+				)
+		
+		if self._checkpointInterval:
+			self._print(
+				"Taking a checkpoint every %i steps." %
+				self._checkpointInterval
+			)
+		else:
+			self._print("Checkpoints are off.")
+		
+		if self._interpreter and self._interpreter.checkpoints():
+			checkpoints = self._interpreter.checkpoints()
+			self._print(
+				"Checkpoints: %i, the latest at step %i." %
+				(len(checkpoints), checkpoints[-1])
+			)
+
+
+	def do_stats(self, args):
+		"""
+		Switch the rule statistics on or off, or show them.
+		"""
+		try:
+			command = self.__parseArgs(args, "statsArgs")
+		except ValueError:
+			self._help_statsSyntax()
+			return
+		
+		if command:
+			command, fileName = command
+			if command in ("on", "off", "reset"):
+				enabled = command != "off"
+				changed = enabled != self._statistics or command == "reset"
+				self._statistics = enabled
+				if self._interpreter and changed:
+					self._interpreter.setStatistics(enabled)
+				self._print(
+					"Statistics are %s." % (self._statistics and "on" or "off")
+				)
+				return
+		
+		statistics = self._interpreter and self._interpreter.statistics()
+		if not statistics:
+			self._printWarning(
+				"There are no statistics. Please switch them on "
+				"(using 'stats on') and execute the program."
+			)
+			return
+		
+		if command == "json":
+			try:
+				file = open(fileName, "w")
+				try:
+					json.dump(statistics, file, indent=2, sort_keys=True)
+				finally:
+					file.close()
+			except IOError, e:
+				self._printError(
+					"Could not write file '%s'. %s." % (fileName, e.args[1])
+				)
+			return
+		
+		for line in formatStatistics(statistics):
+			self._print(line)
+
+
+	def do_capabilities(self, args):
+		"""
+		Watch labelled objects for capabilities they gain, or show the
+		capabilities of the watched objects.
+		"""
+		if not self._interpreter:
+			self._printWarning(
+				"Program execution has not started, yet---the "
+				"memory is empty. Please use the 'step' command "
+				"to execute the program."
+			)
+			return
+		
+		try:
+			names = self.__parseArgs(args, "capabilitiesArgs")
+		except ValueError:
+			self._help_capabilitiesSyntax()
+			return
+		
+		if names is None:
+			for name in self._interpreter.watched():
+				self._interpreter.unwatch(name)
+		else:
+			for name in names:
+				try:
+					self._interpreter.watch(name)
+				except KeyError, e:
+					self._printWarning(e.message)
+		
+		self._capabilities()
+
+
 	def do_inspect(self, args):
 		"""
 		Inspect objects in the store.
@@ -175,6 +500,33 @@ class ClassInterpreterCmd(cmd.Cmd):
 			self._help_inspectSyntax()
 	
 	
+	def do_holders(self, args):
+		"""
+		List the objects that refer to an object, and the paths to it.
+		
+		This method does input sanitation only; method _holders()
+		performs the actual work.
+		"""
+		if not self._interpreter:
+			self._printWarning(
+				"Program execution has not started, yet---the "
+				"memory is empty. Please use the 'step' command "
+				"to execute the program."
+			)
+			return
+		
+		if not args.strip():
+			self._help_holdersSyntax()
+			return
+		
+		try:
+			path, depth = self.__parseArgs(args, "holdersArgs")
+			self._holders(path, depth or 5)
+		
+		except ValueError:
+			self._help_holdersSyntax()
+	
+	
 	def do_label(self, args):
 		"""
 		Assign a label to an object path.
@@ -215,6 +567,142 @@ class ClassInterpreterCmd(cmd.Cmd):
 			self._help_unlabelSyntax()
 
 	
+	def do_engine(self, args):
+		"""
+		Show or select the execution engine.
+		"""
+		try:
+			engine = self.__parseArgs(args, "engineArgs")
+			if not engine:
+				self._print("Current engine: '%s'." % self._engine)
+				return
+			
+			if not engine in self._engines:
+				self._printError("Unknown engine '%s'." % engine)
+				self._help_engineSyntax()
+				return
+			
+			self._engine = engine
+			if self._interpreter:
+				self._print(
+					"The new engine takes effect when the next "
+					"program is loaded."
+				)
+		
+		except ValueError:
+			self._help_engineSyntax()
+
+	
+	def do_parser(self, args):
+		"""
+		Show or select the parser.
+		"""
+		try:
+			parser = self.__parseArgs(args, "parserArgs")
+			if not parser:
+				self._print(
+					"Current parser: '%s'." % self._parseCache.parser()
+				)
+				return
+			
+			if not parser in parsers:
+				self._printError("Unknown parser '%s'." % parser)
+				self._help_parserSyntax()
+				return
+			
+			self._parseCache = ParseCache(
+				self._parseCache.directory(), parser
+			)
+		
+		except ValueError:
+			self._help_parserSyntax()
+
+	
+	def do_store(self, args):
+		"""
+		Show or select the store implementation, or compact the store.
+		"""
+		try:
+			storeType = self.__parseArgs(args, "storeArgs")
+			if not storeType:
+				self._print("Current store: '%s'." % self._storeType)
+				return
+			
+			if storeType == "compact":
+				if not self._interpreter:
+					self._printError("The program did not start yet.")
+					return
+				renamed = self._interpreter.compact()
+				self._print(
+					"Compacted the store: %i objects, %i renamed "
+					"references." % (len(self._interpreter._store), renamed)
+				)
+				return
+			
+			if not storeType in self._stores:
+				self._printError("Unknown store '%s'." % storeType)
+				self._help_storeSyntax()
+				return
+			
+			self._storeType = storeType
+			if self._interpreter:
+				self._print(
+					"The new store takes effect when the next "
+					"program is loaded."
+				)
+		
+		except ValueError:
+			self._help_storeSyntax()
+
+	
+	def do_gc(self, args):
+		"""
+		Run the garbage collector, or configure when it runs.
+		"""
+		try:
+			policy = self.__parseArgs(args, "gcArgs")
+		except ValueError:
+			self._help_gcSyntax()
+			return
+		
+		interval, threshold, reclaimFrames = self._collectionPolicy
+		if policy:
+			command, value = policy
+			if command == "every":
+				interval = value
+			elif command == "threshold":
+				threshold = value
+			elif command == "pop":
+				reclaimFrames = True
+			elif command == "off":
+				interval, threshold, reclaimFrames = None, None, False
+			else:
+				self._gcStatistics()
+				return
+			
+			self._collectionPolicy = (interval, threshold, reclaimFrames)
+			if self._interpreter:
+				self._interpreter.setCollectionPolicy(
+					*self._collectionPolicy
+				)
+			self._printCollectionPolicy()
+			return
+		
+		if not self._interpreter:
+			self._printWarning(
+				"Program execution has not started, yet---the "
+				"memory is empty. Please use the 'step' command "
+				"to execute the program."
+			)
+			return
+		
+		freed, pause = self._interpreter.collect()
+		self._print(
+			"Freed %i objects in %.3f ms; the store holds %i objects." %
+			(freed, 1000 * pause, len(self._interpreter._store))
+		)
+
+	
 	def do_EOF(self, args):
 		"""
 		Exit interpreter shell.  See do_exit().
@@ -254,68 +742,434 @@ class ClassInterpreterCmd(cmd.Cmd):
 	
 	def _load(self, file):
 		"""
-		Load and parse a program from the given file object.
+		Load and parse a program from the given file object.  Returns
+		whether the program could be parsed.
 		"""
 		try:
 			sourceCode = file.read().expandtabs()
 			
-			parser = classGrammar(sourceCode)
-			self._AST = parser.apply("prog")
+			self._AST = self._parseCache.parse(sourceCode)
 			self._interpreter = None
+			self._incrementalParser.remember(
+				sourceCode, self._AST, self._parseCache.classSpans
+			)
 		
-		except pymeta.runtime.ParseError:
-			pos = parser.input.position
-			lineStart = sourceCode.rfind("\n", 0, pos) + 1
-			lineText = sourceCode[lineStart:].splitlines()[0]
-			lineNr = max(len( sourceCode[:pos].splitlines() ), 1)
-			columnNr = pos - lineStart + 1
+		except pymeta.runtime.ParseError, e:
+			self._printParseError(sourceCode, e)
+			return False
+		
+		self._resolve(self._AST.classDeclarations, self._AST.initialStatement)
+		return True
+	
+	
+	def _reload(self, file):
+		"""
+		Parse a new version of the current program from the given file
+		object.  Class declarations that did not change keep their
+		constructs.  The interpreter keeps its state if the program did
+		not change at all; otherwise the program starts over.
+		"""
+		try:
+			sourceCode = file.read().expandtabs()
 			
-			self._printError(
-				"Error parsing line %i, character %i:" %
-				(lineNr, columnNr)
-			)
-			self._print( ">>> %s" % lineText )
-			self._print( "    %s" % ((columnNr - 1) * " " + "^") )
+			program = self._incrementalParser.reparse(sourceCode)
+		
+		except pymeta.runtime.ParseError, e:
+			self._printParseError(sourceCode, e)
+			return
+		
+		parser = self._incrementalParser
+		if program is self._AST:
+			self._print("The program did not change.")
+			return
+		
+		self._AST = program
+		self._print(
+			"Reparsed %i and kept %i class declarations." %
+			(parser.reparsed, parser.reused)
+		)
+		# The kept constructs are resolved already.
+		self._resolve(parser.parsedClasses, parser.parsedInitialStatement)
+		if self._interpreter:
+			self._interpreter = None
+			self._print("The program starts over with the next step.")
+	
+	
+	def _resolve(self, classDeclarations, initialStatement=None):
+		"""
+		Resolve the variables of the given class declarations and, unless
+		it is None, the initial statement, and warn about those that are
+		undefined where they are used.
+		"""
+		problems = ScopeResolverVisitor().resolveParts(
+			classDeclarations, initialStatement
+		)
+		for problem in problems:
+			self._printWarning(problem)
+	
+	
+	def _printParseError(self, sourceCode, error):
+		message, lineText, marker = \
+			self._describeParseError(sourceCode, error)
+		self._printError(message)
+		self._print( ">>> %s" % lineText )
+		self._print( "    %s" % marker )
 	
 	
-	def _step(self, steps=1):
+	@staticmethod
+	def _describeParseError(sourceCode, error):
+		"""
+		Returns the error message, the offending line and a marker
+		line that points to the position of the given ParseError.
+		The message includes what the parser expected if the parser
+		says so.
+		"""
+		pos = error.position
+		lineStart = sourceCode.rfind("\n", 0, pos) + 1
+		lineText = (sourceCode[lineStart:].splitlines() or [""])[0]
+		lineNr = max(len( sourceCode[:pos].splitlines() ), 1)
+		columnNr = pos - lineStart + 1
+		
+		reason = ""
+		if len(error.args) > 1 and isinstance(error.args[1], basestring):
+			reason = " %s" % error.args[1]
+		
+		return (
+			"Error parsing line %i, character %i:%s" % (lineNr, columnNr, reason),
+			lineText,
+			(columnNr - 1) * " " + "^"
+		)
+	
+	
+	def _step(self, steps=1, conditions=()):
 		"""
-		Execute the currently loaded program one or more steps.
+		Execute the currently loaded program one or more steps.  If
+		steps is None, execute it until it finished.  Execution stops
+		early after the first step that meets one of the conditions; see
+		_untilConditions().
 		"""
 		if not self._interpreter:
-			# self.__replaceAsRoot is the callback function for the
-			# visitor that it to replace the AST's root node.
-			self._interpreter = InspectorInterpreterVisitor(
-				self.__replaceAstRoot
-			)
+			self._startEngine()
 		
+		i = 0
 		try:
-			for i in range(0, steps):
-				if not self._AST:
-					self._finished(i)
+			while steps is None or i < steps:
+				if self._interpreter.finished():
+					self._finished()
 					return
-				self._AST.accept(self._interpreter)
+				self._interpreter.step()
+				i += 1
+				self._reportCapabilities()
+				
+				for condition in conditions:
+					reason = condition()
+					if reason:
+						self._print(
+							"Stopped after step %i: %s." %
+							(self._interpreter.steps(), reason)
+						)
+						return
 			
-			if not self._AST:
+			if self._interpreter.finished():
 				self._finished()
 		
 		except AttributeError, e:
 			self._printError(
-				"A runtime error occured in step number %i."  % (i+1)
+				"A runtime error occured in step number %i."  %
+				(self._interpreter.steps() + 1)
 			)
 			self._print(">>> %s" % e.message)
 		except LookupError, e:
 			self._printError(
-				"A runtime error occured in step number %i."  % (i+1)
+				"A runtime error occured in step number %i."  %
+				(self._interpreter.steps() + 1)
 			)
 			self._print(">>> %s" % e.message)
 		except NameError, e:
 			self._printError(
-				"A runtime error occured in step number %i."  % (i+1)
+				"A runtime error occured in step number %i."  %
+				(self._interpreter.steps() + 1)
 			)
 			self._print(">>> %s" % e.message)
 
 	
+	def _startEngine(self):
+		"""
+		Create the current engine for the loaded program.
+		"""
+		self._interpreter = self._engines[self._engine](
+			self._AST,
+			self._stores[self._storeType]()
+		)
+		self._interpreter.setCollectionPolicy(*self._collectionPolicy)
+		self._interpreter.setCheckpointInterval(self._checkpointInterval)
+		self._interpreter.setStatistics(self._statistics)
+		self._reportedEvents = 0
+	
+	
+	def _goto(self, step):
+		"""
+		Bring the program to the given step.  Execution continues from
+		the latest checkpoint before the step if the program is past the
+		step or the checkpoint is ahead of the program; without such a
+		checkpoint, the program starts over.
+		"""
+		if not self._interpreter:
+			self._startEngine()
+		
+		current = self._interpreter.steps()
+		checkpoints = [ c for c in self._interpreter.checkpoints() if c <= step ]
+		if step < current and not checkpoints:
+			# The big-step evaluator and engines without checkpoints
+			# can only start over.
+			self._startEngine()
+			self._print("Restarted the program.")
+		elif step < current or (checkpoints and checkpoints[-1] > current):
+			restored = self._interpreter.restore(step)
+			self._print("Restored the checkpoint at step %i." % restored)
+			# Capabilities that appeared later are forgotten.
+			self._reportedEvents = min(
+				self._reportedEvents,
+				len(self._interpreter.capabilityEvents())
+			)
+		
+		if step > self._interpreter.steps():
+			self._step( step - self._interpreter.steps() )
+		self._print(
+			"The program is at step %i." % self._interpreter.steps()
+		)
+	
+	
+	def _run(self):
+		"""
+		Execute the currently loaded program to its end.  Programs that
+		did not start yet are evaluated in a single big step; otherwise,
+		the current engine continues step by step.
+		"""
+		if self._interpreter or self._statistics:
+			# The big step would count as a single firing.
+			self._step(None)
+			return
+		
+		self._interpreter = InspectorBigStepEvaluator(
+			self._AST,
+			self._stores[self._storeType]()
+		)
+		self._interpreter.setCollectionPolicy(*self._collectionPolicy)
+		self._reportedEvents = 0
+		
+		try:
+			self._interpreter.step()
+			self._finished()
+		
+		except (AttributeError, LookupError, NameError), e:
+			self._printError(
+				"A runtime error occured in step number %i." %
+				(self._interpreter.steps() + 1)
+			)
+			self._print(">>> %s" % e.message)
+		except RuntimeError, e:
+			self._printError(
+				"The program nests method calls too deeply for "
+				"evaluating it in a single big step. Please load "
+				"it again and use 'step' instead."
+			)
+	
+	
+	def _runUntil(self, conditions):
+		"""
+		Execute the currently loaded program step by step until one of
+		the conditions holds or the program finished.
+		"""
+		if not self._interpreter:
+			self._startEngine()
+		
+		labels = [ arg for kind, arg in conditions if kind == "reachable" ]
+		try:
+			try:
+				conditions = self._untilConditions(conditions)
+			except ValueError, e:
+				self._printWarning(e.message)
+				return
+			
+			self._step(None, conditions)
+		finally:
+			for label in labels:
+				self._interpreter.untrackReachable(label)
+	
+	
+	def _untilConditions(self, conditions):
+		"""
+		Translate the parsed conditions of 'run until' into functions
+		that the step loop calls after each step.  A function returns
+		a description of the event if its condition holds, and None
+		otherwise.  Raises a ValueError for conditions that can never
+		hold.
+		"""
+		interpreter = self._interpreter
+		rules = dict([ (name, rule) for rule, name in RULE_NAMES.iteritems() ])
+		
+		def entered(kind, rule, name):
+			def condition():
+				if interpreter._fired == (rule, name):
+					return "entered %s '%s'" % (kind, name)
+			return condition
+		
+		def fired(name):
+			rule = rules[name]
+			def condition():
+				if interpreter._fired and interpreter._fired[0] == rule:
+					return "rule [%s] fired" % name
+			return condition
+		
+		def reached(label):
+			# The interpreter keeps the objects that reach the label
+			# up to date; see _runUntil().
+			interpreter.trackReachable(label)
+			# A list, so that condition() can update it.
+			wasReachable = [ interpreter.reachable(label) ]
+			def condition():
+				isReachable = interpreter.reachable(label)
+				becameReachable = isReachable and not wasReachable[0]
+				wasReachable[0] = isReachable
+				if becameReachable:
+					return "label '%s' became reachable" % label
+			return condition
+		
+		def gained():
+			# Events are numbered by their position in the list.
+			seen = [ len(interpreter.capabilityEvents()) ]
+			def condition():
+				events = interpreter.capabilityEvents(seen[0])
+				seen[0] += len(events)
+				if events:
+					step, source, target = events[-1]
+					return "label '%s' can reach label '%s'" % (source, target)
+			return condition
+		
+		def stepped(n):
+			def condition():
+				if interpreter.steps() >= n:
+					return "reached step %i" % n
+			return condition
+		
+		def grew(n):
+			def condition():
+				if len(interpreter._store) > n:
+					return "the store holds %i objects" % len(interpreter._store)
+			return condition
+		
+		functions = []
+		for kind, arg in conditions:
+			if kind == "call":
+				functions.append( entered("method", RULE.CALL, arg) )
+			elif kind == "new":
+				functions.append( entered("constructor of", RULE.NEW, arg) )
+			elif kind == "rule":
+				if not arg.lower() in rules:
+					raise ValueError(
+						"Unknown rule '%s'; rules are %s." %
+						(arg, ", ".join(sorted(rules)))
+					)
+				functions.append( fired(arg.lower()) )
+			elif kind == "reachable":
+				if not arg in interpreter.labels():
+					raise ValueError("Label '%s' does not exist." % arg)
+				functions.append( reached(arg) )
+			elif kind == "capability":
+				if not interpreter.watched():
+					raise ValueError(
+						"No labels are watched; see 'capabilities'."
+					)
+				functions.append( gained() )
+			elif kind == "step":
+				if interpreter.steps() >= arg:
+					raise ValueError(
+						"The program executed %i steps already." %
+						interpreter.steps()
+					)
+				functions.append( stepped(arg) )
+			elif kind == "store":
+				functions.append( grew(arg) )
+		return functions
+	
+	
+	def _reportCapabilities(self):
+		"""
+		Print the capabilities that watched objects gained since the
+		last report.
+		"""
+		events = self._interpreter.capabilityEvents(self._reportedEvents)
+		self._reportedEvents += len(events)
+		for step, source, target in events:
+			self._print(
+				"Step %i: label '%s' can now reach label '%s'." %
+				(step, source, target)
+			)
+	
+	
+	def _capabilities(self):
+		"""
+		Print the watched labels, their capabilities, and when the
+		capabilities appeared.
+		"""
+		watched = sorted(self._interpreter.watched())
+		if not watched:
+			self._print("No labels are watched.")
+			return
+		
+		self._print("Watched labels: %s" % ", ".join(watched))
+		capabilities = sorted(self._interpreter.capabilities())
+		if capabilities:
+			self._print("Current capabilities:")
+			for source, target in capabilities:
+				self._print("    %s  reaches  %s" % (source, target))
+		else:
+			self._print("No watched label reaches another one.")
+		
+		events = self._interpreter.capabilityEvents()
+		if events:
+			self._print("Capabilities gained:")
+			for step, source, target in events:
+				self._print(
+					"    step %i: %s  reaches  %s" % (step, source, target)
+				)
+	
+	
+	def _gcStatistics(self):
+		"""
+		Print the collection policy and the garbage collector's
+		statistics for the current program.
+		"""
+		self._printCollectionPolicy()
+		if not self._interpreter:
+			return
+		
+		collections, freed, totalPause, maximumPause, reclaimed = \
+			self._interpreter.collectionStatistics()
+		self._print("Reclaimed on pop:      %i" % reclaimed)
+		self._print("Collections:           %i" % collections)
+		self._print("Freed objects:         %i" % freed)
+		self._print("Total pause:           %.3f ms" % (1000 * totalPause))
+		self._print("Maximum pause:         %.3f ms" % (1000 * maximumPause))
+		self._print("Objects in store:      %i" % len(self._interpreter._store))
+	
+	
+	def _printCollectionPolicy(self):
+		interval, threshold, reclaimFrames = self._collectionPolicy
+		if not (interval or threshold or reclaimFrames):
+			self._print("Automatic garbage collection is off.")
+		if reclaimFrames:
+			self._print("Reclaiming frames when they are popped.")
+		if interval:
+			self._print("Collecting garbage every %i steps." % interval)
+		if threshold:
+			self._print(
+				"Collecting garbage when the store holds more "
+				"than %i objects." % threshold
+			)
+	
+	
 	def _inspect(self, paths, depth=0):
 		"""
 		Print objects from the store.
@@ -345,19 +1199,51 @@ class ClassInterpreterCmd(cmd.Cmd):
 				self._print( ">>> %s" % msg )
 	
 	
-	def _finished(self, step=0):
+	def _holders(self, path, depth):
+		"""
+		Print the holders of the object at the given path and the
+		paths of at most the given length that lead to it.
+		"""
+		try:
+			holders = self._interpreter.holders(path)
+			paths = self._interpreter.paths(path, depth)
+		except (KeyError, ValueError), e:
+			self._printWarning("Some errors occured.")
+			self._print( ">>> %s" % e.message )
+			return
+		
+		if holders:
+			width = max([ len(name) for name, var in holders ])
+			holders.sort()
+			for name, var in holders:
+				self._print( "%s  holds it in  %s" % (name.ljust(width), var) )
+		else:
+			self._print("No object holds a reference to it.")
+		
+		self._print()
+		if paths:
+			self._print(
+				"Paths with at most %i segments from the current "
+				"frame or labels:" % depth
+			)
+			for p in paths:
+				self._print("    %s" % p)
+		else:
+			self._print(
+				"There is no path with at most %i segments from "
+				"the current frame or labels." % depth
+			)
+	
+	
+	def _finished(self):
 		"""
-		Notify the user that the program finished execution.
+		Notify the user that the program finished execution, and after
+		how many steps from its start.
 		"""
-		if step > 1:
-			msg = "The program finished execution after %i steps." % (step+1)
-		else:
-			msg = "The program finished execution."
-			
 		self._print(
-			msg +
-			" Memory contents remain available for inspection until "
-			"a new program is loaded."
+			"The program finished execution after %i steps. "
+			"Memory contents remain available for inspection until "
+			"a new program is loaded." % self._interpreter.steps()
 		)
 	
 	
@@ -393,6 +1279,10 @@ class ClassInterpreterCmd(cmd.Cmd):
 		return self.__completeObjPath(text, line, begidx, endidx)
 	
 	
+	def complete_holders(self, text, line, begidx, endidx):
+		return self.__completeObjPath(text, line, begidx, endidx)
+	
+	
 	def complete_label(self, text, line, begidx, endidx):
 		if len(line.split()) > 2:
 			return []
@@ -505,9 +1395,26 @@ class ClassInterpreterCmd(cmd.Cmd):
 		)
 	
 	
+	def _help_reloadSyntax(self):
+		self._print(
+			"SYNTAX:    reload"
+		)
+
+	def help_reload(self):
+		self._help_reloadSyntax()
+		self._print()
+		self._print(
+			"Loads the file loaded last with 'load' again. Only the "
+			"class declarations that changed since the previous "
+			"version are parsed anew, with the 'descent' parser; the "
+			"others keep their constructs and resolved variables. If "
+			"the program changed, it starts over with the next step."
+		)
+	
+	
 	def _help_programSyntax(self):
 		self._print(
-			"SYNTAX:    program"
+			"SYNTAX:    program [--context <number of constructs>]"
 		)
 
 	def help_program(self):
@@ -518,6 +1425,14 @@ class ClassInterpreterCmd(cmd.Cmd):
 			"The code reflects all transformations that were "
 			"applied during the execution up to this point."
 		)
+		self._print()
+		self._print(
+			"With --context (or -c), the command prints only the "
+			"current redex and the given number of constructs that "
+			"enclose it. Statements and class declarations beside "
+			"the path to the redex show as '...', so the output stays "
+			"short even for big configurations."
+		)
 	
 	
 	def _help_stepSyntax(self):
@@ -535,6 +1450,133 @@ class ClassInterpreterCmd(cmd.Cmd):
 		)
 		
 	
+	def _help_runSyntax(self):
+		self._print(
+			"SYNTAX:    run [until <condition> [or <condition> ...]]"
+		)
+	
+	def help_run(self):
+		self._help_runSyntax()
+		self._print()
+		self._print(
+			"Executes the loaded program to its end. If the program "
+			"did not start yet, it is evaluated in a single big step "
+			"without building intermediate statements, which is much "
+			"faster than stepping. The final store and the number of "
+			"steps reported are the same as with 'step'."
+		)
+		self._print()
+		self._print(
+			"If the program already started, the current engine "
+			"executes the remaining steps."
+		)
+		self._print()
+		self._print(
+			"With 'until', the current engine executes the program "
+			"step by step and stops after the first step that meets "
+			"one of the conditions:"
+		)
+		self._print()
+		self._print("    call <method>      a call enters the method")
+		self._print("    new <class>        a constructor of the class starts")
+		self._print("    rule <rule>        the transition rule fires, for")
+		self._print("                       example 'while' or 'if2'")
+		self._print("    reachable <label>  the labelled object becomes")
+		self._print("                       reachable from the current frame")
+		self._print("    capability         a watched label gains a capability;")
+		self._print("                       see 'capabilities'")
+		self._print("    step <number>      the program executed that many steps")
+		self._print("    store <number>     the store holds more objects")
+		self._print()
+		self._print(
+			"The message names the step number, counted from the "
+			"start of the program, and the condition that held."
+		)
+		
+	
+	def _help_gotoSyntax(self):
+		self._print(
+			"SYNTAX:    goto <step>"
+		)
+	
+	def help_goto(self):
+		self._help_gotoSyntax()
+		self._print()
+		self._print(
+			"Brings the loaded program to the configuration after "
+			"<step> steps, counted from its start. Going back "
+			"restores the latest checkpoint before <step> and "
+			"executes the remaining steps; see 'checkpoint'. Labels "
+			"are restored along with the configuration."
+		)
+		
+	
+	def _help_backSyntax(self):
+		self._print(
+			"SYNTAX:    back [<number of steps>]"
+		)
+	
+	def help_back(self):
+		self._help_backSyntax()
+		self._print()
+		self._print(
+			"Returns the loaded program by <number of steps> steps, "
+			"or by one step if the argument is omitted. The command "
+			"works like 'goto'."
+		)
+		
+	
+	def _help_checkpointSyntax(self):
+		self._print(
+			"SYNTAX:    checkpoint [every <number of steps> | off]"
+		)
+	
+	def help_checkpoint(self):
+		self._help_checkpointSyntax()
+		self._print()
+		self._print(
+			"Without argument, the command shows how often "
+			"checkpoints are taken and which exist. A checkpoint "
+			"saves the program's configuration, including the store "
+			"and labels, so that 'goto' and 'back' execute at most "
+			"<number of steps> steps. Checkpoints share all objects "
+			"and parts of the store that did not change since, so "
+			"they take little memory and time. "
+			"By default, there is a checkpoint every 1000 steps."
+		)
+		self._print()
+		self._print(
+			"The argument 'off' disables checkpoints and discards "
+			"the existing ones; 'goto' and 'back' then execute the "
+			"program from its start."
+		)
+		
+	
+	def _help_capabilitiesSyntax(self):
+		self._print(
+			"SYNTAX:    capabilities [<label> ... | off]"
+		)
+	
+	def help_capabilities(self):
+		self._help_capabilitiesSyntax()
+		self._print()
+		self._print(
+			"Watches the objects with the given labels. An object "
+			"holds a capability for another object if a chain of "
+			"member variables leads to it. While the program runs, "
+			"the interpreter reports the step in which a watched "
+			"object gains a capability for another watched object. "
+			"It updates the capabilities along with each changed "
+			"reference, so watching costs little time."
+		)
+		self._print()
+		self._print(
+			"Without argument, the command shows the watched labels, "
+			"their capabilities, and the steps in which they gained "
+			"them. The argument 'off' stops watching all labels."
+		)
+		
+	
 	def help_objectpath(self):
 		self._print(
 			"An object path is a possibly empty string that "
@@ -614,6 +1656,31 @@ class ClassInterpreterCmd(cmd.Cmd):
 		)
 	
 	
+	def _help_holdersSyntax(self):
+		self._print(
+			"SYNTAX:    holders [(-d | --depth) <length>] <object path>"
+		)
+	
+	def help_holders(self):
+		self._help_holdersSyntax()
+		self._print()
+		self._print(
+			"Lists all objects whose member variables refer to the "
+			"object at the given path, together with the names of "
+			"these variables. The interpreter keeps an index of these "
+			"reverse references, so the command does not need to "
+			"search the store."
+		)
+		self._print()
+		self._print(
+			"Afterwards, the command prints the shortest object paths "
+			"from the current frame or from a label that lead to the "
+			"object. The optional parameter '--depth' (or '-d', for "
+			"short) limits their length; it defaults to 5 segments. "
+			"See 'help objectpath' for an explanation on object paths."
+		)
+	
+	
 	def _help_labelSyntax(self):
 		self._print(
 			"SYNTAX:    label <objectPath> <name>"
@@ -659,6 +1726,149 @@ class ClassInterpreterCmd(cmd.Cmd):
 		)
 	
 	
+	def _help_engineSyntax(self):
+		self._print(
+			"SYNTAX:    engine [%s]" % " | ".join(sorted(self._engines))
+		)
+	
+	def help_engine(self):
+		self._help_engineSyntax()
+		self._print()
+		self._print(
+			"Selects the engine that executes programs loaded "
+			"afterwards. Without argument, the command prints the "
+			"current engine."
+		)
+		self._print()
+		self._print(
+			"Engine 'tree' rewrites the program's syntax tree and "
+			"allows printing every intermediate statement with "
+			"'program'. Engine 'vm' compiles the program into "
+			"instructions and runs them on an abstract machine; it "
+			"is faster but does not keep intermediate statements. "
+			"Both engines take the same number of steps."
+		)
+	
+	
+	def _help_parserSyntax(self):
+		self._print(
+			"SYNTAX:    parser [%s]" % " | ".join(sorted(parsers))
+		)
+	
+	def help_parser(self):
+		self._help_parserSyntax()
+		self._print()
+		self._print(
+			"Selects the parser for programs loaded afterwards. "
+			"Without argument, the command prints the current parser."
+		)
+		self._print()
+		self._print(
+			"Parser 'pymeta' uses the PyMeta grammar. Parser "
+			"'descent' splits the source into tokens once and parses "
+			"them by recursive descent; it takes time linear in the "
+			"size of the program and reports what it expected at "
+			"the first token it could not parse. Both build the "
+			"same program, except for words that start with a "
+			"keyword: PyMeta reads 'newC()' as 'new C()' and "
+			"rejects statements such as 'skipip', while the "
+			"descent parser reads words whole."
+		)
+	
+	
+	def _help_storeSyntax(self):
+		self._print(
+			"SYNTAX:    store [%s | compact]" % " | ".join(sorted(self._stores))
+		)
+	
+	def help_store(self):
+		self._help_storeSyntax()
+		self._print()
+		self._print(
+			"Selects the store implementation for programs loaded "
+			"afterwards. Without argument, the command prints the "
+			"current store."
+		)
+		self._print()
+		self._print(
+			"Store 'dict' uses a fresh Python object as reference for "
+			"every object; references show as memory addresses such "
+			"as 'ref:0x7f3a2c1d5e10'. Store 'array' keeps the objects "
+			"in an array and uses their indices as references, for "
+			"example 'ref:42'. It reuses the indices of removed "
+			"objects, so repeated runs yield the same references."
+		)
+		self._print()
+		self._print(
+			"Argument 'compact' moves all objects of the current "
+			"program's store to the beginning of the array and "
+			"renumbers their references; labels follow their "
+			"objects. The 'dict' store has no gaps and leaves "
+			"references unchanged."
+		)
+	
+	
+	def _help_gcSyntax(self):
+		self._print(
+			"SYNTAX:    gc [every <number of steps> | threshold "
+			"<number of objects> | pop | off | stats]"
+		)
+	
+	def help_gc(self):
+		self._help_gcSyntax()
+		self._print()
+		self._print(
+			"Without argument, the command removes all objects that "
+			"are unreachable from the current frame and from labels "
+			"from the store, and reports the number of freed objects "
+			"and the time it took."
+		)
+		self._print()
+		self._print(
+			"By default, frames and the temporary containers of "
+			"their variables are freed as soon as the frame is "
+			"popped, unless a label refers to them. Argument 'pop' "
+			"turns this back on after 'off'."
+		)
+		self._print()
+		self._print(
+			"The other arguments configure automatic collections, "
+			"which run between steps: 'every' collects after the given "
+			"number of steps, 'threshold' collects whenever the store "
+			"holds more than the given number of objects, and 'off' "
+			"disables both. To avoid collecting over and over, the "
+			"threshold grows to twice the number of objects that "
+			"survived the last collection. 'stats' prints the policy "
+			"and the number of collections, freed objects and pause "
+			"times."
+		)
+	
+	
+	def _help_statsSyntax(self):
+		self._print(
+			"SYNTAX:    stats [on | off | reset | json <file name>]"
+		)
+	
+	def help_stats(self):
+		self._help_statsSyntax()
+		self._print()
+		self._print(
+			"Switches statistics on the transition rules on or off. "
+			"While they are on, the engine counts how often each rule "
+			"fires and how much time its steps take, how often each "
+			"method of each class is called, and how many objects are "
+			"put into the store. 'reset' starts over with empty "
+			"statistics. Steps repeated after 'goto' or 'back' count "
+			"again. While statistics are on, 'run' executes the "
+			"program step by step."
+		)
+		self._print()
+		self._print(
+			"Without argument, the command prints the statistics; "
+			"'json' writes them to the given file in JSON format."
+		)
+	
+	
 	def help_exit(self):
 		self._print(
 			"SYNTAX:    exit"
@@ -676,14 +1886,6 @@ class ClassInterpreterCmd(cmd.Cmd):
 	# Utility Functions
 	# =================
 
-	def __replaceAstRoot(self, key, value):
-		"""
-		Provided to the InterpreterVisitor to allow it replacing the
-		AST's root node.
-		"""
-		self._AST = value
-
-
 	def __parseArgs(self, args, rule):
 		"""
 		Generic parsing function that applies a rule of _argsGrammar to
@@ -782,7 +1984,592 @@ class ClassInterpreterCmd(cmd.Cmd):
 		return "\n".join(text)
 
 
+# ==========
+# Batch Mode
+# ==========
+#
+# Running 'class_interpreter.py run <program file>' executes a program
+# without the interactive shell and reports the number of steps and the
+# execution speed.  The exit status tells how the run ended.
+
+EXIT_FINISHED = 0	# The program terminated.
+EXIT_ERROR = 1		# A runtime error occurred.
+EXIT_USAGE = 2		# Invalid arguments, or the program did not parse.
+EXIT_BUDGET = 3		# The program used up its steps before it terminated.
+
+# Batch runs need no inspection support.
+_batchEngines = {
+	"tree": InterpreterVisitor,
+	"vm": AbstractMachine,
+	"bigstep": BigStepEvaluator,
+}
+
+# Engines for batch runs that write a trace; see option --trace.
+_recordingEngines = {
+	"tree": RecordingInterpreterVisitor,
+	"vm": RecordingAbstractMachine,
+}
+
+
+def printStartupTimes(*steps):
+	"""
+	Print to standard error how long the imports took, how long it took
+	to build each grammar so far and whether the grammar came from the
+	cache, followed by the given steps as (name, seconds, note) triples.
+	"""
+	lines = [ ("imports", _importTime, "") ]
+	lines += [
+		("grammar %s" % name, seconds, origin)
+		for name, seconds, origin in grammarcache.buildTimes
+	]
+	lines += list(steps)
+	lines.append( ("total", time.time() - _importStart, "") )
+	
+	width = max([ len(name) for name, seconds, note in lines ])
+	for name, seconds, note in lines:
+		if note:
+			note = " (%s)" % note
+		print >>sys.stderr, "startup: %s  %.3f s%s" % (
+			name.ljust(width), seconds, note
+		)
+
+
+def formatStatistics(statistics):
+	"""
+	Returns the lines of a table of the given rule statistics; see
+	Interpreter.statistics().
+	"""
+	rules = statistics["rules"]
+	firings = sum([ entry["count"] for entry in rules.itervalues() ])
+	lines = [ "Rule        Firings   Share   Time (ms)   Per firing (us)" ]
+	for rule, entry in sorted(rules.iteritems(),
+			key=lambda item: -item[1]["count"]):
+		lines.append( "%-10s %8i %6.1f%% %11.3f %17.2f" % (
+			rule,
+			entry["count"],
+			100.0 * entry["count"] / max(firings, 1),
+			1000 * entry["seconds"],
+			1000000 * entry["seconds"] / entry["count"]
+		))
+	
+	calls = statistics["calls"]
+	if calls:
+		lines.append("")
+		width = max([ len(method) for method in calls ] + [18])
+		lines.append( "%s  Calls" % "Method".ljust(width) )
+		for method, count in sorted(calls.iteritems(),
+				key=lambda item: (-item[1], item[0])):
+			lines.append( "%s %6i" % (method.ljust(width), count) )
+	
+	lines.append("")
+	lines.append( "Allocations: %i" % statistics["allocations"] )
+	return lines
+
+
+def runBatch(args):
+	"""
+	Parse the command line arguments of a batch run, execute the
+	program and return the exit status.
+	"""
+	optionParser = optparse.OptionParser(
+		usage="%prog run [options] <program file>",
+		description="Executes a Class program without the interactive "
+			"shell and prints the number of steps, the wall time and "
+			"the steps per second."
+	)
+	optionParser.add_option("-n", "--max-steps",
+		type="int", dest="maxSteps", metavar="N",
+		help="stop after N steps (default: no limit)")
+	optionParser.add_option("-e", "--engine",
+		type="choice", choices=sorted(_batchEngines), default="tree",
+		help="execution engine: %s (default: %%default)" %
+			", ".join(sorted(_batchEngines)))
+	optionParser.add_option("-s", "--store",
+		type="choice", choices=sorted(ClassInterpreterCmd._stores),
+		default="dict",
+		help="store implementation: %s (default: %%default)" %
+			", ".join(sorted(ClassInterpreterCmd._stores)))
+	optionParser.add_option("-p", "--parser",
+		type="choice", choices=sorted(parsers), default="pymeta",
+		help="parser: %s (default: %%default)" %
+			", ".join(sorted(parsers)))
+	optionParser.add_option("--no-cache",
+		action="store_false", dest="cache", default=True,
+		help="parse the program even if the parse cache holds its AST")
+	optionParser.add_option("--startup-times",
+		action="store_true", dest="startupTimes", default=False,
+		help="print how long imports, grammars and parsing took")
+	optionParser.add_option("--stats",
+		action="store_true", dest="stats", default=False,
+		help="print how often each rule fired and how long it took")
+	optionParser.add_option("--stats-json",
+		dest="statsFile", metavar="FILE",
+		help="write the statistics of --stats to FILE as JSON")
+	optionParser.add_option("-t", "--trace",
+		dest="trace", metavar="FILE",
+		help="write a trace of every step to FILE; see 'replay'")
+	optionParser.add_option("-z", "--compress",
+		action="store_true", dest="compress", default=False,
+		help="compress the trace with gzip")
+	
+	options, arguments = optionParser.parse_args(args)
+	if len(arguments) != 1:
+		optionParser.error("expected exactly one program file")
+	if options.engine == "bigstep" and options.maxSteps is not None:
+		optionParser.error("engine 'bigstep' cannot stop after N steps")
+	if options.engine == "bigstep" and options.trace:
+		optionParser.error("engine 'bigstep' cannot write traces")
+	if options.compress and not options.trace:
+		optionParser.error("option --compress requires --trace")
+	statistics = options.stats or options.statsFile
+	if options.engine == "bigstep" and statistics:
+		optionParser.error("engine 'bigstep' cannot count rules")
+	
+	fileName = arguments[0]
+	try:
+		file = codecs.open(fileName, "r", locale.getpreferredencoding())
+		sourceCode = file.read().expandtabs()
+		file.close()
+	except IOError, e:
+		print >>sys.stderr, "Could not open file '%s'. %s." % (fileName, e.args[1])
+		return EXIT_USAGE
+	
+	if options.cache:
+		parseCache = ParseCache( defaultCacheDirectory(), options.parser )
+	else:
+		parseCache = ParseCache(None, options.parser)
+	try:
+		# Building the grammar counts separately.
+		buildCount = len(grammarcache.buildTimes)
+		parseStart = time.time()
+		program = parseCache.parse(sourceCode)
+		parseTime = time.time() - parseStart - sum([
+			seconds for name, seconds, origin
+			in grammarcache.buildTimes[buildCount:]
+		])
+	except pymeta.runtime.ParseError, e:
+		message, lineText, marker = ClassInterpreterCmd._describeParseError(
+			sourceCode, e )
+		print >>sys.stderr, message
+		print >>sys.stderr, ">>> %s" % lineText
+		print >>sys.stderr, "    %s" % marker
+		return EXIT_USAGE
+	
+	for problem in ScopeResolverVisitor().resolveProgram(program):
+		print >>sys.stderr, "Warning: %s" % problem
+	
+	if options.startupTimes:
+		printStartupTimes(
+			("parse", parseTime, parseCache.hits and "cache" or "parsed")
+		)
+	
+	engines = _batchEngines
+	if options.trace:
+		engines = _recordingEngines
+	interpreter = engines[options.engine](
+		program,
+		ClassInterpreterCmd._stores[options.store]()
+	)
+	trace = None
+	if options.trace:
+		try:
+			trace = TraceWriter(options.trace, options.compress)
+		except IOError, e:
+			print >>sys.stderr, "Could not open file '%s'. %s." % (options.trace, e.args[1])
+			return EXIT_USAGE
+		interpreter.record(trace)
+	interpreter.setStatistics(statistics)
+	maxSteps = options.maxSteps
+	
+	status = EXIT_FINISHED
+	start = time.time()
+	try:
+		while not interpreter.finished():
+			if maxSteps is not None and interpreter.steps() >= maxSteps:
+				status = EXIT_BUDGET
+				break
+			interpreter.step()
+	except (AttributeError, LookupError, NameError, RuntimeError), e:
+		status = EXIT_ERROR
+		error = e
+	if trace:
+		trace.close()
+	wallTime = time.time() - start
+	
+	steps = interpreter.steps()
+	if status == EXIT_ERROR:
+		# The failed step counts, as in the shell.
+		steps += 1
+		print >>sys.stderr, "A runtime error occured in step number %i." % steps
+		print >>sys.stderr, ">>> %s" % error.message
+	
+	print "status:   %s" % {
+		EXIT_FINISHED: "finished",
+		EXIT_ERROR: "runtime error",
+		EXIT_BUDGET: "step budget exhausted",
+	}[status]
+	print "steps:    %i" % steps
+	print "time:     %.3f s" % wallTime
+	if wallTime > 0:
+		print "steps/s:  %.0f" % (steps / wallTime)
+	else:
+		print "steps/s:  n/a"
+	
+	if options.stats:
+		print
+		for line in formatStatistics( interpreter.statistics() ):
+			print line
+	if options.statsFile:
+		try:
+			file = open(options.statsFile, "w")
+			try:
+				json.dump(interpreter.statistics(), file,
+					indent=2, sort_keys=True)
+			finally:
+				file.close()
+		except IOError, e:
+			print >>sys.stderr, "Could not write file '%s'. %s." % (options.statsFile, e.args[1])
+	return status
+
+
+def replayTrace(args):
+	"""
+	Rebuild the store of a step from a trace, print it and return the
+	exit status.
+	"""
+	optionParser = optparse.OptionParser(
+		usage="%prog replay [options] <trace file>",
+		description="Rebuilds the store of a step from a trace that "
+			"'run --trace' wrote, without running the program, and "
+			"prints the frame object pointer, the number of objects "
+			"and how often each rule fired up to the step."
+	)
+	optionParser.add_option("-n", "--step",
+		type="int", dest="step", metavar="N",
+		help="stop after step N (default: the last step)")
+	optionParser.add_option("-d", "--dump",
+		action="store_true", dest="dump", default=False,
+		help="print every object in the store")
+	
+	options, arguments = optionParser.parse_args(args)
+	if len(arguments) != 1:
+		optionParser.error("expected exactly one trace file")
+	
+	fileName = arguments[0]
+	try:
+		replay = Replay(fileName)
+		start = time.time()
+		try:
+			replay.run(options.step)
+		finally:
+			replay.close()
+	except (IOError, ValueError, IndexError), e:
+		print >>sys.stderr, "Could not read trace '%s'. %s" % (fileName, e)
+		return EXIT_USAGE
+	replayTime = time.time() - start
+	
+	if options.step is not None and replay.steps < options.step:
+		print >>sys.stderr, "The trace ends after step %i." % replay.steps
+	
+	def name(number):
+		if number is None:
+			return "NIL"
+		return "ref:%i" % number
+	
+	print "steps:    %i" % replay.steps
+	print "time:     %.3f s" % replayTime
+	print "frame:    %s" % name(replay.fop)
+	print "objects:  %i" % len(replay.store)
+	print "rules:    %s" % ", ".join([
+		"%s %i" % (rule, count)
+		for rule, count in sorted(replay.rules.iteritems())
+	])
+	
+	if options.dump:
+		internalNames = { INAME.PREV: "int:PREV", INAME.CLASS: "int:CLASS" }
+		for number, (methods, state) in sorted(replay.store.iteritems()):
+			variables = ", ".join(sorted([
+				"%s=%s" % (internalNames.get(var, var), name(value))
+				for var, value in state.iteritems()
+			]))
+			print "%s: %s" % (name(number), variables)
+			if methods:
+				print "    methods: %s" % ", ".join(sorted(methods))
+	return EXIT_FINISHED
+
+
+def compareParsers(args):
+	"""
+	Parse every given program file with all parsers, print the parse
+	times and whether the results agree, and return the exit status.
+	"""
+	optionParser = optparse.OptionParser(
+		usage="%prog compare-parsers <program file> ...",
+		description="Parses Class programs with every parser, without "
+			"the parse cache, and checks that the parsers build the "
+			"same programs or both reject them."
+	)
+	options, arguments = optionParser.parse_args(args)
+	if not arguments:
+		optionParser.error("expected at least one program file")
+	
+	names = sorted(parsers)
+	status = EXIT_FINISHED
+	for fileName in arguments:
+		try:
+			file = codecs.open(fileName, "r", locale.getpreferredencoding())
+			sourceCode = file.read().expandtabs()
+			file.close()
+		except IOError, e:
+			print >>sys.stderr, "Could not open file '%s'. %s." % (fileName, e.args[1])
+			return EXIT_USAGE
+		
+		# Failed parses yield None.  The parsers report different
+		# error positions, so only the failure itself must agree.
+		results = []
+		times = []
+		for name in names:
+			parse = parsers[name][0]
+			start = time.time()
+			try:
+				result = parse(sourceCode)
+				note = ""
+			except pymeta.runtime.ParseError, e:
+				result = None
+				note = ", error at %i" % e.position
+			times.append(
+				"%s %.3f s%s" % (name, time.time() - start, note)
+			)
+			results.append(result)
+		
+		same = all([
+			descent.sameConstruct(results[0], result)
+			for result in results[1:]
+		])
+		if not same:
+			status = EXIT_ERROR
+		print "%s: %s (%s)" % (
+			fileName, same and "same" or "DIFFERENT", ", ".join(times)
+		)
+	return status
+
+
+def checkReachability(args):
+	"""
+	Run benchmark workloads with watched and tracked labels, compare the
+	incrementally updated reachability with a search from scratch after
+	every step, and return the exit status.
+	"""
+	# Only this command and 'benchmark' need the corpus.
+	import benchmark
+	
+	optionParser = optparse.OptionParser(
+		usage="%prog check-reachability [options] [workload ...]",
+		description="Runs benchmark workloads, by default all of them, "
+			"while labelling objects that the current frame holds, and "
+			"checks after every step that the capabilities of the "
+			"labels and the objects that reach them agree with a "
+			"search from scratch."
+	)
+	optionParser.add_option("-e", "--engine",
+		type="choice", choices=sorted(benchmark.inspectors), default="tree",
+		help="execution engine: %s (default: %%default)" %
+			", ".join(sorted(benchmark.inspectors)))
+	optionParser.add_option("-s", "--store",
+		type="choice", choices=sorted(benchmark.stores), default="dict",
+		help="store implementation: %s (default: %%default)" %
+			", ".join(sorted(benchmark.stores)))
+	optionParser.add_option("-p", "--parser",
+		type="choice", choices=sorted(parsers), default="pymeta",
+		help="parser: %s (default: %%default)" %
+			", ".join(sorted(parsers)))
+	
+	options, arguments = optionParser.parse_args(args)
+	for name in arguments:
+		if name not in benchmark.workloadNames:
+			optionParser.error("unknown workload '%s'" % name)
+	
+	status = EXIT_FINISHED
+	for name in arguments or benchmark.workloadNames:
+		steps, mismatches = benchmark.checkReachability(
+			name, options.engine, options.store, options.parser
+		)
+		if not mismatches:
+			print "%s: same (%i steps)" % (name, steps)
+			continue
+		status = EXIT_ERROR
+		step, label = mismatches[0]
+		print "%s: DIFFERENT after %i of %i steps, first after step " \
+			"%i for label '%s'" % (
+			name, len(set([ s for s, l in mismatches ])), steps,
+			step, label
+		)
+	return status
+
+
+def runBenchmarks(args):
+	"""
+	Measure the benchmark workloads, optionally write the results to a
+	file and compare them with a baseline, and return the exit status.
+	"""
+	import benchmark
+	
+	optionParser = optparse.OptionParser(
+		usage="%prog benchmark [options] [workload ...]",
+		description="Measures parse time, steps per second, peak store "
+			"size and peak memory of benchmark workloads; by default "
+			"all of them.  With --compare, exits with status 1 if a "
+			"workload got worse than the baseline."
+	)
+	optionParser.add_option("-e", "--engine",
+		type="choice", choices=sorted(benchmark.engines), default="tree",
+		help="execution engine: %s (default: %%default)" %
+			", ".join(sorted(benchmark.engines)))
+	optionParser.add_option("-s", "--store",
+		type="choice", choices=sorted(benchmark.stores), default="dict",
+		help="store implementation: %s (default: %%default)" %
+			", ".join(sorted(benchmark.stores)))
+	optionParser.add_option("-p", "--parser",
+		type="choice", choices=sorted(parsers), default="pymeta",
+		help="parser: %s (default: %%default)" %
+			", ".join(sorted(parsers)))
+	optionParser.add_option("-r", "--repeat",
+		type="int", dest="repeat", default=5, metavar="N",
+		help="keep the fastest of N parses and runs (default: %default)")
+	optionParser.add_option("-o", "--output",
+		dest="output", metavar="FILE",
+		help="write the results to FILE as JSON")
+	optionParser.add_option("-c", "--compare",
+		dest="baseline", metavar="FILE",
+		help="compare the results with the baseline in FILE")
+	optionParser.add_option("--tolerance",
+		type="float", dest="tolerance", default=25.0, metavar="PERCENT",
+		help="changes up to PERCENT are no regressions (default: %default)")
+	optionParser.add_option("--confirm",
+		type="int", dest="confirm", default=2, metavar="N",
+		help="measure workloads that got worse N more times and report "
+			"only what all measurements show (default: %default)")
+	optionParser.add_option("-l", "--list",
+		action="store_true", dest="list", default=False,
+		help="list the workloads and exit")
+	
+	options, arguments = optionParser.parse_args(args)
+	if options.list:
+		for name in benchmark.workloadNames:
+			print name
+		return EXIT_FINISHED
+	for name in arguments:
+		if name not in benchmark.workloadNames:
+			optionParser.error("unknown workload '%s'" % name)
+	if options.repeat < 1:
+		optionParser.error("option --repeat requires a positive number")
+	if options.confirm < 0:
+		optionParser.error("option --confirm requires a number of at least 0")
+	settings = {
+		"engine": options.engine,
+		"store": options.store,
+		"parser": options.parser,
+		"repeat": options.repeat,
+	}
+	
+	baseline = None
+	if options.baseline:
+		try:
+			file = open(options.baseline, "r")
+			try:
+				baseline = json.load(file)
+			finally:
+				file.close()
+		except IOError, e:
+			print >>sys.stderr, "Could not open file '%s'. %s." % (options.baseline, e.args[1])
+			return EXIT_USAGE
+		except ValueError:
+			print >>sys.stderr, "'%s' is not a benchmark result file." % options.baseline
+			return EXIT_USAGE
+		if baseline.get("settings") != settings:
+			print >>sys.stderr, "Warning: the baseline was measured with " \
+				"different settings (%s)." % ", ".join([
+					"%s %s" % item
+					for item in sorted(baseline.get("settings", {}).iteritems())
+				])
+	
+	print "workload       parse (ms)    steps     steps/s  peak store  memory (KiB)"
+	results = {}
+	try:
+		for name, result in benchmark.run(
+				arguments or benchmark.workloadNames,
+				options.engine, options.store, options.parser,
+				options.repeat ):
+			results[name] = result
+			print "%-14s %10.2f %8i %11.0f %11i %13s" % (
+				name,
+				1000 * result["parseSeconds"],
+				result["steps"],
+				result["stepsPerSecond"] or 0,
+				result["peakStore"],
+				result["peakMemory"] is None and "n/a" or result["peakMemory"]
+			)
+	except RuntimeError, e:
+		print >>sys.stderr, e.message
+		return EXIT_ERROR
+	
+	if options.output:
+		try:
+			file = open(options.output, "w")
+			try:
+				json.dump({"settings": settings, "workloads": results},
+					file, indent=2, sort_keys=True)
+			finally:
+				file.close()
+		except IOError, e:
+			print >>sys.stderr, "Could not write file '%s'. %s." % (options.output, e.args[1])
+			return EXIT_USAGE
+	
+	if baseline is None:
+		return EXIT_FINISHED
+	try:
+		regressions = benchmark.confirm(
+			baseline.get("workloads", {}),
+			benchmark.compare(
+				baseline.get("workloads", {}), results,
+				options.tolerance / 100
+			),
+			options.tolerance / 100, options.confirm,
+			options.engine, options.store, options.parser, options.repeat
+		)
+	except RuntimeError, e:
+		print >>sys.stderr, e.message
+		return EXIT_ERROR
+	print
+	if not regressions:
+		print "No regressions beyond %g%%." % options.tolerance
+		return EXIT_FINISHED
+	for name, metric, change in regressions:
+		if change is None:
+			print "REGRESSION  %-14s %s differ: %i before, %i now" % (
+				name, metric,
+				baseline["workloads"][name][metric], results[name][metric]
+			)
+		else:
+			print "REGRESSION  %-14s %s worse by %.1f%%" % (
+				name, metric, 100 * change
+			)
+	return EXIT_ERROR
+
+
 if __name__ == "__main__":
 	# Switch to the locale prefered by the user
 	locale.setlocale(locale.LC_ALL, '')
-	ClassInterpreterCmd().cmdloop()
+	if len(sys.argv) > 1 and sys.argv[1] == "run":
+		sys.exit( runBatch(sys.argv[2:]) )
+	if len(sys.argv) > 1 and sys.argv[1] == "replay":
+		sys.exit( replayTrace(sys.argv[2:]) )
+	if len(sys.argv) > 1 and sys.argv[1] == "compare-parsers":
+		sys.exit( compareParsers(sys.argv[2:]) )
+	if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+		sys.exit( runBenchmarks(sys.argv[2:]) )
+	if len(sys.argv) > 1 and sys.argv[1] == "check-reachability":
+		sys.exit( checkReachability(sys.argv[2:]) )
+	ClassInterpreterCmd(
+		startupTimes = sys.argv[1:] == ["--startup-times"]
+	).cmdloop()
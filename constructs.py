@@ -37,12 +37,22 @@ class Construct(object):
 	def accept(self, visitor): pass
 	def copy(self): return Construct()
 
+# Scope resolution annotates variables, and the names that assignments
+# assign to, with the declaration they refer to: scope is a pair of the
+# declaring scope's level and the variable's slot there, and frameSlot the
+# slot of the name in the frame.  Both stay None for names that resolution
+# did not handle.  See module visitor.resolver.
+
 class Name(Construct):
+	scope = None
+	frameSlot = None
 	def __init__(self, n): self.name = n
 	def accept(self, visitor): visitor.visitName(self)
 	def copy(self): return Name(self.name)
 
 class Variable(Construct):
+	scope = None
+	frameSlot = None
 	def __init__(self, v): self.name = v
 	def accept(self, visitor): visitor.visitVariable(self)
 	def copy(self): return Variable(self.name)
@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import re
+import sys
+
+from pymeta.runtime import ParseError
+
+from grammarcache import sourceDigest
+from constructs import *
+import constructs
+
+
+# ========================
+# Recursive Descent Parser
+# ========================
+#
+# An alternative to the PyMeta grammar in module grammar.  PyMeta works on
+# characters: every alternative that fails rereads the characters of its
+# predecessors, and the input position after an error only marks the start
+# of the biggest construct that failed.  The parser below splits the source
+# into tokens once and decides between most alternatives by looking at the
+# next few tokens.
+#
+# Each parsing method implements the rule of the same name in the PyMeta
+# grammar and builds the same constructs.  Where an alternative can fail
+# after consuming tokens, the method backtracks like PyMeta does; this
+# matters for keywords used as variable names, which the grammar allows.
+# Repetitions never backtrack into an iteration that succeeded, as in
+# PyMeta.
+#
+# The grammar's <token> matches keywords as prefixes, so PyMeta reads
+# "newC()" as "new C()" and the statement "returnx" as "return x", and it
+# rejects statements such as "skipip" or "beginx", where the rest of the
+# word does not fit the keyword's rule.  The tokenizer reads words whole;
+# it rejects the first and reads the others as variable expressions.
+# Apart from words that start with a keyword, both parsers accept the
+# same programs and produce equal ASTs; see sameConstruct() and the
+# command 'class_interpreter.py compare-parsers'.
+
+# Tokens are triples (kind, text, position).  Names follow PyMeta's rules
+# <letter> and <letterOrDigit>; everything else is punctuation, the end of
+# the input, or an invalid character.
+NAME = "name"
+SYMBOL = "symbol"
+END = "end of input"
+INVALID = "invalid character"
+
+__tokenPattern = re.compile(
+	r"\s*(?:(?P<name>[^\W\d_]\w*)|(?P<symbol>:=|!=|[,=.();{}\[\]])|(?P<end>\Z))",
+	re.UNICODE
+)
+
+def tokenize(sourceCode, start=0, end=None):
+	"""
+	Generates the tokens of sourceCode[start:end]; positions count from
+	the start of sourceCode.  After the end of the input or an invalid
+	character, the last token repeats forever.
+	"""
+	if end is None:
+		end = len(sourceCode)
+	match = __tokenPattern.match
+	position = start
+	while True:
+		m = match(sourceCode, position, end)
+		if m is None:
+			position = end - len( sourceCode[position:end].lstrip() )
+			token = (INVALID, sourceCode[position], position)
+			break
+		
+		kind = m.lastgroup
+		if kind == "end":
+			token = (END, "", m.start(kind))
+			break
+		yield (kind, m.group(kind), m.start(kind))
+		position = m.end()
+	
+	while True:
+		yield token
+
+
+# Identifies the parser and the constructs it builds; see module parsecache.
+parserVersion = hashlib.sha1(
+	sourceDigest(sys.modules[__name__]) + sourceDigest(constructs)
+).hexdigest()
+
+
+class Mismatch(Exception):
+	"""
+	A rule did not match; the parser backtracks or gives up.
+	"""
+	pass
+
+
+class DescentParser(object):
+	"""
+	Parses Class programs from a stream of tokens.
+	
+	Like the parsers that PyMeta generates, a DescentParser is created
+	for the source code, and apply() parses a rule from the start of
+	the source.  Supported rules are "prog", "stmt" and "sstmt"; as in
+	PyMeta, input after the parsed construct is ignored.
+	
+	Rules "classes" and "tail" parse parts of programs for incremental
+	reparsing: zero or more class declarations, which must match the
+	whole input, and zero or more class declarations followed by the
+	initial statement, which ignores the input after it.  A parser for a part of the source receives its
+	start and end; positions still count from the start of the source.
+	The character spans (start, end) of all class declarations parsed
+	so far are in classSpans.
+	"""
+	
+	def __init__(self, sourceCode, start=0, end=None):
+		self.__source = tokenize(sourceCode, start, end)
+		self.__tokens = []
+		self.classSpans = []
+		self.__position = 0
+		# The furthest token that did not match and what the parser
+		# expected there; the error message reports them.
+		self.__errorPosition = 0
+		self.__expected = []
+		
+		self.__rules = {
+			"prog": self.__prog,
+			"stmt": self.__stmt,
+			"sstmt": self.__sstmt,
+			"classes": self.__classes,
+			"tail": self.__tail,
+		}
+	
+
+	def apply(self, rule):
+		"""
+		Parse the given rule.  Raises a ParseError with the character
+		position of the offending token and a description of what the
+		parser expected there if the source does not match.
+		"""
+		try:
+			return self.__rules[rule]()
+		except Mismatch:
+			position = self.__tokens[self.__errorPosition][2]
+			raise ParseError(position, self.__describeExpected())
+	
+
+	# ============
+	# Token access
+	# ============
+	
+	def __peek(self, offset=0):
+		"""
+		The token offset tokens after the current one.
+		"""
+		index = self.__position + offset
+		tokens = self.__tokens
+		while len(tokens) <= index:
+			tokens.append( self.__source.next() )
+		return tokens[index]
+	
+
+	def __isName(self, offset=0, text=None):
+		kind, tokenText, position = self.__peek(offset)
+		return kind == NAME and (text is None or tokenText == text)
+	
+
+	def __isSymbol(self, text, offset=0):
+		kind, tokenText, position = self.__peek(offset)
+		return kind == SYMBOL and tokenText == text
+	
+
+	def __fail(self, expected):
+		"""
+		Record what the current token should have been and raise a
+		Mismatch.
+		"""
+		if self.__position > self.__errorPosition:
+			self.__errorPosition = self.__position
+			self.__expected = []
+		if self.__position == self.__errorPosition and \
+			not expected in self.__expected:
+			self.__expected.append(expected)
+		raise Mismatch()
+	
+
+	def __describeExpected(self):
+		expected = self.__expected
+		if len(expected) == 1:
+			return "expected %s" % expected[0]
+		return "expected %s or %s" % (", ".join(expected[:-1]), expected[-1])
+	
+
+	def __name(self):
+		"""
+		Rule <name>.
+		"""
+		kind, text, position = self.__peek()
+		if kind != NAME:
+			self.__fail("a name")
+		self.__position += 1
+		return Name(text)
+	
+
+	def __symbol(self, text):
+		"""
+		Rule <token> for punctuation.
+		"""
+		if not self.__isSymbol(text):
+			self.__fail("'%s'" % text)
+		self.__position += 1
+	
+
+	def __keyword(self, text):
+		"""
+		Rule <token> for keywords.
+		"""
+		if not self.__isName(0, text):
+			self.__fail("'%s'" % text)
+		self.__position += 1
+	
+
+	# ===============
+	# Syntax of Class
+	# ===============
+	#
+	# See the grammar in module grammar; methods are in the same order.
+	
+	def __names(self):
+		names = [ self.__name() ]
+		while self.__isSymbol(",") and self.__isName(1):
+			self.__position += 1
+			names.append( self.__name() )
+		return names
+	
+
+	def __var(self):
+		return Variable( self.__name().name )
+	
+
+	def __vars(self):
+		return [ Variable(n.name) for n in self.__names() ]
+	
+
+	def __bool(self):
+		"""
+		Rules <eq>, <neq> and <bool>.
+		"""
+		y1 = self.__var()
+		if self.__isSymbol("="):
+			self.__position += 1
+			return BoolEq(y1, self.__var())
+		if self.__isSymbol("!="):
+			self.__position += 1
+			return BoolNeq(y1, self.__var())
+		self.__fail("'=' or '!='")
+	
+
+	def __arguments(self):
+		"""
+		The part <token '('> <vars>? <token ')'> of <new> and <call>.
+		"""
+		self.__symbol("(")
+		arguments = None
+		if self.__isName():
+			arguments = self.__vars()
+		self.__symbol(")")
+		return arguments
+	
+
+	def __new(self):
+		self.__keyword("new")
+		c = self.__name()
+		return New(c, self.__arguments())
+	
+
+	def __expr(self):
+		"""
+		Rules <expr>, <new>, <call> and <varex>.
+		"""
+		start = self.__position
+		if self.__isName(0, "new"):
+			try:
+				return self.__new()
+			except Mismatch:
+				self.__position = start
+		
+		if self.__isSymbol(".", 1):
+			try:
+				y = self.__var()
+				self.__position += 1
+				m = self.__name()
+				return Call(y, m, self.__arguments())
+			except Mismatch:
+				self.__position = start
+		
+		return VarExpression( self.__var() )
+	
+
+	def __seq(self):
+		"""
+		Rule <seq>.  Every name starts a statement, so the parser need
+		not try one after a semicolon if no name follows.
+		"""
+		statements = [ self.__stmt() ]
+		while self.__isSymbol(";") and self.__isName(1):
+			self.__position += 1
+			statements.append( self.__stmt() )
+		return Sequence(statements)
+	
+
+	def __block(self):
+		self.__keyword("begin")
+		dv = self.__decv()
+		Q = self.__seq()
+		self.__keyword("end")
+		return Block(dv, Q)
+	
+
+	def __if(self):
+		self.__keyword("if")
+		b = self.__bool()
+		self.__keyword("then")
+		S1 = self.__stmt()
+		self.__keyword("else")
+		S2 = self.__stmt()
+		return IfThenElse(b, S1, S2)
+	
+
+	def __while(self):
+		self.__keyword("while")
+		b = self.__bool()
+		self.__keyword("do")
+		S = self.__stmt()
+		return While(b, S)
+	
+
+	def __stmt(self):
+		"""
+		Rules <stmt>, <ass>, <skip> and <return>.  Keywords are valid
+		variable names, so a statement that starts with a keyword but
+		does not match its rule is an expression.
+		"""
+		if not self.__isName():
+			self.__fail("a statement")
+		
+		start = self.__position
+		if self.__isSymbol(":=", 1):
+			try:
+				x = self.__name()
+				self.__position += 1
+				return Assign(x, self.__expr())
+			except Mismatch:
+				self.__position = start
+		
+		keyword = self.__peek()[1]
+		if keyword == "skip":
+			self.__position += 1
+			return Skip()
+		if keyword == "return" and self.__isName(1):
+			self.__position += 1
+			return Return( self.__var() )
+		
+		rule = self.__compoundStatements.get(keyword)
+		if rule:
+			try:
+				return rule(self)
+			except Mismatch:
+				self.__position = start
+		
+		return self.__expr()
+	
+	__compoundStatements = {
+		"begin": __block,
+		"if": __if,
+		"while": __while,
+	}
+	
+
+	def __decv(self):
+		"""
+		Rule <decv>.  An iteration that does not match in full ends the
+		repetition; block bodies may start with a variable named 'var'.
+		"""
+		declarations = []
+		while self.__isName(0, "var") and self.__isName(1) and \
+			self.__isSymbol(";", 2):
+			self.__position += 1
+			declarations.append( VariableDeclaration(self.__name()) )
+			self.__position += 1
+		return declarations
+	
+
+	def __parameters(self):
+		"""
+		The part <token '('> <names>? <token ')'> of <decm> and
+		<decctor>.
+		"""
+		self.__symbol("(")
+		params = None
+		if self.__isName():
+			params = self.__names()
+		self.__symbol(")")
+		return params
+	
+
+	def __decm(self):
+		methods = []
+		while self.__isName(0, "method"):
+			self.__position += 1
+			m = self.__name()
+			params = self.__parameters()
+			self.__keyword("is")
+			S = self.__stmt()
+			self.__symbol(";")
+			methods.append( MethodDeclaration(m, params, S) )
+		return methods
+	
+
+	def __decctor(self):
+		self.__keyword("constructor")
+		params = self.__parameters()
+		self.__keyword("is")
+		S = self.__stmt()
+		self.__symbol(";")
+		return ConstructorDeclaration(params, S)
+	
+
+	def __classDeclaration(self):
+		"""
+		One iteration of <decc>.
+		"""
+		start = self.__peek()[2]
+		self.__keyword("class")
+		c = self.__name()
+		self.__keyword("is")
+		self.__keyword("begin")
+		dv = self.__decv()
+		ct = self.__decctor()
+		dm = self.__decm()
+		self.__keyword("end")
+		end = self.__peek()[2] + 1
+		self.__symbol(";")
+		self.classSpans.append( (start, end) )
+		return ClassDeclaration(c, dv, ct, dm)
+	
+
+	def __decc(self):
+		classes = [ self.__classDeclaration() ]
+		while self.__isName(0, "class"):
+			classes.append( self.__classDeclaration() )
+		return classes
+	
+
+	def __prog(self):
+		dc = self.__decc()
+		S = self.__new()
+		return Program(dc, S)
+	
+
+	# Parts of programs
+	
+	def __classes(self):
+		classes = []
+		while self.__isName(0, "class"):
+			classes.append( self.__classDeclaration() )
+		if self.__peek()[0] != END:
+			self.__fail("'class'")
+		return classes
+	
+
+	def __tail(self):
+		classes = []
+		while self.__isName(0, "class"):
+			classes.append( self.__classDeclaration() )
+		return classes, self.__new()
+	
+
+	# Scoped statements
+	
+	def __scoped(self):
+		"""
+		Rules <bscope>, <mscope> and <sass>.  Returns None if none of
+		them matches.
+		"""
+		start = self.__position
+		try:
+			if self.__isSymbol("{"):
+				self.__position += 1
+				B = self.__sstmt()
+				self.__symbol("}")
+				return BlockScopedStatement(B)
+			
+			if self.__isSymbol("["):
+				return self.__mscope()
+			
+			if self.__isSymbol(":=", 1) and self.__isSymbol("[", 2):
+				x = self.__name()
+				self.__position += 1
+				return Assign(x, self.__mscope())
+		
+		except Mismatch:
+			self.__position = start
+		return None
+	
+
+	def __mscope(self):
+		self.__symbol("[")
+		B = self.__sstmt()
+		self.__symbol("]")
+		return MethodScopedStatement(B)
+	
+
+	def __sstmt(self):
+		"""
+		Rules <sstmt> and <sseq>.  The alternatives <bscope>, <mscope>
+		and <sass> after <sseq> match exactly what its head matched, so
+		the head is parsed only once.  The last alternative, <seq>,
+		never applies: it starts with a <stmt>, which the alternative
+		before it tried already.
+		"""
+		head = self.__scoped()
+		if head is None:
+			return self.__stmt()
+		
+		tail = []
+		while self.__isSymbol(";") and self.__isName(1):
+			self.__position += 1
+			tail.append( self.__stmt() )
+		if tail:
+			return Sequence([head] + tail)
+		return head
+
+
+def parseProgram(sourceCode):
+	"""
+	Returns the Program that sourceCode describes; raises a ParseError
+	if it contains errors.
+	"""
+	return DescentParser(sourceCode).apply("prog")
+
+
+def sameConstruct(a, b):
+	"""
+	Whether the ASTs a and b consist of the same constructs with equal
+	names.
+	"""
+	if type(a) != type(b) and not (
+		isinstance(a, basestring) and isinstance(b, basestring) ):
+		return False
+	if isinstance(a, list):
+		return len(a) == len(b) and \
+			all([ sameConstruct(x, y) for x, y in zip(a, b) ])
+	if isinstance(a, Construct):
+		return sorted(vars(a)) == sorted(vars(b)) and all([
+			sameConstruct(value, getattr(b, key))
+			for key, value in vars(a).iteritems()
+		])
+	return a == b
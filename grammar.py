@@ -16,7 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from pymeta.grammar import OMeta
+import hashlib
+
+from grammarcache import LazyGrammar, sourceDigest
+import constructs
 from constructs import *
 
 # ===============
@@ -76,4 +79,10 @@ sseq	::= (<bscope> | <mscope> | <sass>):head (<token ';'> <stmt>)+:tail	=> Seque
 sstmt	::= <sseq> | <bscope> | <mscope> | <sass> | <stmt> | <seq>
 """
 
-classGrammar = OMeta.makeGrammar(__classGrammar, globals(), name="Class")
+classGrammar = LazyGrammar(__classGrammar, globals(), name="Class")
+
+# Identifies the grammar and the constructs it builds.  A parse result is
+# valid only as long as neither of them changed; see module parsecache.
+grammarVersion = hashlib.sha1(
+	__classGrammar + sourceDigest(constructs)
+).hexdigest()
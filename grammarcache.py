@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import imp
+import marshal
+import os
+import os.path
+import sys
+import tempfile
+import time
+
+import pymeta.builder
+import pymeta.runtime
+
+
+# ====================
+# Precompiled Grammars
+# ====================
+#
+# OMeta.makeGrammar() parses the grammar with PyMeta's own metagrammar,
+# writes a Python module with one method per rule, and compiles it.  All of
+# that happens again on every start, and importing pymeta.grammar alone
+# builds PyMeta's metagrammars.  A LazyGrammar instead compiles its grammar
+# when the first parser is created, and it stores the compiled module in the
+# cache directory.  Later starts load the module from there; they need
+# neither PyMeta's metagrammar nor its code generator.
+#
+# Entries are named after the hash of the grammar, its name, the Python
+# version and PyMeta's code generator.  Changing any of them compiles the
+# grammar anew.
+
+def defaultCacheDirectory():
+	"""
+	The directory named by the environment variable CLASS_PARSE_CACHE,
+	or a directory in the user's cache directory if the variable is
+	unset.  Returns None if the variable is set but empty, which
+	disables the cache.
+	"""
+	directory = os.environ.get("CLASS_PARSE_CACHE")
+	if directory is not None:
+		return directory or None
+	
+	cacheHome = os.environ.get("XDG_CACHE_HOME") or \
+		os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(cacheHome, "class_interpreter")
+
+
+def sourceDigest(module):
+	"""
+	Hash of the module's source file, or of the file it was loaded
+	from if the source is unavailable.
+	"""
+	fileName = module.__file__
+	if fileName.endswith((".pyc", ".pyo")) and os.path.exists(fileName[:-1]):
+		fileName = fileName[:-1]
+	file = open(fileName, "rb")
+	try:
+		return hashlib.sha1( file.read() ).hexdigest()
+	finally:
+		file.close()
+
+
+# Grammars built so far as triples (name, seconds, origin), where origin
+# is "cache" or "compiled"; see class_interpreter's startup report.
+buildTimes = []
+
+
+class LazyGrammar(object):
+	"""
+	A PyMeta grammar that is built on first use.
+	
+	Calling a LazyGrammar creates a parser exactly as calling the class
+	returned by OMeta.makeGrammar() does.  The grammar may extend another
+	LazyGrammar; see makeGrammar().
+	"""
+	
+	# Digest of the code generator, computed once for all grammars.
+	__generatorDigest = None
+	
+	def __init__(self, grammar, globals, name="Grammar", base=None):
+		self.__grammar = grammar
+		self.__globals = globals
+		self.__name = name
+		self.__base = base
+		self.__class = None
+	
+
+	def __call__(self, *args):
+		return self.grammar()(*args)
+	
+
+	def makeGrammar(self, grammar, globals, name="Grammar"):
+		"""
+		A LazyGrammar whose rules extend the rules of this one.
+		"""
+		return LazyGrammar(grammar, globals, name, self)
+	
+
+	def grammar(self):
+		"""
+		The grammar class, built if necessary.
+		"""
+		if self.__class is None:
+			start = time.time()
+			if self.__base is None:
+				baseClass = pymeta.runtime.OMetaBase
+			else:
+				baseClass = self.__base.grammar()
+			
+			code, origin = self.__code()
+			self.__class = self.__load(code, baseClass)
+			buildTimes.append( (self.__name, time.time() - start, origin) )
+		return self.__class
+	
+
+	def built(self):
+		return self.__class is not None
+	
+
+	def __code(self):
+		"""
+		The compiled module that defines the grammar class, and
+		whether it came from the cache.
+		"""
+		directory = defaultCacheDirectory()
+		if directory:
+			fileName = os.path.join(directory, self.__key() + ".grammar")
+			code = self.__read(fileName)
+			if code is not None:
+				return code, "cache"
+		
+		code = self.__compile()
+		if directory:
+			self.__write(directory, fileName, code)
+		return code, "compiled"
+	
+
+	def __key(self):
+		if LazyGrammar.__generatorDigest is None:
+			LazyGrammar.__generatorDigest = sourceDigest(pymeta.builder)
+		key = hashlib.sha1(LazyGrammar.__generatorDigest)
+		key.update(sys.version)
+		key.update(self.__name)
+		key.update(self.__grammar)
+		return key.hexdigest()
+	
+
+	def __compile(self):
+		"""
+		Compile the grammar the way OMeta.makeGrammar() does.
+		"""
+		import pymeta.grammar
+		tree = pymeta.grammar.OMeta.metagrammarClass(self.__grammar).parseGrammar(
+			self.__name, pymeta.builder.TreeBuilder
+		)
+		source = pymeta.builder.writePython(tree)
+		return compile(source, self.__fileName(), "exec")
+	
+
+	def __load(self, code, baseClass):
+		"""
+		Run the compiled module and return its grammar class.  Mirrors
+		pymeta.builder.moduleFromGrammar().
+		"""
+		moduleName = "pymeta_grammar__" + self.__name
+		module = imp.new_module(moduleName)
+		module.__dict__.update(self.__globals)
+		module.__dict__[baseClass.__name__] = baseClass
+		module.__dict__["GrammarBase"] = baseClass
+		exec code in module.__dict__
+		
+		grammarClass = module.__dict__[self.__name]
+		fullGlobals = dict( getattr(grammarClass, "globals", None) or {} )
+		fullGlobals.update(self.__globals)
+		grammarClass.globals = fullGlobals
+		sys.modules[moduleName] = module
+		return grammarClass
+	
+
+	def __fileName(self):
+		return "/pymeta_generated_code/pymeta_grammar__%s.py" % self.__name
+	
+
+	def __read(self, fileName):
+		try:
+			file = open(fileName, "rb")
+		except IOError:
+			return None
+		
+		try:
+			try:
+				return marshal.load(file)
+			finally:
+				file.close()
+		except (EOFError, ValueError, TypeError):
+			return None
+	
+
+	def __write(self, directory, fileName, code):
+		"""
+		Write the entry to a temporary file first and rename it, so
+		concurrent readers never see a partial entry.
+		"""
+		temporaryName = None
+		try:
+			if not os.path.isdir(directory):
+				os.makedirs(directory)
+			handle, temporaryName = tempfile.mkstemp(dir=directory, suffix=".tmp")
+			file = os.fdopen(handle, "wb")
+			try:
+				marshal.dump(code, file)
+			finally:
+				file.close()
+			os.rename(temporaryName, fileName)
+		except EnvironmentError:
+			if temporaryName and os.path.exists(temporaryName):
+				os.remove(temporaryName)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from pymeta.runtime import ParseError
+
+from constructs import Program
+from descent import DescentParser
+
+
+# =====================
+# Incremental Reparsing
+# =====================
+#
+# Reloading a program after an edit usually changes a few class
+# declarations.  The IncrementalParser compares the new source with the
+# previous one and finds the region that changed: everything between the
+# longest common prefix and the longest common suffix.  Class declarations
+# that lie completely outside of the region keep their constructs.  The
+# recursive descent parser parses only the text between the last unchanged
+# declaration before the region and the first unchanged one after it; that
+# text consists of the changed declarations and, if the edit reaches past
+# the last declaration, the initial statement.
+#
+# The boundaries of the reparsed text are boundaries of tokens in both
+# versions: a declaration ends with ';', and the character before an
+# unchanged declaration after the region is unchanged, too.  So the new
+# program is the same that a full parse would build.  A declaration that
+# ends right where the region starts counts as changed, because the edit
+# may extend its last token.
+
+def _commonPrefixLength(a, b):
+	"""
+	Length of the longest common prefix of a and b.  Compares slices
+	instead of characters, which is faster in Python.
+	"""
+	low, high = 0, min(len(a), len(b))
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[low:middle] == b[low:middle]:
+			low = middle
+		else:
+			high = middle - 1
+	return low
+
+
+def _commonSuffixLength(a, b, limit):
+	"""
+	Length of the longest common suffix of a and b, but at most limit.
+	"""
+	n, m = len(a), len(b)
+	low, high = 0, limit
+	while low < high:
+		middle = (low + high + 1) // 2
+		if a[n - middle:n - low] == b[m - middle:m - low]:
+			low = middle
+		else:
+			high = middle - 1
+	return low
+
+
+class IncrementalParser(object):
+	"""
+	Parses new versions of a program, reusing the class declarations
+	of the previous version that did not change.
+	
+	After a parse, reparsed and reused hold the number of class
+	declarations that were parsed anew and that were taken from the
+	previous version.  The new constructs are in parsedClasses and,
+	if the initial statement was parsed anew, parsedInitialStatement;
+	only they need scope resolution.
+	"""
+	
+	def __init__(self):
+		self.__source = None
+		self.__program = None
+		# Character spans of the previous version's class
+		# declarations; None if the descent parser rejects it.
+		self.__classSpans = None
+		self.reparsed = 0
+		self.reused = 0
+		self.parsedClasses = []
+		self.parsedInitialStatement = None
+	
+
+	def remember(self, sourceCode, program, classSpans=None):
+		"""
+		Make the given source and its program the previous version.
+		The program may come from any parser.  Pass the spans of its
+		class declarations if the parser reported them, as the
+		DescentParser does; otherwise the descent parser finds them
+		now, and its constructs are discarded so that the given ones
+		stay in use.
+		"""
+		self.__source = sourceCode
+		self.__program = program
+		if classSpans is None:
+			parser = DescentParser(sourceCode)
+			try:
+				parser.apply("prog")
+				classSpans = parser.classSpans
+			except ParseError:
+				pass
+		self.__classSpans = classSpans
+	
+
+	def hasPrevious(self):
+		return self.__program is not None
+	
+
+	def reparse(self, sourceCode):
+		"""
+		Returns the Program that sourceCode describes and makes it the
+		previous version.  Returns the previous Program itself if the
+		source did not change.  Raises a pymeta.runtime.ParseError if
+		the source contains errors; the previous version stays.
+		"""
+		old = self.__source
+		oldSpans = self.__classSpans
+		if oldSpans is None:
+			return self.__parseAll(sourceCode)
+		delta = len(sourceCode) - len(old)
+		
+		prefix = _commonPrefixLength(old, sourceCode)
+		if prefix == len(old) == len(sourceCode):
+			self.reparsed = 0
+			self.reused = len(oldSpans)
+			self.parsedClasses = []
+			self.parsedInitialStatement = None
+			return self.__program
+		suffix = _commonSuffixLength(
+			old, sourceCode, min(len(old), len(sourceCode)) - prefix
+		)
+		changeStart = prefix
+		changeEnd = len(old) - suffix
+		
+		before = 0
+		while before < len(oldSpans) and oldSpans[before][1] < changeStart:
+			before += 1
+		after = before
+		while after < len(oldSpans) and oldSpans[after][0] <= changeEnd:
+			after += 1
+		
+		start = 0
+		if before:
+			start = oldSpans[before - 1][1]
+		oldClasses = self.__program.classDeclarations
+		
+		if after < len(oldSpans):
+			parser = DescentParser(
+				sourceCode, start, oldSpans[after][0] + delta
+			)
+			parsedClasses = parser.apply("classes")
+			parsedInitialStatement = None
+			initialStatement = self.__program.initialStatement
+		else:
+			parser = DescentParser(sourceCode, start)
+			parsedClasses, parsedInitialStatement = parser.apply("tail")
+			initialStatement = parsedInitialStatement
+		
+		classes = oldClasses[:before] + parsedClasses + oldClasses[after:]
+		spans = oldSpans[:before] + parser.classSpans + [
+			(s + delta, e + delta) for s, e in oldSpans[after:]
+		]
+		if not classes:
+			# A program declares at least one class; see <decc>.
+			DescentParser(sourceCode).apply("prog")
+		
+		self.reparsed = len(parser.classSpans)
+		self.reused = len(classes) - self.reparsed
+		self.parsedClasses = parsedClasses
+		self.parsedInitialStatement = parsedInitialStatement
+		self.__source = sourceCode
+		self.__program = Program(classes, initialStatement)
+		self.__classSpans = spans
+		return self.__program
+	
+
+	def __parseAll(self, sourceCode):
+		parser = DescentParser(sourceCode)
+		program = parser.apply("prog")
+		self.reparsed = len(parser.classSpans)
+		self.reused = 0
+		self.parsedClasses = program.classDeclarations
+		self.parsedInitialStatement = program.initialStatement
+		self.__source = sourceCode
+		self.__program = program
+		self.__classSpans = parser.classSpans
+		return program
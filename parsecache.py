@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import cPickle
+import hashlib
+import os
+import os.path
+import tempfile
+
+import pymeta.runtime
+
+from grammar import classGrammar, grammarVersion
+from grammarcache import defaultCacheDirectory
+from constructs import Program
+import descent
+
+
+# ===========
+# Parse Cache
+# ===========
+#
+# Parsing with PyMeta takes long for big programs.  The cache stores the
+# AST of every parsed program in a file whose name is the hash of the
+# source code and the grammar version.  Loading the same source again
+# reads the AST from that file instead of parsing.  A changed source or
+# grammar yields a different hash, so stale entries are never read; they
+# merely remain on disk until someone deletes the directory.  The cache
+# shares its directory with the compiled grammars; see module grammarcache.
+#
+# Programs can be parsed with the PyMeta grammar or with the recursive
+# descent parser in module descent.  Both build equal ASTs, but each has
+# its own entries: the hash includes the version of the chosen parser.
+# The descent parser also reports the character spans of the class
+# declarations, which incremental reparsing starts from (see module
+# incremental); its entries keep the spans along with the AST.
+
+def _parsePyMeta(sourceCode):
+	parser = classGrammar(sourceCode)
+	try:
+		return parser.apply("prog")
+	except pymeta.runtime.ParseError:
+		raise pymeta.runtime.ParseError(parser.input.position)
+
+def _parseDescent(sourceCode):
+	parser = descent.DescentParser(sourceCode)
+	return parser.apply("prog"), parser.classSpans
+
+# Parsers selectable by name as pairs (parse function, version).
+parsers = {
+	"pymeta": (_parsePyMeta, grammarVersion),
+	"descent": (descent.parseProgram, descent.parserVersion),
+}
+
+# Parse functions that return pairs (program, class spans), by parser.
+spanParsers = {
+	"descent": _parseDescent,
+}
+
+
+class ParseCache(object):
+	"""
+	Parses programs and keeps their ASTs on disk.
+	
+	A cache without directory parses every time.  Problems with the
+	directory never fail a parse: unreadable entries count as misses,
+	and entries that cannot be written are not written.
+	
+	After a parse, classSpans holds the character spans of the
+	program's class declarations if the parser reports them, and None
+	otherwise.
+	"""
+	
+	def __init__(self, directory, parser="pymeta"):
+		self.__directory = directory
+		self.__parser = parser
+		self.__parse, self.__version = parsers[parser]
+		self.__parseSpans = spanParsers.get(parser)
+		self.hits = 0
+		self.misses = 0
+		self.classSpans = None
+	
+
+	def directory(self):
+		return self.__directory
+	
+
+	def parser(self):
+		return self.__parser
+	
+
+	def parse(self, sourceCode):
+		"""
+		Returns the Program that sourceCode describes.  Raises a
+		pymeta.runtime.ParseError whose position is the one where the
+		parser stopped if the source contains errors.  The descent
+		parser also states what it expected there.
+		"""
+		self.classSpans = None
+		if not self.__directory:
+			program, self.classSpans = self.__parseWithSpans(sourceCode)
+			return program
+		
+		fileName = self.__fileName(sourceCode)
+		entry = self.__read(fileName)
+		if entry is not None:
+			self.hits += 1
+			program, self.classSpans = entry
+			return program
+		
+		self.misses += 1
+		program, self.classSpans = self.__parseWithSpans(sourceCode)
+		self.__write(fileName, program, self.classSpans)
+		return program
+	
+
+	def __parseWithSpans(self, sourceCode):
+		if self.__parseSpans:
+			return self.__parseSpans(sourceCode)
+		return self.__parse(sourceCode), None
+	
+
+	def __fileName(self, sourceCode):
+		key = hashlib.sha1(self.__version)
+		key.update( sourceCode.encode("utf-8") )
+		return os.path.join(self.__directory, key.hexdigest() + ".ast")
+	
+
+	def __read(self, fileName):
+		"""
+		Returns the entry as pair (program, class spans), or None if
+		there is no valid entry.
+		"""
+		try:
+			file = open(fileName, "rb")
+		except IOError:
+			return None
+		
+		try:
+			try:
+				entry = cPickle.load(file)
+			finally:
+				file.close()
+		except Exception:
+			# A truncated or otherwise broken entry; the next parse
+			# replaces it.
+			return None
+		
+		# Entries without spans hold the program alone.
+		if isinstance(entry, Program):
+			return (entry, None)
+		if isinstance(entry, tuple) and len(entry) == 2 and \
+			isinstance(entry[0], Program) and isinstance(entry[1], list):
+			return entry
+		return None
+	
+
+	def __write(self, fileName, program, classSpans):
+		"""
+		Write the entry to a temporary file first and rename it, so
+		concurrent readers never see a partial entry.
+		"""
+		temporaryName = None
+		try:
+			if not os.path.isdir(self.__directory):
+				os.makedirs(self.__directory)
+			handle, temporaryName = tempfile.mkstemp(
+				dir=self.__directory, suffix=".tmp"
+			)
+			file = os.fdopen(handle, "wb")
+			try:
+				entry = program
+				if classSpans is not None:
+					entry = (program, classSpans)
+				cPickle.dump(entry, file, cPickle.HIGHEST_PROTOCOL)
+			finally:
+				file.close()
+			os.rename(temporaryName, fileName)
+		except (EnvironmentError, cPickle.PicklingError, RuntimeError):
+			if temporaryName and os.path.exists(temporaryName):
+				os.remove(temporaryName)
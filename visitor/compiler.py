@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from visitor import Visitor
+from constructs import *
+import util
+
+# ============
+# Instructions
+# ============
+#
+# The compiled form of a statement is a flat list of instructions.  An
+# instruction is a tuple; its first item is the opcode, the remaining items
+# are the operands.  Jump targets are indices into the same list.  Operands
+# that refer to variables are the Variables of the AST themselves, so the
+# machine can use the slots that scope resolution assigned to them.
+#
+# Instructions fall into two groups.  Executing a step instruction applies
+# exactly one transition rule that works on a redex, for example [call] or
+# [if1].  Completion instructions apply the rules that only rearrange the
+# configuration once a scoped statement or an assignment's right hand side
+# finished, namely [ass3], [comp*], [subb*] and [subc*].  The
+# InterpreterVisitor applies the latter in the same step as the rule that
+# triggered them.  The AbstractMachine therefore executes all completion
+# instructions following a step instruction as part of the same step, which
+# keeps the step counts of both engines identical.
+
+OPCODE = util.Enum([
+	# Step instructions
+	"PROG",		# (PROG, class declarations)
+	"NEW",		# (NEW, class name, argument Variables)
+	"CALL",		# (CALL, target Variable, method name, argument Variables, inline cache)
+	"VAR",		# (VAR, code of the scoped return statement)
+	"RETURN",	# (RETURN, Variable, number of enclosing blocks)
+	"SKIP",		# (SKIP,)
+	"BLOCK",	# (BLOCK, declared variable names)
+	"IF",		# (IF, is equality test, Variable 1, Variable 2, else target)
+	"WHILE",	# (WHILE,)
+	
+	# Completion instructions
+	"ASSIGN",	# (ASSIGN, target Name)
+	"ENDBLOCK",	# (ENDBLOCK,)
+	"ENDMETHOD",	# (ENDMETHOD,)
+	"JUMP",		# (JUMP, target)
+	"HALT",		# (HALT,)
+])
+
+COMPLETIONS = frozenset([
+	OPCODE.ASSIGN,
+	OPCODE.ENDBLOCK,
+	OPCODE.ENDMETHOD,
+	OPCODE.JUMP,
+	OPCODE.HALT,
+])
+
+
+
+class CompilerVisitor(Visitor):
+	"""
+	Translates trees of Constructs into lists of instructions for the
+	AbstractMachine.
+	
+	Use the compile*() methods; they return a fresh list of instructions
+	for the program's initial statement, a method body or a constructor
+	body, respectively.
+	"""
+	
+	def __init__(self):
+		Visitor.__init__(self)
+		self.__code = None
+		self.__blockDepth = 0
+	
+
+	def compileProgram(self, prog):
+		"""
+		Instructions that initialise the store, create the initial
+		object and stop the machine after it was constructed.
+		"""
+		return \
+			[ (OPCODE.PROG, prog.classDeclarations) ] + \
+			self.__compile(prog.initialStatement) + \
+			[ (OPCODE.HALT,) ]
+	
+	def compileMethod(self, body):
+		"""
+		Instructions for a method body.  Methods may end without
+		returning a value.
+		"""
+		return self.__compile(body) + [ (OPCODE.ENDMETHOD,) ]
+	
+	def compileConstructor(self, body):
+		"""
+		Instructions for a constructor body.  Like rule [new], they
+		finish by returning the newly created object.
+		"""
+		return self.__compile(body) + [ (OPCODE.RETURN, Variable("self"), 0) ]
+	
+
+	def visitVarExpression(self, varexpr):
+		# Rule [var] scopes a return statement, which is therefore
+		# compiled separately.
+		self.__emit( OPCODE.VAR, [ (OPCODE.RETURN, varexpr.var, 0) ] )
+	
+	def visitNew(self, new):
+		self.__emit(
+			OPCODE.NEW,
+			new.className.name,
+			new.arguments
+		)
+	
+	def visitCall(self, call):
+		self.__emit(
+			OPCODE.CALL,
+			call.target,
+			call.methodName.name,
+			call.arguments,
+			# Behaviour, code and argument mapping of the last
+			# call; see Interpreter._resolveCall().
+			[None, None, None]
+		)
+	
+
+	def visitAssign(self, ass):
+		ass.rhs.accept(self)
+		self.__emit(OPCODE.ASSIGN, ass.target)
+	
+	def visitSkip(self, skip):
+		self.__emit(OPCODE.SKIP)
+	
+	def visitReturn(self, ret):
+		self.__emit(OPCODE.RETURN, ret.var, self.__blockDepth)
+	
+	def visitSequence(self, seq):
+		for S in seq.statements:
+			S.accept(self)
+	
+	def visitBlock(self, block):
+		self.__emit(OPCODE.BLOCK, [ Dv.var.name for Dv in block.declaredVars ])
+		self.__blockDepth += 1
+		block.sequence.accept(self)
+		self.__blockDepth -= 1
+		self.__emit(OPCODE.ENDBLOCK)
+	
+	def visitIfThenElse(self, ite):
+		ifIndex = self.__emit(
+			OPCODE.IF,
+			type(ite.bool) == BoolEq,
+			ite.bool.var1,
+			ite.bool.var2,
+			None
+		)
+		ite.trueStatement.accept(self)
+		jumpIndex = self.__emit(OPCODE.JUMP, None)
+		self.__patch(ifIndex, len(self.__code))
+		ite.falseStatement.accept(self)
+		self.__patch(jumpIndex, len(self.__code))
+	
+	def visitWhile(self, whil):
+		# Rule [while] unfolds the loop into a conditional whose else
+		# branch is a skip statement.
+		whileIndex = self.__emit(OPCODE.WHILE)
+		ifIndex = self.__emit(
+			OPCODE.IF,
+			type(whil.bool) == BoolEq,
+			whil.bool.var1,
+			whil.bool.var2,
+			None
+		)
+		whil.bodyStatement.accept(self)
+		self.__emit(OPCODE.JUMP, whileIndex)
+		self.__patch(ifIndex, len(self.__code))
+		self.__emit(OPCODE.SKIP)
+	
+
+	def visitBlockScopedStatement(self, B):
+		raise TypeError("Cannot compile intermediate configurations.")
+	
+	def visitMethodScopedStatement(self, B):
+		raise TypeError("Cannot compile intermediate configurations.")
+	
+
+	# =================
+	# Utility functions
+	# =================
+	
+	def __compile(self, construct):
+		"""
+		Return the instructions for the given statement.
+		"""
+		outerCode, outerBlockDepth = self.__code, self.__blockDepth
+		self.__code, self.__blockDepth = [], 0
+		try:
+			construct.accept(self)
+			return self.__code
+		finally:
+			self.__code, self.__blockDepth = outerCode, outerBlockDepth
+	
+	def __emit(self, *instruction):
+		"""
+		Append an instruction and return its index.
+		"""
+		self.__code.append(instruction)
+		return len(self.__code) - 1
+	
+	def __patch(self, index, target):
+		"""
+		Set the (last) jump target operand of the instruction at index.
+		"""
+		self.__code[index] = self.__code[index][:-1] + (target,)
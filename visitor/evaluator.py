@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import sys
+import threading
+
+from constructs import *
+from interpreter import Interpreter, Inspector, ReturnValue
+
+
+class BigStepEvaluator(Interpreter):
+	"""
+	Evaluates a whole program at once (natural semantics).
+	
+	The evaluator executes each statement to its end by recursively
+	executing its parts.  Unlike the InterpreterVisitor, it never builds
+	intermediate configurations: method calls, blocks and loops are
+	Python calls and loops, and return values are Python values.  The
+	store and the frames, however, evolve exactly as with the small-step
+	rules because the evaluator uses the same auxiliary functions.  The
+	final store therefore equals the one of a small-step run.
+	
+	The evaluator also counts how many steps the small-step rules would
+	take; steps() reports this number.  A single call of step() runs the
+	program to its end.
+	"""
+	
+	# Each method call nests about eight Python calls.  The evaluation
+	# therefore runs in a thread of its own whose stack is large enough
+	# for deeply recursive programs; the recursion limit is raised
+	# accordingly, but stays low enough to fail before the stack is
+	# exhausted.
+	stackSize = 256 * 1024 * 1024
+	recursionLimit = 250000
+	
+	def __init__(self, program, store=None):
+		Interpreter.__init__(self, store)
+		self.__program = program
+		self.__steps = 0
+		self.__finished = False
+		# The evaluation cannot resume after a runtime error.
+		self.__failure = None
+	
+
+	def _step(self):
+		if self.__failure:
+			excType, excValue, excTraceback = self.__failure
+			raise excType, excValue, excTraceback
+		
+		failure = []
+		def evaluate():
+			try:
+				self.__evaluateProgram(self.__program)
+			except:
+				failure.append(sys.exc_info())
+		
+		recursionLimit = sys.getrecursionlimit()
+		stackSize = threading.stack_size()
+		try:
+			sys.setrecursionlimit( max(recursionLimit, self.recursionLimit) )
+			threading.stack_size(self.stackSize)
+			evaluation = threading.Thread(target=evaluate)
+			evaluation.start()
+			evaluation.join()
+		finally:
+			threading.stack_size(stackSize)
+			sys.setrecursionlimit(recursionLimit)
+		
+		if failure:
+			self.__failure = failure[0]
+			excType, excValue, excTraceback = self.__failure
+			raise excType, excValue, excTraceback
+		self.__finished = True
+	
+	def finished(self):
+		return self.__finished
+	
+	def steps(self):
+		"""
+		Number of small steps the evaluation corresponds to.
+		"""
+		return self.__steps
+	
+	def setCheckpointInterval(self, interval=None):
+		"""
+		The evaluation has no intermediate configurations to return
+		to; checkpoints stay off.
+		"""
+		Interpreter.setCheckpointInterval(self, None)
+	
+
+	# ===============
+	# Execution rules
+	# ===============
+	#
+	# __execute() runs a statement in the current frame.  It returns a
+	# ReturnValue if the statement executed a return statement, and None
+	# if it finished normally.  Each rule adds the small steps that the
+	# respective transition rule takes; the completion rules take no
+	# steps of their own.  Counting a step after the rule's effect keeps
+	# the count of finished steps accurate if an error occurs.
+	
+	def __evaluateProgram(self, prog):
+		"""
+		Transition rule [prog].
+		"""
+		self._initialise(prog.classDeclarations)
+		self.__steps += 1
+		self.__execute(prog.initialStatement)
+	
+
+	def __execute(self, S):
+		return self.__rules[type(S)](self, S)
+	
+
+	def __skip(self, skip):
+		self.__steps += 1
+		return None
+	
+
+	def __return(self, ret):
+		result = ReturnValue( self._lookup(ret.var) )
+		self.__steps += 1
+		return result
+	
+
+	def __sequence(self, seq):
+		"""
+		Rules [comp1] to [comp3]: a return value ends the sequence.
+		"""
+		for S in seq.statements:
+			result = self.__execute(S)
+			if result:
+				return result
+		return None
+	
+
+	def __block(self, block):
+		"""
+		Rules [block], [subb1] and [subb2].
+		"""
+		self._push( self._store[self._fop].copy() )
+		self._declare( self._pv(block.declaredVars) )
+		self.__steps += 1
+		result = self.__execute(block.sequence)
+		self._pop()
+		return result
+	
+
+	def __ifThenElse(self, ite):
+		"""
+		Rules [if1] and [if2].
+		"""
+		if self.__test(ite.bool):
+			S = ite.trueStatement
+		else:
+			S = ite.falseStatement
+		self.__steps += 1
+		return self.__execute(S)
+	
+
+	def __while(self, whil):
+		"""
+		Rule [while] followed by rules [if1] or [if2].  The loop ends
+		with the else branch's skip statement.
+		"""
+		while True:
+			self.__steps += 1
+			b = self.__test(whil.bool)
+			self.__steps += 1
+			if not b:
+				self.__steps += 1
+				return None
+			
+			result = self.__execute(whil.bodyStatement)
+			if result:
+				return result
+	
+
+	def __assign(self, ass):
+		"""
+		Rules [ass1] to [ass3].
+		"""
+		result = self.__evaluate(ass.rhs)
+		if not result:
+			raise AttributeError(
+				"Cannot assign to '%s': the method returned "
+				"no value." % ass.target.name
+			)
+		
+		self._pop()
+		self._setv(
+			dict([ (ass.target.name, result.reference) ]),
+			self._container(ass.target)
+		)
+		return None
+	
+
+	def __expressionStatement(self, expr):
+		"""
+		Expressions in statement position; rules [subc1] and [subc2]
+		discard their result.
+		"""
+		self.__evaluate(expr)
+		self._pop()
+		return None
+	
+
+	# Evaluation rules
+	#
+	# __evaluate() runs an expression up to the point where its scoped
+	# statement finished.  The expression's frame is still on the stack
+	# then; the caller pops it.  The result is the ReturnValue, or None
+	# if a method ended without returning a value.
+	
+	def __evaluate(self, expr):
+		return self.__expressions[type(expr)](self, expr)
+	
+
+	def __varExpression(self, varexpr):
+		"""
+		Rule [var] followed by rule [return].
+		"""
+		self._push( self._store[self._fop].copy() )
+		self.__steps += 1
+		return self.__return( Return(varexpr.var) )
+	
+
+	def __call(self, call):
+		"""
+		Rule [call], with the call site's inline cache as in the
+		InterpreterVisitor.
+		"""
+		targetReference =  self._lookup(call.target)
+		calledObject = self._store[ targetReference ]
+		methodBody, argumentMapping = self._resolveCall(
+			calledObject.shape().behaviour, call.target,
+			call.methodName.name, len(call.arguments),
+			self._callCache(call)
+		)
+		binding = dict([
+				(argumentMapping[i], self._lookup(call.arguments[i]))
+				for i in range(0, len(argumentMapping))
+			])
+		binding["self"] = targetReference
+		self._push( self._framefrom(targetReference) )
+		self._declare(binding)
+		self.__steps += 1
+		
+		return self.__execute(methodBody)
+	
+
+	def __new(self, new):
+		"""
+		Rule [new].  The constructor body ends with returning the
+		new object.
+		"""
+		classObject = self._classObject(new.className.name)
+		objectPrototype = self._store[ classObject.variable("proto") ]
+		newReference = self._put( objectPrototype.copy() )
+		
+		constructorBody, argumentMapping = classObject.method("ctor")
+		if len(argumentMapping) != len(new.arguments):
+			raise IndexError(
+				"The constructor of class '%s' takes exactly "
+				"%i arguments; %i were given." %
+				(new.className.name, len(argumentMapping), len(new.arguments))
+			)
+		binding = dict([
+				(argumentMapping[i], self._lookup(new.arguments[i]))
+				for i in range(0, len(argumentMapping))
+			])
+		binding["self"] = newReference
+		
+		self._push( self._framefrom(newReference) )
+		self._declare(binding)
+		self.__steps += 1
+		
+		result = self.__execute(constructorBody)
+		if result:
+			return result
+		return self.__return( Return(Variable("self")) )
+	
+
+	def __test(self, bool):
+		"""
+		The semantic function B from the thesis.
+		"""
+		ref1 = self._lookup(bool.var1)
+		ref2 = self._lookup(bool.var2)
+		if type(bool) == BoolEq:
+			return ref1 == ref2
+		return ref1 != ref2
+	
+
+	__rules = {
+		Skip: __skip,
+		Return: __return,
+		Sequence: __sequence,
+		Block: __block,
+		IfThenElse: __ifThenElse,
+		While: __while,
+		Assign: __assign,
+		VarExpression: __expressionStatement,
+		Call: __expressionStatement,
+		New: __expressionStatement,
+	}
+	
+	__expressions = {
+		VarExpression: __varExpression,
+		Call: __call,
+		New: __new,
+	}
+
+
+
+class InspectorBigStepEvaluator(Inspector, BigStepEvaluator):
+	"""
+	Evaluates a whole program at once and allows access to the final
+	store for inspection and debugging.
+	"""
+	
+	def __init__(self, program, store=None):
+		BigStepEvaluator.__init__(self, program, store)
+		Inspector.__init__(self)
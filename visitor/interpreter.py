@@ -18,18 +18,18 @@
 
 from visitor import Visitor
 from constructs import *
-import pymeta.grammar
+from store import DictStore, ArrayStore, Reference
+from reachability import Reachability
+from grammarcache import LazyGrammar
+import bisect
+import time
 import util
 
 # ================
 # Semantic objects
 # ================
-
-class Reference(object):
-	"""
-	Identifiers for ClassObjects.
-	"""
-	pass
+#
+# References and the store are defined in module store.
 
 # The domain of object states are names; we represent them as strings.
 # Consequently, object states in our interpreter are dictionaries mapping
@@ -38,41 +38,119 @@ class Reference(object):
 
 INAME = util.Enum(["PREV", "CLASS"])
 
+# Transition rules that apply to the redex.  Every step applies exactly one
+# of them; the completion rules that follow in the same step, such as
+# [ass3] or [subc2], are not listed.
+
+RULE = util.Enum([
+	"PROG", "VAR", "NEW", "CALL", "SKIP", "RETURN",
+	"BLOCK", "IF1", "IF2", "WHILE",
+])
+
+# Names of the rules as in the thesis.
+RULE_NAMES = dict([ (v, k.lower()) for k, v in RULE.__dict__.items() ])
+
 # Similar to the object state, object behaviour maps (string) names to
 # a tuple containing the implementation and argument mapping
 # (see section 3.1.1).
+#
+# Objects of the same class have the same member variables and the same
+# behaviour.  Instead of giving each object dictionaries of its own, objects
+# share a Shape: the behaviour together with the mapping from variable
+# names to slots.  An object itself holds only its shape and the list of
+# references in the slots.  Declaring a new variable moves the object to a
+# successor shape; objects that acquire the same variables in the same order
+# end up with the same shape.
+#
+# Variables that an update introduces take their slots in sorted order.  The
+# layout of an object therefore depends only on the names it acquired, and
+# not on the order of a dictionary; scope resolution relies on this to
+# assign slots to variables ahead of time (see module resolver).
+
+class Shape(object):
+	"""
+	The layout shared by ClassObjects: variable names, the slot index
+	of each name, and the behaviour.
+	"""
+	def __init__(self, behaviour, names = ()):
+		self.behaviour = behaviour
+		self.names = names
+		self.slots = dict([ (x, i) for i, x in enumerate(names) ])
+		self.__successors = {}
+	
+	def extend(self, x):
+		"""
+		Returns the shape with the additional variable x in the last slot.
+		"""
+		try:
+			return self.__successors[x]
+		except KeyError:
+			successor = Shape(self.behaviour, self.names + (x,))
+			self.__successors[x] = successor
+			return successor
+
+# Frames and other objects without methods all start from this shape.
+EMPTY_SHAPE = Shape({})
+
 
 class ClassObject(object):
 	"""
 	Objects of Class as introduced in section 3.1.
 	"""
-	def __init__(self, state = {}, behaviour = {}):
-		self.__state = state
-		self.__behaviour = behaviour
+	__slots__ = ("__shape", "__values")
+	
+	def __init__(self, state = None, behaviour = None):
+		if behaviour:
+			self.__shape = Shape(behaviour)
+		else:
+			self.__shape = EMPTY_SHAPE
+		self.__values = []
+		if state:
+			self.update(state)
 	
 	def variable(self, x):
-		return self.__state[x]
+		return self.__values[ self.__shape.slots[x] ]
+	
+	def slot(self, i):
+		return self.__values[i]
 	
 	def method(self, m):
-		return self.__behaviour[m]
+		return self.__shape.behaviour[m]
 	
 	def variables(self):
-		return self.__state.keys()
+		return list(self.__shape.names)
 	
 	def references(self):
-		return self.__state.values()
+		return list(self.__values)
 	
 	def methods(self):
-		return self.__behaviour.keys()
+		return self.__shape.behaviour.keys()
+	
+	def shape(self):
+		return self.__shape
 	
 	def update(self, newState):
-		self.__state.update(newState)
+		slots = self.__shape.slots
+		added = None
+		for x, ref in newState.iteritems():
+			try:
+				self.__values[ slots[x] ] = ref
+			except KeyError:
+				if added is None: added = []
+				added.append(x)
+		if added:
+			added.sort()
+			for x in added:
+				self.__shape = self.__shape.extend(x)
+				self.__values.append(newState[x])
 	
 	def copy(self):
-		return ClassObject(
-			self.__state.copy(),
-			self.__behaviour.copy()
-		)
+		# Behaviours never change once they are constructed; copies
+		# therefore share the shape.
+		obj = ClassObject()
+		obj.__shape = self.__shape
+		obj.__values = list(self.__values)
+		return obj
 
 
 # Return values are the result of rule applications and, hence, appear in the
@@ -83,29 +161,242 @@ class ReturnValue(Construct):
 		self.reference = ref
 
 
+# Method bodies and loop bodies are shared by all their executions and never
+# change.  The progress of one execution of a sequence is kept in an
+# activation record instead of removing finished statements from the list.
+# Towards visitors, the record looks like the sequence of the statements
+# still to be executed.
+class SequenceActivation(Sequence):
+	def __init__(self, SS):
+		self.__statements = SS
+		self.__index = 0
+		self.current = SS[0]
+	
+	def statements(self):
+		return [self.current] + self.__statements[self.__index + 1:]
+	statements = property(statements)
+	
+	def remaining(self):
+		"""
+		Number of statements left, including the current one.
+		"""
+		return len(self.__statements) - self.__index
+	
+	def advance(self):
+		"""
+		Make the next statement current; returns False if there is none.
+		"""
+		self.__index += 1
+		if self.__index == len(self.__statements):
+			self.current = None
+			return False
+		self.current = self.__statements[self.__index]
+		return True
+	
+	def copy(self):
+		return Sequence( [ s.copy() for s in self.statements ] )
+	
+	def fork(self):
+		"""
+		Another activation at the same position; advancing either one
+		leaves the other where it is.
+		"""
+		activation = SequenceActivation(self.__statements)
+		activation.__index = self.__index
+		activation.current = self.current
+		return activation
+
+
 
 
-class InterpreterVisitor(Visitor):
+class Interpreter(object):
 	"""
-	Applies the transition rules (section 3.3) to a tree of Constructs.
+	The semantic core shared by all execution engines.
 	
-	The visitor encapsulates all program state outside the code.  It
-	therefore contains the store and the frame object pointer.  Together
-	with the code, this makes for a complete configuration (section 3.1.4).
+	An Interpreter encapsulates all program state outside the code: the
+	store and the frame object pointer.  It provides the auxiliary
+	functions of section 3.2 on this state.  Subclasses decide how the
+	code part of the configuration is represented and implement the
+	transition rules on it in _step(), and offer finished() and
+	statement() to observe the execution.
 	
-	As the visitor traverses the tree, it applies the transition rules to
-	the Constructs (modifying them!) and accordingly updates its store and
-	frame object pointer.  With every application of the InterpreterVisitor
-	to a Construct tree, the visitor executes one step of the respective
-	program.
+	The Interpreter also owns the garbage collector.  Collections run
+	between steps only, when no intermediate results are in flight.
 	"""
 	
-	def __init__(self, replaceRootConstruct):
-		Visitor.__init__(self)
-		self._store = {}
+	def __init__(self, store=None):
+		if store is None: store = DictStore()
+		self._store = store
 		self._fop = None
+		self.__steps = 0
+		# The rule the last step applied to the redex: a pair of a RULE
+		# value and, for rules [call] and [new], the method or class
+		# name.  Engines set it in each step.
+		self._fired = None
+		
+		# Garbage collection policy and statistics
+		self.__collectionInterval = None
+		self.__collectionThreshold = None
+		self.__nextThreshold = None
+		self.__stepsSinceCollection = 0
+		self.__framesPopped = 0
+		self.__collections = 0
+		self.__collectedObjects = 0
+		self.__totalPause = 0.0
+		self.__maximumPause = 0.0
+		
+		# Immediate reclamation of popped frames; see _pop().
+		self.__reclaimFrames = True
+		self.__temporaries = {}
+		self.__retainedFrames = set()
+		self.__reclaimedObjects = 0
+		
+		# Checkpoints by step number; see checkpoint().
+		self.__checkpointInterval = None
+		self.__checkpoints = {}
+		self.__checkpointSteps = []
+		self.__unshared = None
+		
+		# Class declarations whose class and prototype objects do not
+		# exist yet, by class name, as pairs of the declaration's
+		# position and the declaration; see _initialise().
+		self.__pendingClasses = {}
+		# Class names by the identity of their behaviour.
+		self.__classNames = {}
 		
-		self.__currentConstructAccessor = [ (replaceRootConstruct, None) ]
+		# Inline caches of call sites by Call construct; see
+		# _resolveCall().  Checkpoints need not save the caches.
+		self._callCaches = {}
+		
+		# Rule statistics; None while they are off.  See
+		# setStatistics().
+		self.__statistics = None
+	
+	
+	def step(self):
+		"""
+		Apply the transition relation once to the current configuration.
+		"""
+		if self.__checkpointInterval and \
+			self.__steps % self.__checkpointInterval == 0 and \
+			not self.__steps in self.__checkpoints:
+			self.checkpoint()
+		
+		if self.__statistics is None:
+			self._step()
+		else:
+			self.__measuredStep()
+		self.__steps += 1
+		self.__stepsSinceCollection += 1
+		if self.__collectionDue():
+			self.collect()
+	
+	
+	def steps(self):
+		"""
+		Number of steps executed so far.
+		"""
+		return self.__steps
+	
+	
+	# Statistics
+	#
+	# While statistics are on, every step counts towards the rule it fired,
+	# along with its wall time; the completion rules of the step count as
+	# part of it.  Calls count by class and method name, and allocations
+	# by _put().  While they are off, a step costs a single comparison.
+	# Steps count again if they are repeated after returning to a
+	# checkpoint.
+	
+	def setStatistics(self, enabled=True):
+		"""
+		Switch the statistics on or off.  Switching them on starts with
+		empty statistics.
+		"""
+		if not enabled:
+			self.__statistics = None
+			return
+		self.__statistics = {
+			"rules": {},
+			"calls": {},
+			"allocations": 0,
+		}
+	
+	
+	def statistics(self):
+		"""
+		The statistics since they were switched on, or None if they
+		are off.  They map "rules" to the number of firings and the
+		total wall time in seconds by rule name, "calls" to the number
+		of calls by "Class.method", and "allocations" to the number of
+		objects put into the store.
+		"""
+		if self.__statistics is None:
+			return None
+		statistics = self.__statistics
+		return {
+			"rules": dict([
+				(RULE_NAMES[rule], {"count": count, "seconds": seconds})
+				for rule, (count, seconds)
+				in statistics["rules"].iteritems()
+			]),
+			"calls": dict(statistics["calls"]),
+			"allocations": statistics["allocations"],
+		}
+	
+	
+	def __measuredStep(self):
+		start = time.time()
+		self._step()
+		seconds = time.time() - start
+		
+		statistics = self.__statistics
+		rule, name = self._fired
+		try:
+			entry = statistics["rules"][rule]
+			entry[0] += 1
+			entry[1] += seconds
+		except KeyError:
+			statistics["rules"][rule] = [1, seconds]
+		
+		if rule == RULE.CALL:
+			# The frame of the called method holds the object.
+			behaviour = self._store[ self._deref("self") ].shape().behaviour
+			key = "%s.%s" % (self.__classNames.get(id(behaviour), "?"), name)
+			calls = statistics["calls"]
+			calls[key] = calls.get(key, 0) + 1
+	
+	
+	def _step(self):
+		"""
+		Apply one transition rule; subclasses implement the rules.
+		"""
+		raise NotImplementedError()
+	
+	
+	def finished(self):
+		"""
+		Whether the program terminated.
+		"""
+		raise NotImplementedError()
+	
+	
+	def statement(self):
+		"""
+		The statement of the current configuration as a tree of
+		Constructs, or None if the program terminated or the engine
+		does not materialise the statement.
+		"""
+		return None
+	
+	
+	def redexPath(self):
+		"""
+		The constructs from the statement down to the current redex,
+		or an empty list if the engine does not materialise the
+		statement.
+		"""
+		return []
 
 
 	# ===================
@@ -125,7 +416,7 @@ class InterpreterVisitor(Visitor):
 		"""
 		Returns an unused reference.
 		"""
-		return Reference()
+		return self._store.new()
 
 	def _put(self, obj):
 		"""
@@ -133,14 +424,30 @@ class InterpreterVisitor(Visitor):
 		"""
 		ref = self._new(self._fop)
 		self._store[ref] = obj
+		if self.__unshared is not None:
+			self.__unshared.add(ref)
+		if self.__statistics is not None:
+			self.__statistics["allocations"] += 1
 		return ref
 
 	def _setv(self, state, ref):
 		"""
 		Partially updates the state of the object referred to.
 		"""
+		if self.__unshared is not None and not ref in self.__unshared:
+			# The object belongs to a checkpoint, too.
+			self._store[ref] = self._store[ref].copy()
+			self.__unshared.add(ref)
 		self._store[ref].update(state)
 
+	def _free(self, ref):
+		"""
+		Removes the object referred to from the store.
+		"""
+		del self._store[ref]
+		if self.__unshared is not None:
+			self.__unshared.discard(ref)
+
 
 	# Variable Management (see subsection 3.2.2 in the thesis).
 	
@@ -148,17 +455,18 @@ class InterpreterVisitor(Visitor):
 		"""
 		Introduces temporary variables with given values in the frame.
 		"""
-		if not fop: fop = self._fop
+		if fop is None: fop = self._fop
 		
 		tmpp = self._put(ClassObject(state))
 		self._setv( dict([ (x, tmpp) for x in state.keys() ]), fop )
+		self.__temporaries.setdefault(fop, []).append(tmpp)
 
 
 	def _deref(self, x, fop = None):
 		"""
 		Resolves a variable's value in the frame.
 		"""
-		if not fop: fop = self._fop
+		if fop is None: fop = self._fop
 		
 		frameObj = None
 		containerRef = None
@@ -181,6 +489,80 @@ class InterpreterVisitor(Visitor):
 			raise NameError(msg)
 
 
+	def _lookup(self, var):
+		"""
+		Resolves the value of the Variable var in the current frame like
+		_deref(), but through the slots that scope resolution assigned
+		to it (see module resolver).  Unresolved variables are looked
+		up by name.
+		"""
+		frameSlot = var.frameSlot
+		if frameSlot is None:
+			return self._deref(var.name)
+		store = self._store
+		return store[ store[self._fop].slot(frameSlot) ].slot(var.scope[1])
+
+
+	def _container(self, target):
+		"""
+		Returns the reference of the object that holds the variable
+		the given assignment target names in the current frame.
+		"""
+		if target.frameSlot is not None:
+			return self._store[self._fop].slot(target.frameSlot)
+		try:
+			return self._store[self._fop].variable(target.name)
+		except KeyError:
+			raise NameError(
+				"Cannot assign to undefined variable '%s'." % target.name
+			)
+
+
+	def _resolveCall(self, behaviour, target, methodName, argumentCount,
+			cache):
+		"""
+		Returns the body and the argument mapping of the method that
+		calling methodName with argumentCount arguments on an object
+		of the given behaviour runs; target is the called Variable.
+		
+		The call site's inline cache is a list of the behaviour of the
+		last called object, the method body and the argument mapping.
+		Behaviours never change once they are constructed; the entry
+		therefore stays valid, and its number of arguments checked,
+		until an object of another behaviour is called there, which
+		replaces it.
+		"""
+		if cache[0] is behaviour:
+			return cache[1], cache[2]
+		
+		try:
+			methodBody, argumentMapping = behaviour[methodName]
+		except KeyError:
+			raise AttributeError(
+				"Object '%s' has no method '%s'." % (target.name, methodName)
+			)
+		if len(argumentMapping) != argumentCount:
+			raise IndexError(
+				"Method '%s' of object '%s' takes exactly "
+				"%i arguments; %i were given." %
+				( methodName, target.name,
+				len(argumentMapping), argumentCount )
+			)
+		cache[:] = [ behaviour, methodBody, argumentMapping ]
+		return methodBody, argumentMapping
+	
+	
+	def _callCache(self, call):
+		"""
+		The inline cache of the given Call construct; see _resolveCall().
+		"""
+		try:
+			return self._callCaches[call]
+		except KeyError:
+			cache = self._callCaches[call] = [ None, None, None ]
+			return cache
+
+
 	# Stack and Frame Management (see subsection 3.2.3 in the thesis).
 	
 	def _framefrom(self, ref):
@@ -206,8 +588,50 @@ class InterpreterVisitor(Visitor):
 		"""
 		Removes the topmost frame from the stack.
 		"""
-		self._fop = self._store[self._fop].variable(INAME.PREV)
-		# Maybe call freeUnused() here.
+		frame = self._fop
+		self._fop = self._store[frame].variable(INAME.PREV)
+		# The frame most likely became garbage; see __collectionDue().
+		self.__framesPopped += 1
+		
+		temporaries = self.__temporaries.pop(frame, [])
+		if self.__reclaimFrames:
+			self.__reclaim(frame, temporaries)
+	
+	
+	# Frames and the temporary containers that _declare() creates for them
+	# never become the value of a variable: values are references to
+	# objects created by rule [new], or nil.  Apart from the frames pushed
+	# later, which are popped first, nothing in the store refers to a frame
+	# or its temporaries.  Popping a frame therefore makes it and its
+	# temporaries garbage, unless they escaped to the user through a label.
+	# An escaped frame keeps the frames below it reachable; they are marked
+	# as retained and survive their pop, too.  The garbage collector takes
+	# care of retained frames once they became unreachable.
+	
+	def __reclaim(self, frame, temporaries):
+		"""
+		Free the popped frame and its temporaries if nothing refers to
+		them any more.
+		"""
+		if frame in self.__retainedFrames or self._escaped(frame):
+			self.__retainedFrames.discard(frame)
+			self.__retainedFrames.add(self._fop)
+			return
+		
+		self._free(frame)
+		self.__reclaimedObjects += 1
+		for tmpp in temporaries:
+			if not self._escaped(tmpp):
+				self._free(tmpp)
+				self.__reclaimedObjects += 1
+	
+	
+	def _escaped(self, ref):
+		"""
+		Whether references to the given object exist outside the store.
+		Subclasses that keep references must extend this method.
+		"""
+		return False
 
 
 	# Declaration Parsing (see subsection 3.2.4 in the thesis).
@@ -239,45 +663,476 @@ class InterpreterVisitor(Visitor):
 			Dc.constructor.body,
 			[p.name for p in Dc.constructor.parameters]
 		)
+	
+	def _initialise(self, Dcs):
+		"""
+		Sets up the initial frame and the class registry from the given
+		class declarations as required by transition rule [prog].
+		
+		The class and prototype objects come into existence only when
+		the program first creates an object of the class, or when
+		someone looks at the registry; see _classObject() and
+		_materialiseClasses().  Programs with large class libraries
+		that use a few of them start faster and need less memory.  As
+		in the registry, a later declaration of a class replaces an
+		earlier one.
+		"""
+		self._fop = self._put(ClassObject())
+		self._setv( {INAME.PREV: self._fop}, self._fop )
+		
+		self.__pendingClasses = dict([
+			(DecC.className.name, (i, DecC))
+			for i, DecC in enumerate(Dcs)
+		])
+		
+		classRegistryReference = self._put( ClassObject() )
+		self._setv( {INAME.CLASS: classRegistryReference}, self._fop )
+	
+	def _classObject(self, className):
+		"""
+		Returns the class object of the named class from the class
+		registry, creating it first if necessary.  Raises a NameError
+		if the program declares no such class.
+		"""
+		classRegistryReference = self._store[self._fop].variable(INAME.CLASS)
+		try:
+			return self._store[
+				self._store[classRegistryReference].variable(className)
+			]
+		except KeyError:
+			pass
+		
+		try:
+			position, DecC = self.__pendingClasses.pop(className)
+		except KeyError:
+			raise NameError("Cannot create undefined class '%s'." % className)
+		return self._store[ self.__materialise(DecC, classRegistryReference) ]
+	
+	def _materialiseClasses(self):
+		"""
+		Create the class and prototype objects of all classes that do
+		not have them yet, in the order of their declarations.
+		"""
+		if not self.__pendingClasses: return
+		classRegistryReference = self._store[self._fop].variable(INAME.CLASS)
+		pending = sorted( self.__pendingClasses.values() )
+		self.__pendingClasses = {}
+		for position, DecC in pending:
+			self.__materialise(DecC, classRegistryReference)
+	
+	def __materialise(self, DecC, classRegistryReference):
+		"""
+		Put the class and prototype objects of the declared class into
+		the store and register the class.  Returns the reference to
+		the class object.
+		"""
+		prototypeObject, constructorBody, argumentMapping = self._pc(DecC)
+		protoReference = self._put(prototypeObject)
+		if prototypeObject.methods():
+			behaviour = prototypeObject.shape().behaviour
+			self.__classNames[ id(behaviour) ] = DecC.className.name
+		
+		classObject = ClassObject(
+				{"proto": protoReference},
+				{"ctor": (constructorBody, argumentMapping)}
+			)
+		classReference = self._put( classObject )
+		
+		self._setv( {DecC.className.name: classReference}, classRegistryReference )
+		return classReference
 
 	
 	def _alloc(self):
 		"""
 		Returns the set of currently allocated and used references.
 		"""
-		usedReferences = set(self._fop)
-		_collectReferences(self._fop, self._store, usedReferences)
+		usedReferences = set()
+		for root in self._roots():
+			if root in usedReferences: continue
+			usedReferences.add(root)
+			Interpreter._collectReferences(root, self._store, usedReferences)
 		return usedReferences
 	
+	
+	def _roots(self):
+		"""
+		References from which all used objects are reachable.  Subclasses
+		that keep references outside the store must extend this list.
+		"""
+		return [ self._fop ]
+	
+	
 	@staticmethod
 	def _collectReferences(ref, sto, usedReferences, depth=-1):
 		"""
-		Recursively traverses the network of object references starting
-		from the given point.  Visited references are collected in
+		Traverses the network of object references starting from the
+		given point, breadth first and up to the given depth (negative
+		depths mean no limit).  Visited references are collected in
 		usedReferences.
 		"""
-		if not ref or depth == 0: return
-		
-		newReferences = set( sto[ref].references() ) - usedReferences
-		usedReferences.update( newReferences )
-		
-		for r in newReferences:
-			InterpreterVisitor._collectReferences(
-				r,
-				sto,
-				usedReferences,
-				depth - 1
-			)
+		# The traversal keeps an explicit list; the frame chain of
+		# deeply recursive programs is longer than Python's stack.
+		frontier = [ ref ]
+		while frontier and depth != 0:
+			nextFrontier = []
+			for r in frontier:
+				if r is None: continue
+				try:
+					references = sto[r].references()
+				except KeyError:
+					continue
+				for x in references:
+					if not x in usedReferences:
+						usedReferences.add(x)
+						nextFrontier.append(x)
+			frontier = nextFrontier
+			depth -= 1
 
 	
 	def _freeUnused(self):
 		"""
 		Removes all unreachable, hence, unused objects from the store.
+		Returns the number of removed objects.
+		"""
+		usedReferences = self._alloc()
+		unused = [ ref for ref in self._store.iterkeys()
+				if not ref in usedReferences ]
+		for ref in unused:
+			self._free(ref)
+		
+		# Forget freed objects before the store hands out their
+		# references again.  Temporaries of empty declarations are
+		# unreachable right away.
+		if unused:
+			self.__temporaries = dict([
+				(frame, [ t for t in temporaries if t in usedReferences ])
+				for frame, temporaries in self.__temporaries.iteritems()
+			])
+			self.__retainedFrames = set([ ref for ref in self.__retainedFrames
+					if ref in usedReferences ])
+		return len(unused)
+	
+	
+	# Garbage Collection
+	#
+	# The collector marks all objects reachable from the roots and sweeps
+	# the rest from the store.  Objects become garbage only when a frame is
+	# popped: any assignment finishes a call, object creation or variable
+	# expression, and each of them pops a frame, as do finished blocks.
+	# Steps that pop no frame therefore never trigger a collection.
+	
+	def collect(self):
 		"""
-		for ref in set(self._store.keys()) - self._alloc():
-			del self._store[ref]
+		Run the garbage collector now.  Returns the number of freed
+		objects and the pause in seconds.
+		"""
+		start = time.time()
+		freed = self._freeUnused()
+		pause = time.time() - start
+		
+		self.__stepsSinceCollection = 0
+		self.__framesPopped = 0
+		if self.__collectionThreshold:
+			# Avoid collecting after every step when most objects
+			# are in use.
+			self.__nextThreshold = max(
+				self.__collectionThreshold,
+				2 * len(self._store)
+			)
+		
+		self.__collections += 1
+		self.__collectedObjects += freed
+		self.__totalPause += pause
+		self.__maximumPause = max(self.__maximumPause, pause)
+		return freed, pause
+	
+	
+	def setCollectionPolicy(self, interval=None, threshold=None,
+			reclaimFrames=True):
+		"""
+		Collect garbage every interval steps, and whenever the store
+		grew beyond threshold objects.  None disables the respective
+		trigger.  If reclaimFrames is true, popped frames and their
+		temporaries are freed right away.
+		"""
+		self.__collectionInterval = interval
+		self.__collectionThreshold = threshold
+		self.__nextThreshold = threshold
+		self.__reclaimFrames = reclaimFrames
+	
+	
+	def collectionPolicy(self):
+		"""
+		The collection interval, the threshold, and whether popped
+		frames are reclaimed right away.
+		"""
+		return (
+			self.__collectionInterval,
+			self.__collectionThreshold,
+			self.__reclaimFrames
+		)
+	
+	
+	def collectionStatistics(self):
+		"""
+		The number of collections, the number of objects they freed,
+		the total and maximum pause in seconds, and the number of
+		objects reclaimed when their frame was popped.
+		"""
+		return (
+			self.__collections,
+			self.__collectedObjects,
+			self.__totalPause,
+			self.__maximumPause,
+			self.__reclaimedObjects
+		)
+	
+	
+	def __collectionDue(self):
+		if not self.__framesPopped:
+			return False
+		if self.__collectionInterval and \
+			self.__stepsSinceCollection >= self.__collectionInterval:
+			return True
+		if self.__nextThreshold and \
+			len(self._store) > self.__nextThreshold:
+			return True
+		return False
+	
+	
+	def _compact(self):
+		"""
+		Closes the gaps that removed objects left in the store.  Returns
+		the mapping from old to new references, or None if the store
+		keeps all references.
+		"""
+		mapping = self._store.compact()
+		if mapping:
+			self._remapReferences(mapping)
+		return mapping
+	
+	
+	def _remapReferences(self, mapping):
+		"""
+		Translates the references held outside the store after the store
+		renamed them.  Subclasses that keep references must extend this
+		method.
+		"""
+		self._fop = mapping.get(self._fop)
+		self.__temporaries = dict([
+			(mapping.get(frame), [ mapping.get(t) for t in temporaries ])
+			for frame, temporaries in self.__temporaries.iteritems()
+		])
+		self.__retainedFrames = set([
+			mapping.get(ref) for ref in self.__retainedFrames
+		])
+		if self.__unshared is not None:
+			# Compaction moves copies of the objects; checkpoints keep
+			# the old objects under the old references.
+			self.__unshared = set(self._store.iterkeys())
+	
+	
+	# Checkpoints
+	#
+	# A checkpoint saves the configuration so that the execution can return
+	# to it later on.  Objects are shared between the store and all
+	# checkpoints taken since the object last changed: the store's snapshot
+	# shares the objects, and the parts of the mapping from references to
+	# objects that did not change, with the snapshot before; see module
+	# store.
+	# Before _setv() changes an object that is shared with a checkpoint, it
+	# replaces the object in the store with a copy (copy on write).  Objects
+	# created since the last checkpoint are not shared; their references
+	# are in __unshared.
+	
+	def checkpoint(self):
+		"""
+		Save the current configuration; see restore().
+		"""
+		if not self.__steps in self.__checkpoints:
+			bisect.insort(self.__checkpointSteps, self.__steps)
+		self.__checkpoints[self.__steps] = self._saveConfiguration()
+		self.__unshared = set()
+	
+	
+	def restore(self, step):
+		"""
+		Return to the latest checkpoint taken at or before the given
+		step.  Returns the number of steps executed at that checkpoint;
+		raises a LookupError if there is none.  Later checkpoints remain
+		valid because execution is deterministic.
+		"""
+		i = bisect.bisect_right(self.__checkpointSteps, step)
+		if i == 0:
+			raise LookupError("There is no checkpoint before step %i." % step)
+		
+		steps = self.__checkpointSteps[i-1]
+		self._restoreConfiguration( self.__checkpoints[steps] )
+		self.__unshared = set()
+		return steps
+	
+	
+	def setCheckpointInterval(self, interval=None):
+		"""
+		Take a checkpoint every interval steps; None disables
+		checkpoints and drops the existing ones.
+		"""
+		self.__checkpointInterval = interval
+		if not interval:
+			self.__checkpoints = {}
+			self.__checkpointSteps = []
+			self.__unshared = None
+	
+	
+	def checkpointInterval(self):
+		return self.__checkpointInterval
+	
+	
+	def checkpoints(self):
+		"""
+		Step numbers of the available checkpoints.
+		"""
+		return list(self.__checkpointSteps)
+	
+	
+	def _saveConfiguration(self):
+		"""
+		Returns a copy of the configuration, which _restoreConfiguration()
+		reinstates.  Subclasses with more state must extend both methods.
+		"""
+		return {
+			"store": self._store.snapshot(),
+			"fop": self._fop,
+			"steps": self.__steps,
+			"fired": self._fired,
+			"collection": (
+				self.__stepsSinceCollection,
+				self.__framesPopped,
+				self.__nextThreshold,
+				self.__collections,
+				self.__collectedObjects,
+				self.__totalPause,
+				self.__maximumPause,
+				self.__reclaimedObjects
+			),
+			"temporaries": dict([
+				(frame, list(temporaries))
+				for frame, temporaries in self.__temporaries.iteritems()
+			]),
+			"retainedFrames": set(self.__retainedFrames),
+			"pendingClasses": dict(self.__pendingClasses),
+		}
+	
+	
+	def _restoreConfiguration(self, configuration):
+		self._store.restore( configuration["store"] )
+		self._fop = configuration["fop"]
+		self.__steps = configuration["steps"]
+		self._fired = configuration["fired"]
+		(
+			self.__stepsSinceCollection,
+			self.__framesPopped,
+			self.__nextThreshold,
+			self.__collections,
+			self.__collectedObjects,
+			self.__totalPause,
+			self.__maximumPause,
+			self.__reclaimedObjects
+		) = configuration["collection"]
+		self.__temporaries = dict([
+			(frame, list(temporaries))
+			for frame, temporaries in configuration["temporaries"].iteritems()
+		])
+		self.__retainedFrames = set( configuration["retainedFrames"] )
+		self.__pendingClasses = dict( configuration["pendingClasses"] )
+
 
 
+
+
+class InterpreterVisitor(Interpreter, Visitor):
+	"""
+	Applies the transition rules (section 3.3) to a tree of Constructs.
+	
+	The visitor holds the code part of the configuration (section 3.1.4)
+	as a tree of Constructs; the Interpreter base class contributes the
+	store and the frame object pointer.
+	
+	As the visitor traverses the tree, it applies the transition rules to
+	the Constructs (modifying them!) and accordingly updates its store and
+	frame object pointer.  Every call of step() executes one step of the
+	program.
+	
+	The visitor keeps a cursor on the tree: the path from the root to the
+	construct it evaluates.  A step resumes at the cursor instead of
+	descending from the root again, and the completion rules only climb
+	up as far as constructs finish.  A step therefore takes amortised
+	constant time, and neither depends on nor is bounded by the nesting
+	depth of scoped statements.
+	"""
+	
+	# Returned by the completion functions if a construct stays in place.
+	__KEEP = object()
+	
+	def __init__(self, program, store=None):
+		Interpreter.__init__(self, store)
+		Visitor.__init__(self)
+		# Keeping the root in a list lets the cursor address it like
+		# any other child.
+		self.__root = [ program ]
+		
+		# The cursor is a list of triples (owner, container, key).
+		# Item key of container (an attribute if container is a
+		# Construct) is the child the entry points to; owner is the
+		# construct whose completion rules apply when the child
+		# finished.  The last entry points to the current construct.
+		self.__cursor = [ (None, self.__root, 0) ]
+		self.__fired = False
+		# Runtime errors that leave the configuration stuck.
+		self.__fault = None
+	
+	
+	def _step(self):
+		if self.__fault: raise self.__fault
+		
+		self.__fired = False
+		while not self.__fired:
+			self.__currentConstruct().accept(self)
+	
+	def finished(self):
+		return self.__root[0] is None
+	
+	def statement(self):
+		return self.__root[0]
+	
+	def redexPath(self):
+		# The cursor's first entry points to the statement.  An entry
+		# may address the child of a construct that no entry points
+		# to, such as the scoped statement on the right hand side of
+		# an assignment.
+		path = []
+		for owner, container, key in self.__cursor:
+			if type(container) == list:
+				path.append( container[key] )
+				continue
+			if path and not path[-1] is container:
+				path.append(container)
+			path.append( getattr(container, key) )
+		return path
+	
+	
+	def _saveConfiguration(self):
+		configuration = super(InterpreterVisitor, self)._saveConfiguration()
+		configuration["code"] = \
+			self.__copyCode(self.__root, self.__cursor) + (self.__fault,)
+		return configuration
+	
+	def _restoreConfiguration(self, configuration):
+		super(InterpreterVisitor, self)._restoreConfiguration(configuration)
+		root, cursor, self.__fault = configuration["code"]
+		self.__root, self.__cursor = self.__copyCode(root, cursor)
+	
+	
 	# ================
 	# Transition rules
 	# ================
@@ -289,12 +1144,16 @@ class InterpreterVisitor(Visitor):
 	# section 3.3 in the thesis for a formal definition and explanation
 	# of all transition rules.
 	#
-	# Note that the methods transform the tree they traverse.
+	# Note that the methods transform the tree they traverse.  Methods of
+	# constructs that contain the redex only move the cursor; the
+	# completion rules for these constructs are in the functions
+	# __complete*() below.
 	
 	def visitVarExpression(self, varexpr):
 		"""
 		Transition rule [var].  See thesis for an explanation.
 		"""
+		self._fired = (RULE.VAR, None)
 		self._push( self._store[self._fop].copy() )
 		self.__replaceConstructWith(
 			MethodScopedStatement( Return(varexpr.var) )
@@ -304,35 +1163,28 @@ class InterpreterVisitor(Visitor):
 	def visitCall(self, call):
 		"""
 		Transition rule [call].  See thesis for an explanation.
+		
+		Each call site caches the method of the last called object's
+		behaviour; see _resolveCall().
 		"""
-		targetReference =  self._deref(call.target.name)
+		targetReference =  self._lookup(call.target)
 		calledObject = self._store[ targetReference ]
-			
-		try:
-			methodBody, argumentMapping = \
-				calledObject.method(call.methodName.name)
-		except KeyError:
-			raise AttributeError(
-				"Object '%s' has no method '%s'." %
-				(call.target.name, call.methodName.name)
-			)
-		if len(argumentMapping) != len(call.arguments):
-			raise IndexError(
-				"Method '%s' of object '%s' takes exactly "
-				"%i arguments; %i were given." %
-				( call.methodName.name, call.target.name,
-				len(argumentMapping), len(call.arguments) )
-			)
+		methodBody, argumentMapping = self._resolveCall(
+			calledObject.shape().behaviour, call.target,
+			call.methodName.name, len(call.arguments),
+			self._callCache(call)
+		)
 		binding = dict([
-				(argumentMapping[i], self._deref(call.arguments[i].name))
+				(argumentMapping[i], self._lookup(call.arguments[i]))
 				for i in range(0, len(argumentMapping))
 			])
 		binding["self"] = targetReference
 		self._push( self._framefrom(targetReference) )
 		self._declare(binding)
 		
+		self._fired = (RULE.CALL, call.methodName.name)
 		self.__replaceConstructWith(
-			MethodScopedStatement(methodBody.copy())
+			MethodScopedStatement(methodBody)
 		)
 		
 
@@ -340,12 +1192,7 @@ class InterpreterVisitor(Visitor):
 		"""
 		Transition rule [new].  See thesis for an explanation.
 		"""
-		classRegistry = self._store[ self._store[self._fop].variable(INAME.CLASS) ]
-		try:
-			classObject = self._store[ classRegistry.variable(new.className.name) ]
-		except KeyError:
-			raise NameError("Cannot create undefined class '%s'." % new.className.name)
-		
+		classObject = self._classObject(new.className.name)
 		objectPrototype = self._store[ classObject.variable("proto") ]
 		newReference = self._put( objectPrototype.copy() )
 		
@@ -357,7 +1204,7 @@ class InterpreterVisitor(Visitor):
 				(new.className.name, len(argumentMapping), len(new.arguments))
 			)
 		binding = dict([
-				(argumentMapping[i], self._deref(new.arguments[i].name))
+				(argumentMapping[i], self._lookup(new.arguments[i]))
 				for i in range(0, len(argumentMapping))
 			])
 				
@@ -366,9 +1213,10 @@ class InterpreterVisitor(Visitor):
 		self._push( self._framefrom(newReference) )
 		self._declare(binding)
 		
+		self._fired = (RULE.NEW, new.className.name)
 		self.__replaceConstructWith(
-			MethodScopedStatement( Sequence(
-				[ constructorBody.copy(), Return( Variable("self") ) ]
+			MethodScopedStatement( SequenceActivation(
+				[ constructorBody, Return( Variable("self") ) ]
 			))
 		)
 
@@ -381,35 +1229,22 @@ class InterpreterVisitor(Visitor):
 		
 		# [ass1]
 		if isinstance(ass.rhs, Expression):
-			self.__descendTo(ass, "rhs")
-			
+			# The assignment may be part of a shared body; record
+			# the progress in a fresh one.
+			ass = Assign(ass.target, ass.rhs)
+			self.__setCurrentConstruct(ass)
+			self.__descendTo(ass, ass, "rhs")
+		
+		# [ass2]; see __completeAssign() for [ass3].
 		elif isinstance(ass.rhs, ScopedStatement):
-			self.__descendTo(ass.rhs, "body")
-			
-			# [ass3]
-			if isinstance(ass.rhs.body, ReturnValue):
-				self._pop()
-				try:
-					containerRef = self._store[ self._fop ].variable(ass.target.name)
-				except KeyError:
-					raise NameError(
-						"Cannot assign to undefined variable '%s'." %
-						ass.target.name
-					)
-				self._setv(
-					dict([ (ass.target.name, ass.rhs.body.reference) ]),
-					containerRef
-				)
-				self.__replaceConstructWith(None)
-			
-			# [ass2] is handled implicitly because it does not
-			# change the tree any further.
+			self.__descendTo(ass, ass.rhs, "body")
 	
 	
 	def visitSkip(self, skip):
 		"""
 		Transition rule [skip].  See thesis for an explanation.
 		"""
+		self._fired = (RULE.SKIP, None)
 		self.__replaceConstructWith(None)
 	
 	
@@ -417,8 +1252,9 @@ class InterpreterVisitor(Visitor):
 		"""
 		Transition rule [return].  See thesis for an explanation.
 		"""
+		self._fired = (RULE.RETURN, None)
 		self.__replaceConstructWith(
-			ReturnValue( self._deref(ret.var.name) )
+			ReturnValue( self._lookup(ret.var) )
 		)
 	
 	
@@ -428,6 +1264,7 @@ class InterpreterVisitor(Visitor):
 		"""
 		self._push( self._store[self._fop].copy() )
 		self._declare( self._pv(block.declaredVars) )
+		self._fired = (RULE.BLOCK, None)
 		self.__replaceConstructWith(
 			BlockScopedStatement(block.sequence)
 		)
@@ -440,8 +1277,8 @@ class InterpreterVisitor(Visitor):
 		
 		# Evaluate booleans; this implements the semantic function B
 		# from the thesis.
-		ref1 = self._deref(ite.bool.var1.name)
-		ref2 = self._deref(ite.bool.var2.name)
+		ref1 = self._lookup(ite.bool.var1)
+		ref2 = self._lookup(ite.bool.var2)
 
 		if type(ite.bool) == BoolEq:
 			b = (ref1 == ref2)
@@ -449,8 +1286,10 @@ class InterpreterVisitor(Visitor):
 			b = (ref1 != ref2)
 		
 		if b:
+			self._fired = (RULE.IF1, None)
 			self.__replaceConstructWith( ite.trueStatement )
 		else:
+			self._fired = (RULE.IF2, None)
 			self.__replaceConstructWith( ite.falseStatement )
 
 
@@ -458,14 +1297,15 @@ class InterpreterVisitor(Visitor):
 		"""
 		Transition rule [while].  See thesis for an explanation.
 		"""
+		self._fired = (RULE.WHILE, None)
 		self.__replaceConstructWith(
 			IfThenElse(
 				whil.bool,
 				# Omit the block statement so we don't increase
 				# the recursion depth. See visitSequence() for
 				# respective flattening.
-				Sequence([
-					whil.bodyStatement.copy(),
+				SequenceActivation([
+					whil.bodyStatement,
 					whil
 				]),
 				Skip()
@@ -478,73 +1318,123 @@ class InterpreterVisitor(Visitor):
 		Transition rules [comp1], [comp2] and [comp3].  See thesis for
 		an explanation.
 		"""
-		self.__descendTo(seq.statements, 0)
-		if not seq.statements[0]: del seq.statements[0]
+		if not isinstance(seq, SequenceActivation):
+			if len(seq.statements) == 1:
+				# Replace sequences of one element with the
+				# element.  This effectively flattens nested
+				# sequences resulting from while statements.
+				self.__setCurrentConstruct(seq.statements[0])
+				return
+			
+			seq = SequenceActivation(seq.statements)
+			self.__setCurrentConstruct(seq)
 		
-		# List is empty or a return value was generated.
-		if not seq.statements:
-			self.__replaceConstructWith(None)
-		elif isinstance(seq.statements[0], ReturnValue):
-			self.__replaceConstructWith(seq.statements[0])
-		elif len(seq.statements) == 1:
-			# Replace sequences of one element with the element.
-			# This effectively flattens nested sequences resulting
-			# from while statements.
-			self.__replaceConstructWith(seq.statements[0])
-
+		self.__descendTo(seq, seq, "current")
+	
 	
 	def visitBlockScopedStatement(self, B):
 		"""
 		Transition rules [subb1], [subb2] and [subb3].  See thesis for
 		an explanation.
 		"""
-		self.__descendTo(B, "body")
-		
-		if not B.body or isinstance(B.body, ReturnValue):
-			self._pop()
-			self.__replaceConstructWith(B.body)
-
+		self.__descendTo(B, B, "body")
+	
 	
 	def visitMethodScopedStatement(self, B):
 		"""
 		Transition rules [subc1], [subc2] and [subc3].  See thesis for
 		an explanation.
 		"""
-		self.__descendTo(B, "body")
-		
-		if not B.body or isinstance(B.body, ReturnValue):
-			self._pop()
-			# Note that we always return None and terminate this
-			# block (in contrast to visitBlockScopedStatement()).
-			self.__replaceConstructWith(None)
+		self.__descendTo(B, B, "body")
 	
 	
 	def visitProgram(self, prog):
 		"""
 		Transition rule [prog].  See thesis for an explanation.
 		"""
-		self._fop = self._put(ClassObject())
-		self._setv( {INAME.PREV: self._fop}, self._fop )
-		
-		classRegistryState = {}
-		for DecC in prog.classDeclarations:
-			prototypeObject, constructorBody, argumentMapping = self._pc(DecC)
-			protoReference = self._put(prototypeObject)
-			
-			classObject = ClassObject(
-					{"proto": protoReference},
-					{"ctor": (constructorBody, argumentMapping)}
-				)
-			classReference = self._put( classObject )
-			
-			classRegistryState[DecC.className.name] = classReference
-		
-		classRegistryReference = self._put( ClassObject(classRegistryState) )
-		self._setv( {INAME.CLASS: classRegistryReference}, self._fop )
-		
+		self._initialise(prog.classDeclarations)
+		self._fired = (RULE.PROG, None)
 		self.__replaceConstructWith(prog.initialStatement)
 
 
+	# ================
+	# Completion rules
+	# ================
+	#
+	# Once the child of a construct finished or produced a return value,
+	# the construct itself may finish, too.  The functions below
+	# implement the respective rules.  They return the construct's
+	# replacement, or __KEEP if the construct stays in the tree.
+	
+	def __completeAssign(self, ass, container, child):
+		"""
+		Transition rule [ass3].  See thesis for an explanation.
+		"""
+		if container is ass:
+			# [ass1] turned the expression into a scoped statement;
+			# continue with [ass2] on the assignment itself.
+			self.__cursor.pop()
+			return self.__KEEP
+		
+		if not child:
+			# [subc1] finished the method without a return value,
+			# and no rule applies to the assignment.
+			self.__fault = AttributeError(
+				"Cannot assign to '%s': the method "
+				"returned no value." % ass.target.name
+			)
+			return self.__KEEP
+		elif not isinstance(child, ReturnValue):
+			return self.__KEEP
+		
+		self._pop()
+		self._setv(
+			dict([ (ass.target.name, child.reference) ]),
+			self._container(ass.target)
+		)
+		return None
+	
+	
+	def __completeSequence(self, seq, container, child):
+		"""
+		Transition rules [comp2] and [comp3].  See thesis for an
+		explanation.
+		"""
+		# List is empty or a return value was generated.
+		if not child and not seq.advance():
+			return None
+		elif isinstance(seq.current, ReturnValue):
+			return seq.current
+		elif seq.remaining() == 1:
+			# See visitSequence().
+			return seq.current
+		return self.__KEEP
+	
+	
+	def __completeBlockScopedStatement(self, B, container, child):
+		"""
+		Transition rules [subb1] and [subb2].  See thesis for an
+		explanation.
+		"""
+		if not child or isinstance(child, ReturnValue):
+			self._pop()
+			return child
+		return self.__KEEP
+	
+	
+	def __completeMethodScopedStatement(self, B, container, child):
+		"""
+		Transition rules [subc1] and [subc2].  See thesis for an
+		explanation.
+		"""
+		if not child or isinstance(child, ReturnValue):
+			self._pop()
+			# Note that we always return None and terminate this
+			# block (in contrast to BlockScopedStatements).
+			return None
+		return self.__KEEP
+	
+	
 	# =================
 	# Utility functions
 	# =================
@@ -553,43 +1443,136 @@ class InterpreterVisitor(Visitor):
 	# _in place_.  The problem is that Constructs don't know their parent
 	# otherwise and thus could not replace themselves.
 	
-	def __descendTo(self, construct, key):
+	def __currentConstruct(self):
 		"""
-		Apply self to child 'key' of the given Construct and save this
-		access path.  That way, nodes can replace themselves in the
-		tree (using __replaceConstruct()).
+		The construct the cursor points to.
 		"""
-		if type(construct) == list:
-			self.__currentConstructAccessor.append(
-				(construct.__setitem__, key)
-			)
-			construct.__getitem__(key).accept(self)
-		elif isinstance(construct, Construct):
-			self.__currentConstructAccessor.append(
-				(construct.__setattr__, key)
-			)
-			construct.__getattribute__(key).accept(self)
+		owner, container, key = self.__cursor[-1]
+		if type(container) == list:
+			return container[key]
+		return getattr(container, key)
+	
+	
+	def __setCurrentConstruct(self, construct):
+		"""
+		Replace the construct the cursor points to without applying
+		any rules.
+		"""
+		owner, container, key = self.__cursor[-1]
+		if type(container) == list:
+			container[key] = construct
 		else:
+			setattr(container, key, construct)
+	
+	
+	def __descendTo(self, owner, container, key):
+		"""
+		Move the cursor to child 'key' of the given container (a list or
+		a Construct) on behalf of owner.  That way, nodes can replace
+		themselves in the tree (using __replaceConstructWith()).
+		"""
+		if type(container) != list and not isinstance(container, Construct):
 			raise TypeError("Expected a Construct or a list of Constructs.")
-		
-		self.__currentConstructAccessor.pop()
-
+		self.__cursor.append( (owner, container, key) )
+	
 	
 	def __replaceConstructWith(self, construct):
 		"""
-		Replace the current node in the tree.  In order for this to
-		work, the visitor must have traversed the tree using
-		__descendTo().
+		Replace the current node in the tree and apply the completion
+		rules of the enclosing constructs.  This finishes the step.
+		"""
+		self.__fired = True
+		while True:
+			self.__setCurrentConstruct(construct)
+			owner, container, key = self.__cursor[-1]
+			if owner is None:
+				return
+			
+			construct = self.__completions[type(owner)](
+				self, owner, container, construct
+			)
+			if construct is self.__KEEP:
+				return
+			self.__cursor.pop()
+	
+	
+	__completions = {
+		Assign: __completeAssign,
+		SequenceActivation: __completeSequence,
+		BlockScopedStatement: __completeBlockScopedStatement,
+		MethodScopedStatement: __completeMethodScopedStatement,
+	}
+	
+	
+	# Steps modify only the constructs that the interpreter created, and
+	# of each such construct only one child: the one that contains the
+	# redex.  Starting from the root, these constructs form a chain; all
+	# other constructs are parts of the program and never change.  Copying
+	# the chain therefore copies the code part of the configuration.  The
+	# cursor points into the chain, but the chain may go on below it: an
+	# assignment leaves the cursor while its right hand side runs.
+	
+	def __copyCode(self, root, cursor):
+		"""
+		Returns copies of the root and the cursor that share everything
+		except the chain of constructs that contains the redex.
+		"""
+		copies = {}
+		rootCopy = list(root)
+		copies[ id(root) ] = rootCopy
+		
+		construct, key = rootCopy, 0
+		while key is not None:
+			if type(construct) == list:
+				child = construct[key]
+			else:
+				child = getattr(construct, key)
+			if not type(child) in self.__duplicates:
+				break
+			
+			duplicate, childKey = self.__duplicates[type(child)]
+			childCopy = duplicate(child)
+			copies[ id(child) ] = childCopy
+			if type(construct) == list:
+				construct[key] = childCopy
+			else:
+				setattr(construct, key, childCopy)
+			construct, key = childCopy, childKey
+		
+		cursorCopy = [
+			( copies.get(id(owner)), copies[ id(container) ], key )
+			for owner, container, key in cursor
+		]
+		return rootCopy, cursorCopy
+	
+	
+	def __copyCondition(ite):
+		"""
+		Rule [while] creates a conditional statement whose then branch
+		is a sequence activation; the statement itself is the redex.
 		"""
-		set, key = self.__currentConstructAccessor[-1]
-		set(key, construct)
+		trueStatement = ite.trueStatement
+		if isinstance(trueStatement, SequenceActivation):
+			trueStatement = trueStatement.fork()
+		return IfThenElse(ite.bool, trueStatement, ite.falseStatement)
+	
+	
+	# For each construct the interpreter creates, a function that returns
+	# a shallow copy and the key of the child that contains the redex.
+	__duplicates = {
+		SequenceActivation: (lambda seq: seq.fork(), "current"),
+		Assign: (lambda ass: Assign(ass.target, ass.rhs), "rhs"),
+		BlockScopedStatement: (lambda B: BlockScopedStatement(B.body), "body"),
+		MethodScopedStatement: (lambda B: MethodScopedStatement(B.body), "body"),
+		IfThenElse: (__copyCondition, None),
+	}
 
 
 
-class InspectorInterpreterVisitor(InterpreterVisitor):
+class Inspector(object):
 	"""
-	Interprets a program represented by a tree of Constructs and allows
-	access to runtime information for inspection and debugging.
+	Mix-in for Interpreters that allows access to runtime information for
+	inspection and debugging.
 	
 	The class provides methods to conveniently access objects in the store
 	through "object paths".  Objects may also be labelled for later
@@ -598,7 +1581,7 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 	
 	# Grammar to parse user input into the data structures expected by
 	# the  methods label(), unlabel() and inspect().
-	identifierGrammar = pymeta.grammar.OMeta.makeGrammar(
+	identifierGrammar = LazyGrammar(
 		"""
 		name	::= <letterOrDigit>+:ls					=> "".join(ls)
 		segment	::= (<name>:t ':' => t)?:typ <name>:val			=> (typ, val)
@@ -606,13 +1589,30 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		objpath	::= <spaces> <frstseg>:head ('.' <segment>)*:tail '.'?	=> [head] + tail
 		label	::= <spaces> <name>
 		""",
-		globals()
+		globals(),
+		name="Identifier"
 	)
 	
-	def __init__(self, replaceRootConstruct):
-		InterpreterVisitor.__init__(self, replaceRootConstruct)
-		
+	def __init__(self):
+		# Labels map names to references; the inverse map gives the
+		# names of a labelled reference without searching.
 		self.__labels = {}
+		self.__labelNames = {}
+		# Reverse references: maps each referenced object to the set
+		# of (holder, variable) pairs that refer to it.
+		self.__holders = {}
+		self.__indexStore()
+		# Capabilities among watched labels, and the steps in which
+		# they appeared; see watch().
+		self.__reachability = Reachability(
+			self.__successors, self.__predecessors
+		)
+		self.__capabilityEvents = []
+		# The objects that reach tracked labels: the same graph with
+		# the references reversed; see trackReachable().
+		self.__ancestors = Reachability(
+			self.__predecessors, self.__successors
+		)
 	
 	
 	def inspect(self, objectPath, depth=0):
@@ -628,23 +1628,18 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		"""
 		start = self.__lookup(objectPath)
 		references = set([start])
-		InterpreterVisitor._collectReferences(
+		Interpreter._collectReferences(
 			start, self._store, references, depth )
 		
 		objects = {}
 		for ref in references:
-			if not ref in self._store.iterkeys(): continue
+			if not ref in self._store: continue
 			
 			obj = self._store[ref]
 			
 			state = {}
 			for var in obj.variables():
-				# Translate internalised names to a human
-				# readable form.
-				name = {
-					INAME.CLASS:"int:CLASS",
-					INAME.PREV:"int:PREV"
-				}.get(var, var)
+				name = self.__nameVariable(var)
 				state[name] = self.__nameReference(obj.variable(var))
 			
 			beh = []
@@ -658,13 +1653,109 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		return objects
 	
 	
+	def holders(self, objectPath):
+		"""
+		Get the list of objects that refer to the object at the given
+		path.  The list contains pairs of the holder's name and the
+		name of the variable holding the reference.
+		"""
+		ref = self.__lookup(objectPath)
+		return [
+			( self.__nameReference(holder), self.__nameVariable(var) )
+			for holder, var in self.__holders.get(ref, ())
+		]
+	
+	
+	def paths(self, objectPath, depth):
+		"""
+		Get all object paths with at most depth segments that lead from
+		the current frame or a label to the object at the given path.
+		Each object on the way appears in at most one path, so the
+		result contains the shortest paths only.
+		"""
+		target = self.__lookup(objectPath)
+		
+		roots = { self._fop: [] }
+		for name in sorted(self.__labels.keys(), reverse=True):
+			roots[ self.__labels[name] ] = [ "label:%s" % name ]
+		
+		paths = []
+		if target in roots:
+			paths.append( roots[target] )
+		
+		# Breadth first search backwards along the reverse references.
+		visited = set([ target ])
+		frontier = [ (target, []) ]
+		while frontier and depth > 0:
+			nextFrontier = []
+			for ref, segments in frontier:
+				for holder, var in self.__holders.get(ref, ()):
+					holderSegments = [ self.__nameVariable(var) ] + segments
+					if holder in roots:
+						paths.append( roots[holder] + holderSegments )
+					if not holder in visited:
+						visited.add(holder)
+						nextFrontier.append( (holder, holderSegments) )
+			frontier = nextFrontier
+			depth -= 1
+		
+		paths.sort(key=lambda p: (len(p), p))
+		return [ ".".join(p) or "." for p in paths ]
+	
+	
+	def reachable(self, name):
+		"""
+		Whether the program can reach the object with the given label,
+		that is, whether a chain of variables leads from the current
+		frame to the object.  Internalised names do not count: through
+		them, every object of the callers would be reachable.
+		
+		For labels that trackReachable() follows, the answer takes
+		constant time; otherwise, it takes a search through all objects
+		that reach the labelled one.
+		"""
+		if not name in self.__labels:
+			raise KeyError("Label '%s' does not exist." % name)
+		if self.__ancestors.watches(name):
+			return self.__ancestors.includes(name, self._fop)
+		
+		ancestors = Reachability(self.__predecessors, self.__successors)
+		ancestors.watch(name, self.__labels[name])
+		return ancestors.includes(name, self._fop)
+	
+	
+	def trackReachable(self, name):
+		"""
+		Keep the set of objects that reach the object with the given
+		label up to date while the program changes the store, so that
+		reachable() need not search it.
+		"""
+		if not name in self.__labels:
+			raise KeyError("Label '%s' does not exist." % name)
+		self.__ancestors.watch(name, self.__labels[name])
+	
+	
+	def untrackReachable(self, name):
+		self.__ancestors.unwatch(name)
+	
+	
 	def label(self, objectPath, name):
 		"""
 		Assign an (absolute) label to the given object path.  The label
 		can be used to later on refer to an object from the current
 		(relative) context.
 		"""
-		self.__labels[name] = self.__lookup(objectPath)
+		ref = self.__lookup(objectPath)
+		watched = name in self.__reachability.watched()
+		tracked = name in self.__ancestors.watched()
+		if name in self.__labels:
+			self.__removeLabel(name)
+		self.__labels[name] = ref
+		self.__labelNames.setdefault(ref, set()).add(name)
+		if watched:
+			self.__reachability.watch(name, ref)
+		if tracked:
+			self.__ancestors.watch(name, ref)
 	
 	
 	def unlabel(self, name):
@@ -673,21 +1764,15 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		deleted.  Otherwise, it will be interpreted as object path and
 		all labels denoting the resolved reference will be removed.
 		"""
-		if name in self.__labels.iterkeys():
-			del self.__labels[name]
+		if not type(name) == list:
+			if name in self.__labels:
+				self.__removeLabel(name)
 			return
 		try:
-			if not type(name) == list: return
-			
 			ref = self.__lookup(name)
-			if ref in self.__labels.itervalues():
-				# Avoid mutating iterated lists.
-				delList = [
-					k
-					for k,v in self.__labels.iteritems()
-					if v == ref
-				]
-				for k in delList: del self.__labels[k]
+			# Avoid mutating iterated sets.
+			for k in list(self.__labelNames.get(ref, ())):
+				self.__removeLabel(k)
 		except:
 			# We tried to do something useful with the name and
 			# failed.  Now let's simply get over with it.
@@ -701,22 +1786,291 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		return self.__labels.keys()
 	
 	
+	def watch(self, name):
+		"""
+		Track which other watched labels the object with the given label
+		reaches, that is, which capabilities it holds.  Whenever one of
+		the watched objects gains a capability for another, the step and
+		the two labels are added to capabilityEvents().
+		"""
+		if not name in self.__labels:
+			raise KeyError("Label '%s' does not exist." % name)
+		self.__reachability.watch(name, self.__labels[name])
+	
+	
+	def unwatch(self, name):
+		self.__reachability.unwatch(name)
+	
+	
+	def watched(self):
+		"""
+		Labels whose capabilities are tracked.
+		"""
+		return self.__reachability.watched()
+	
+	
+	def capabilities(self):
+		"""
+		Pairs of watched labels (source, target) such that the object
+		labelled source reaches the one labelled target along member
+		variables.
+		"""
+		return self.__reachability.reaches()
+	
+	
+	def capabilityEvents(self, start=0):
+		"""
+		Triples (step, source, target) for each capability that appeared
+		among the watched labels, in the order of their appearance.  The
+		list omits the first start events.
+		"""
+		return self.__capabilityEvents[start:]
+	
+	
+	def staleReachability(self):
+		"""
+		Labels whose capabilities or whose set of objects that reach
+		them differ from a search from scratch; see Reachability.stale().
+		"""
+		return sorted(set(
+			self.__reachability.stale() + self.__ancestors.stale()
+		))
+	
+	
+	def compact(self):
+		"""
+		Close the gaps in the store; see Interpreter._compact().
+		Returns the number of renamed references.
+		"""
+		mapping = self._compact()
+		if not mapping: return 0
+		return len([ r for r in mapping if mapping[r] != r ])
+	
+	
+	def _roots(self):
+		return super(Inspector, self)._roots() + self.__labels.values()
+	
+	
+	def _saveConfiguration(self):
+		configuration = super(Inspector, self)._saveConfiguration()
+		configuration["labels"] = dict(self.__labels)
+		return configuration
+	
+	
+	def _restoreConfiguration(self, configuration):
+		# Only the objects that differ from the checkpoint change the
+		# reverse references.
+		changes = self._store.changes( configuration["store"] )
+		for ref in changes:
+			if ref in self._store:
+				self.__unindexObject(ref, self._store[ref])
+		super(Inspector, self)._restoreConfiguration(configuration)
+		for ref in changes:
+			if ref in self._store:
+				self.__indexObject(ref, self._store[ref])
+		
+		self.__labels = dict(configuration["labels"])
+		self.__labelNames = {}
+		for name, ref in self.__labels.iteritems():
+			self.__labelNames.setdefault(ref, set()).add(name)
+		
+		self.__capabilityEvents = [
+			event for event in self.__capabilityEvents
+			if event[0] <= self.steps()
+		]
+		self.__rewatch()
+	
+	
+	def _escaped(self, ref):
+		return ref in self.__labelNames or \
+			super(Inspector, self)._escaped(ref)
+	
+	
+	def _remapReferences(self, mapping):
+		super(Inspector, self)._remapReferences(mapping)
+		for name, ref in self.__labels.items():
+			self.__labels[name] = mapping.get(ref)
+		self.__labelNames = dict([
+			(mapping.get(ref), names)
+			for ref, names in self.__labelNames.iteritems()
+		])
+		self.__indexStore()
+		self.__rewatch()
+	
+	
+	# Maintenance of the reverse references.  All changes to the store
+	# pass through _put(), _setv() and _free(); compaction renames all
+	# references at once, so the index is rebuilt afterwards.  The index
+	# always equals the one __indexStore() would build, even for objects
+	# that left the store but are still referenced; hence restoring a
+	# checkpoint need only re-index the objects that differ.
+	
+	def _put(self, obj):
+		ref = super(Inspector, self)._put(obj)
+		self.__indexObject(ref, obj)
+		
+		# A new object cannot be referenced yet, but it may reach
+		# tracked labels, such as a frame whose parameters do.
+		if self.__ancestors.active():
+			self.__ancestors.update([], [
+				(obj.variable(var), ref) for var in obj.variables()
+				if not var in (INAME.PREV, INAME.CLASS)
+			])
+		return ref
+	
+	
+	def _setv(self, state, ref):
+		obj = self._store[ref]
+		watching = self.__reachability.active() or \
+			self.__ancestors.active()
+		removed = []
+		added = []
+		for var, value in state.iteritems():
+			try:
+				previous = obj.variable(var)
+				self.__removeHolder(previous, ref, var)
+			except KeyError:
+				previous = None
+			self.__addHolder(value, ref, var)
+			
+			if watching and previous != value and \
+				not var in (INAME.PREV, INAME.CLASS):
+				removed.append( (ref, previous) )
+				added.append( (ref, value) )
+		super(Inspector, self)._setv(state, ref)
+		
+		if not removed:
+			return
+		if self.__reachability.active():
+			for source, target in self.__reachability.update(removed, added):
+				# The step counter advances after the step.
+				self.__capabilityEvents.append(
+					(self.steps() + 1, source, target)
+				)
+		if self.__ancestors.active():
+			self.__ancestors.update(
+				[ (target, holder) for holder, target in removed ],
+				[ (target, holder) for holder, target in added ]
+			)
+	
+	
+	def _free(self, ref):
+		obj = self._store[ref]
+		# The edges of the object, in both directions, for updating
+		# the capabilities and the objects that reach tracked labels.
+		if self.__reachability.active() or self.__ancestors.active():
+			targets = self.__successors(ref)
+			holders = self.__predecessors(ref)
+		self.__unindexObject(ref, obj)
+		super(Inspector, self)._free(ref)
+		if self.__reachability.active():
+			self.__reachability.removed(ref, targets)
+		if self.__ancestors.active():
+			self.__ancestors.removed(ref, holders)
+	
+	
+	def __addHolder(self, ref, holder, var):
+		if ref is None: return
+		try:
+			self.__holders[ref].add( (holder, var) )
+		except KeyError:
+			self.__holders[ref] = set([ (holder, var) ])
+	
+	
+	def __removeHolder(self, ref, holder, var):
+		holders = self.__holders.get(ref)
+		if not holders: return
+		holders.discard( (holder, var) )
+		if not holders:
+			del self.__holders[ref]
+	
+	
+	def __indexStore(self):
+		self.__holders = {}
+		for ref, obj in self._store.iteritems():
+			self.__indexObject(ref, obj)
+	
+	
+	def __indexObject(self, holder, obj):
+		for var in obj.variables():
+			self.__addHolder(obj.variable(var), holder, var)
+	
+	
+	def __unindexObject(self, holder, obj):
+		for var in obj.variables():
+			self.__removeHolder(obj.variable(var), holder, var)
+	
+	
+	def __removeLabel(self, name):
+		ref = self.__labels.pop(name)
+		names = self.__labelNames[ref]
+		names.discard(name)
+		if not names:
+			del self.__labelNames[ref]
+		self.__reachability.unwatch(name)
+		self.__ancestors.unwatch(name)
+	
+	
+	# The graph for capability reachability: member variables, but not the
+	# internalised names, which only the semantics uses.
+	
+	def __successors(self, ref):
+		try:
+			obj = self._store[ref]
+		except KeyError:
+			return []
+		return [
+			obj.variable(var) for var in obj.variables()
+			if not var in (INAME.PREV, INAME.CLASS)
+		]
+	
+	
+	def __predecessors(self, ref):
+		return [
+			holder for holder, var in self.__holders.get(ref, ())
+			if not var in (INAME.PREV, INAME.CLASS)
+		]
+	
+	
+	def __rewatch(self):
+		"""
+		Compute the capabilities of the watched labels and the objects
+		that reach the tracked labels from scratch.
+		"""
+		for reachability in (self.__reachability, self.__ancestors):
+			reachability.rebuild(dict([
+				(name, self.__labels[name])
+				for name in reachability.watched()
+				if name in self.__labels
+			]))
+	
+	
+	def __nameVariable(self, var):
+		"""
+		Translate internalised names to a human readable form.
+		"""
+		return {
+			INAME.CLASS:"int:CLASS",
+			INAME.PREV:"int:PREV"
+		}.get(var, var)
+	
+	
 	def __nameReference(self, ref):
 		"""
 		Find best absolute object path for the given reference.  This
 		path doubles as the reference's "name" (for the user).
 		"""
-		if not ref in self._store.iterkeys():
+		if not ref in self._store:
 			return "NIL"
 		
 		labels = [
 			"label:%s" % l
-			for l, r in self.__labels.iteritems() if r == ref
+			for l in sorted(self.__labelNames.get(ref, ()))
 		]
 		if labels:
 			return ", ".join(labels)
 		else:
-			return "ref:0x%x" % id(ref)
+			return "ref:%s" % self._store.name(ref)
 	
 	
 	def __lookup(self, objectPath):
@@ -725,8 +2079,10 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 		
 		See above grammar and  ClassInterpreterCmd.help_objpath() for
 		a syntax description of object paths.  This method expects
-		the path to be parsed already.
+		the path to be parsed already.  The classes all appear in the
+		class registry from the start, so paths make them exist.
 		"""
+		self._materialiseClasses()
 		ref = self._fop
 		
 		for typ, val in objectPath:
@@ -744,7 +2100,7 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 				
 				# Labeled objects
 				elif typ.lower() in [ "l", "label" ]:
-					if self.__labels.has_key(val):
+					if val in self.__labels:
 						ref = self.__labels[val]
 						continue
 					else:
@@ -760,28 +2116,38 @@ class InspectorInterpreterVisitor(InterpreterVisitor):
 					else:
 						addr = int(val)
 					
-					# There should be exactly one object in
-					# the store that has the given address.
-					refs = [ r for r in self._store.keys() if id(r) == addr ]
-					if not refs:
+					try:
+						ref = self._store.reference(addr)
+					except KeyError:
 						raise KeyError("Found no reference with address '%s'." % val)
-					ref = refs[0]
 					continue
 				
 				else:
 					raise KeyError("Unknown prefix '%s'." % typ)
 		
-			if not self._store.has_key(ref):
+			if not ref in self._store:
 				raise KeyError("There is no object at "
 					"reference '%s' (anymore?)." %
 					self.__nameReference(ref))
 			obj = self._store[ref]
 			
-			if not val in obj.variables():
+			try:
+				ref = obj.variable(val)
+			except KeyError:
 				raise KeyError("The object at reference '%s' "
 					"has no member variable '%s'." %
 					(self.__nameReference(ref), val))
-			
-			ref = obj.variable(val)
 		
 		return ref
+
+
+
+class InspectorInterpreterVisitor(Inspector, InterpreterVisitor):
+	"""
+	Interprets a program represented by a tree of Constructs and allows
+	access to runtime information for inspection and debugging.
+	"""
+	
+	def __init__(self, program, store=None):
+		InterpreterVisitor.__init__(self, program, store)
+		Inspector.__init__(self)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from compiler import CompilerVisitor, OPCODE, COMPLETIONS
+from interpreter import Interpreter, Inspector, ClassObject, RULE
+
+
+class AbstractMachine(Interpreter):
+	"""
+	Executes programs compiled into lists of instructions.
+	
+	The machine is an alternative to the InterpreterVisitor.  Instead of
+	searching the redex in a tree of Constructs and rewriting the tree, it
+	keeps a program counter into the instruction list of the current
+	method and a stack of continuations, that is, the code and program
+	counter of the callers.  Frames remain in the store, exactly as in
+	the thesis.
+	
+	Every step executes one step instruction and all completion
+	instructions that follow it; see module compiler for the details.
+	Step counts therefore agree with the InterpreterVisitor.
+	"""
+	
+	def __init__(self, program, store=None):
+		Interpreter.__init__(self, store)
+		self.__compiler = CompilerVisitor()
+		
+		self.__code = self.__compiler.compileProgram(program)
+		self.__pc = 0
+		self.__continuations = []
+		self.__result = None
+		self.__halted = False
+		# Runtime errors that leave the configuration stuck.
+		self.__fault = None
+		
+		self.__instructions = {
+			OPCODE.PROG: self.__prog,
+			OPCODE.NEW: self.__new,
+			OPCODE.CALL: self.__call,
+			OPCODE.VAR: self.__var,
+			OPCODE.RETURN: self.__return,
+			OPCODE.SKIP: self.__skip,
+			OPCODE.BLOCK: self.__block,
+			OPCODE.IF: self.__if,
+			OPCODE.WHILE: self.__while,
+			OPCODE.ASSIGN: self.__assign,
+			OPCODE.ENDBLOCK: self.__endblock,
+			OPCODE.ENDMETHOD: self.__endmethod,
+			OPCODE.JUMP: self.__jump,
+			OPCODE.HALT: self.__halt,
+		}
+	
+
+	def _step(self):
+		if self.__fault: raise self.__fault
+		
+		instruction = self.__code[self.__pc]
+		self.__instructions[instruction[0]](instruction)
+		
+		while not (self.__halted or self.__fault) and \
+			self.__code[self.__pc][0] in COMPLETIONS:
+			instruction = self.__code[self.__pc]
+			self.__instructions[instruction[0]](instruction)
+	
+	def finished(self):
+		return self.__halted
+	
+	
+	def _saveConfiguration(self):
+		configuration = super(AbstractMachine, self)._saveConfiguration()
+		# Code lists never change; the continuations do.
+		configuration["code"] = (
+			self.__code, self.__pc, list(self.__continuations),
+			self.__result, self.__halted, self.__fault
+		)
+		return configuration
+	
+	def _restoreConfiguration(self, configuration):
+		super(AbstractMachine, self)._restoreConfiguration(configuration)
+		self.__code, self.__pc, continuations, \
+			self.__result, self.__halted, self.__fault = configuration["code"]
+		self.__continuations = list(continuations)
+	
+
+	# Behaviours hold compiled code instead of Constructs.
+	
+	def _pm(self, Dms):
+		return dict([
+			(	m.methodName.name,
+				(	self.__compiler.compileMethod(m.body),
+					[p.name for p in m.parameters] ) )
+			for m in Dms
+		])
+	
+	def _pc(self, Dc):
+		prototypeObject, constructorBody, argumentMapping = \
+			Interpreter._pc(self, Dc)
+		return (
+			prototypeObject,
+			self.__compiler.compileConstructor(constructorBody),
+			argumentMapping
+		)
+	
+
+	# ============
+	# Instructions
+	# ============
+	#
+	# Step instructions implement the transition rules of the same name
+	# in InterpreterVisitor; see there and section 3.3 of the thesis.
+	
+	def __prog(self, instruction):
+		self._initialise(instruction[1])
+		self._fired = (RULE.PROG, None)
+		self.__pc += 1
+	
+
+	def __new(self, instruction):
+		opcode, className, arguments = instruction
+		
+		classObject = self._classObject(className)
+		objectPrototype = self._store[ classObject.variable("proto") ]
+		newReference = self._put( objectPrototype.copy() )
+		
+		constructorCode, argumentMapping = classObject.method("ctor")
+		if len(argumentMapping) != len(arguments):
+			raise IndexError(
+				"The constructor of class '%s' takes exactly "
+				"%i arguments; %i were given." %
+				(className, len(argumentMapping), len(arguments))
+			)
+		binding = dict([
+				(argumentMapping[i], self._lookup(arguments[i]))
+				for i in range(0, len(argumentMapping))
+			])
+		binding["self"] = newReference
+		
+		self._push( self._framefrom(newReference) )
+		self._declare(binding)
+		self._fired = (RULE.NEW, className)
+		self.__enter(constructorCode)
+	
+
+	def __call(self, instruction):
+		"""
+		The instruction carries the call site's inline cache; see
+		Interpreter._resolveCall().
+		"""
+		opcode, target, methodName, arguments, cache = instruction
+		
+		targetReference = self._lookup(target)
+		calledObject = self._store[ targetReference ]
+		methodCode, argumentMapping = self._resolveCall(
+			calledObject.shape().behaviour, target, methodName,
+			len(arguments), cache
+		)
+		binding = dict([
+				(argumentMapping[i], self._lookup(arguments[i]))
+				for i in range(0, len(argumentMapping))
+			])
+		binding["self"] = targetReference
+		
+		self._push( self._framefrom(targetReference) )
+		self._declare(binding)
+		self._fired = (RULE.CALL, methodName)
+		self.__enter(methodCode)
+	
+
+	def __var(self, instruction):
+		self._push( self._store[self._fop].copy() )
+		self._fired = (RULE.VAR, None)
+		self.__enter(instruction[1])
+	
+
+	def __return(self, instruction):
+		opcode, var, blockDepth = instruction
+		
+		reference = self._lookup(var)
+		# Rules [subb2] for all enclosing blocks, then [subc2].
+		for i in range(0, blockDepth):
+			self._pop()
+		self._pop()
+		self._fired = (RULE.RETURN, None)
+		self.__leave(reference)
+	
+
+	def __skip(self, instruction):
+		self._fired = (RULE.SKIP, None)
+		self.__pc += 1
+	
+
+	def __block(self, instruction):
+		self._push( self._store[self._fop].copy() )
+		self._declare( dict([ (x, None) for x in instruction[1] ]) )
+		self._fired = (RULE.BLOCK, None)
+		self.__pc += 1
+	
+
+	def __if(self, instruction):
+		opcode, isEq, var1, var2, elseTarget = instruction
+		
+		ref1 = self._lookup(var1)
+		ref2 = self._lookup(var2)
+		
+		if (ref1 == ref2) == isEq:
+			self._fired = (RULE.IF1, None)
+			self.__pc += 1
+		else:
+			self._fired = (RULE.IF2, None)
+			self.__pc = elseTarget
+	
+
+	def __while(self, instruction):
+		self._fired = (RULE.WHILE, None)
+		self.__pc += 1
+	
+
+	# Completion instructions
+	
+	def __assign(self, instruction):
+		"""
+		Rule [ass3]; the method frame was popped on return already.
+		"""
+		target = instruction[1]
+		self._setv(
+			dict([ (target.name, self.__result) ]), self._container(target)
+		)
+		self.__result = None
+		self.__pc += 1
+	
+
+	def __endblock(self, instruction):
+		"""
+		Rule [subb1].
+		"""
+		self._pop()
+		self.__pc += 1
+	
+
+	def __endmethod(self, instruction):
+		"""
+		Rule [subc1].
+		"""
+		code, pc = self.__continuations[-1]
+		if code[pc][0] == OPCODE.ASSIGN:
+			# No rule applies to an assignment whose right hand
+			# side finished without a return value.
+			self.__fault = AttributeError(
+				"Cannot assign to '%s': the method returned no value." %
+				code[pc][1].name
+			)
+			return
+		
+		self._pop()
+		self.__leave(None)
+	
+
+	def __jump(self, instruction):
+		self.__pc = instruction[1]
+	
+
+	def __halt(self, instruction):
+		self.__halted = True
+	
+
+	# =================
+	# Utility functions
+	# =================
+	
+	def __enter(self, code):
+		"""
+		Continue with the first instruction of code; the next
+		instruction of the current code is its continuation.
+		"""
+		self.__continuations.append( (self.__code, self.__pc + 1) )
+		self.__code = code
+		self.__pc = 0
+	
+
+	def __leave(self, result):
+		"""
+		Resume the most recent continuation with the given result.
+		"""
+		self.__result = result
+		self.__code, self.__pc = self.__continuations.pop()
+
+
+
+class InspectorAbstractMachine(Inspector, AbstractMachine):
+	"""
+	Executes a compiled program and allows access to runtime information
+	for inspection and debugging.
+	"""
+	
+	def __init__(self, program, store=None):
+		AbstractMachine.__init__(self, program, store)
+		Inspector.__init__(self)
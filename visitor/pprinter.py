@@ -23,33 +23,72 @@ class PrettyPrintVisitor(Visitor):
 	"""
 	Print AST as nicely indented source code.
 	
-	Note that the visitor only generates an internal string when traversing
-	an AST; it does not output anything by itself.  Use its __str__()
-	method to print the code, for example by using "print pv" if pv is a
-	PrettyPrintVisitor instance.
+	If the visitor has a stream, it writes the code to the stream while
+	it traverses the AST.  Otherwise, it collects the code internally;
+	use its __str__() method to print the code, for example by using
+	"print pv" if pv is a PrettyPrintVisitor instance.
+	
+	A visitor with a focus prints only the constructs on a path through
+	the AST: the focus is the list of constructs from the root of the
+	printed tree down to a construct that is printed in full.  Other
+	statements and class declarations show as "...", which bounds the
+	output by the depth of the path instead of the size of the tree.
 	"""
-	def __init__(self):
-		self.__indentionlist = []
-		self.__result = ""
+	def __init__(self, stream=None, focus=None):
+		self.__indentionlist = [""]
+		if stream is None:
+			self.__result = []
+			self.__print = self.__result.append
+		else:
+			self.__result = None
+			self.__print = stream.write
+		
+		self.__focus = None
+		self.__focusEnd = None
+		if focus and len(focus) > 1:
+			self.__focus = set([ id(c) for c in focus[:-1] ])
+			self.__focusEnd = focus[-1]
 	
 	def __indent(self, prefix="  "):
-		self.__indentionlist.append(prefix)
+		self.__indentionlist.append(self.__indentionlist[-1] + prefix)
 	
 	def __unindent(self):
 		self.__indentionlist.pop()
 	
 	def __indention(self):
-		return "".join(self.__indentionlist)
+		return self.__indentionlist[-1]
+	
+	def __shown(self, construct):
+		"""
+		Whether the construct is on the focus path or within the
+		construct at its end.
+		"""
+		return self.__focus is None or construct is self.__focusEnd or \
+			id(construct) in self.__focus
 	
-	def __print(self, x):
-		self.__result += x
+	def __printStatement(self, pre, S, post):
+		"""
+		Shortcut for printing a statement while printing a pre- and
+		postfix; statements off the focus path show as "...".
+		"""
+		if self.__shown(S):
+			self.__printEnclosed(pre, S, post)
+		else:
+			self.__print("%s...%s" % (pre, post))
 	
 	def __printEnclosed(self, pre, obj, post):
 		"""
 		Shortcut for visiting obj while printing a pre- and postfix.
 		"""
 		self.__print(pre)
-		obj.accept(self)
+		if obj is self.__focusEnd:
+			# Everything within the end of the focus path shows.
+			focus = self.__focus
+			self.__focus = None
+			obj.accept(self)
+			self.__focus = focus
+		else:
+			obj.accept(self)
 		self.__print(post)
 	
 	def __printList(self, l):
@@ -64,7 +103,9 @@ class PrettyPrintVisitor(Visitor):
 		self.__print(")")
 	
 	def __str__(self):
-		return self.__result
+		if self.__result is None:
+			return ""
+		return "".join(self.__result)
 	
 	
 	def visitName(self, name):
@@ -102,7 +143,7 @@ class PrettyPrintVisitor(Visitor):
 	def visitAssign(self, ass):
 		ass.target.accept(self)
 		self.__print(" := ")
-		ass.rhs.accept(self)
+		self.__printStatement("", ass.rhs, "")
 	
 	def visitSkip(self, skip):
 		self.__print("skip")
@@ -112,11 +153,16 @@ class PrettyPrintVisitor(Visitor):
 		ret.var.accept(self)
 
 	def visitSequence(self, seq):
-		# Insert semicolons only between statements.
-		for S in seq.statements[:-1]:
-			self.__printEnclosed(self.__indention(), S, ";\n")
-		if seq.statements:
-			self.__printEnclosed(self.__indention(), seq.statements[-1], "\n")
+		# Insert semicolons only between statements.  Consecutive
+		# statements off the focus path show as a single "...".
+		statements = seq.statements
+		last = len(statements) - 1
+		for i, S in enumerate(statements):
+			separator = i < last and ";\n" or "\n"
+			if self.__shown(S):
+				self.__printEnclosed(self.__indention(), S, separator)
+			elif i == last or self.__shown(statements[i+1]):
+				self.__print("%s...%s" % (self.__indention(), separator))
 
 	def visitBlock(self, block):
 		self.__print("begin\n")
@@ -137,18 +183,18 @@ class PrettyPrintVisitor(Visitor):
 		self.__printEnclosed("if ", ite.bool, " then\n")
 		self.__indent()
 		
-		self.__printEnclosed(self.__indention(), ite.trueStatement, "")
+		self.__printStatement(self.__indention(), ite.trueStatement, "")
 		
 		self.__unindent()
 		self.__print("\n%selse\n" % self.__indention())
 		self.__indent()
 		
-		self.__printEnclosed(self.__indention(), ite.falseStatement, "")
+		self.__printStatement(self.__indention(), ite.falseStatement, "")
 		self.__unindent()
 
 	def visitWhile(self, whil):
 		self.__printEnclosed("while ", whil.bool, " do ")
-		whil.bodyStatement.accept(self)
+		self.__printStatement("", whil.bodyStatement, "")
 
 	def visitVariableDeclaration(self, dv):
 		self.__printEnclosed("var ", dv.var, ";")
@@ -182,26 +228,35 @@ class PrettyPrintVisitor(Visitor):
 		self.__print("%send;" % self.__indention())
 	
 	def visitProgram(self, prog):
+		elided = False
 		for dc in prog.classDeclarations:
-			self.__printEnclosed(self.__indention(), dc, "\n\n")
-		self.__printEnclosed("", prog.initialStatement, "\n")
+			if self.__shown(dc):
+				self.__printEnclosed(self.__indention(), dc, "\n\n")
+			elif not elided:
+				self.__print("%s...\n\n" % self.__indention())
+				elided = True
+		self.__printStatement("", prog.initialStatement, "\n")
 
 	def visitBlockScopedStatement(self, B):
-		if type(B.body) == Sequence:
+		if isinstance(B.body, Sequence):
 			self.__print("{\n")
 			self.__indent()
 			B.body.accept(self)
 			self.__unindent()
 			self.__print("%s}" % self.__indention())
 		else:
-			self.__printEnclosed("{ ", B.body, " }")
+			self.__printStatement("{ ", B.body, " }")
 
 	def visitMethodScopedStatement(self, B):
-		if type(B.body) == Sequence:
+		if isinstance(B.body, Sequence):
 			self.__print("[\n")
 			self.__indent()
 			B.body.accept(self)
 			self.__unindent()
 			self.__print("%s]" % self.__indention())
+		elif B.body is None:
+			# The method finished without a return value, which
+			# leaves an assignment stuck.
+			self.__print("[ ]")
 		else:
-			self.__printEnclosed("[ ", B.body, " ]")
+			self.__printStatement("[ ", B.body, " ]")
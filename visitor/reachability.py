@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# =======================
+# Capability reachability
+# =======================
+#
+# An object can use every object that a chain of member variables leads to:
+# it holds a capability for them.  The Reachability below keeps track of
+# which of a few watched objects hold capabilities for which others while
+# the program changes the store.
+#
+# For each watched object, the set of objects it reaches is kept along with
+# a level for each of them.  The watched object itself has level 0; every
+# other object in the set has a predecessor in the set on a lower level,
+# its support.  Following supports downwards therefore always ends at the
+# watched object, which proves that the object is reachable.  The levels
+# need not be the distances from the watched object.
+#
+# A new reference can only add objects to the set; a search from the
+# referenced object finds them.  Losing a reference matters only if the
+# referenced object lost its last support.  Then the objects whose support
+# depended on it are taken out of the set and put back from their remaining
+# predecessors, if they have any.  An object that leaves the store loses
+# all its references at once, and only the objects it held need checking.
+# Either way, the work is proportional to the objects that actually change
+# their status, not to the store's size.
+
+class Reachability(object):
+	"""
+	Maintains the objects that each of a set of watched objects reaches.
+	
+	The graph is given by two functions: successors(ref) returns the
+	references an object holds, and predecessors(ref) the objects that
+	hold a reference to the given object.  The owner reports every change
+	of the graph through update().
+	"""
+	
+	def __init__(self, successors, predecessors):
+		self.__successors = successors
+		self.__predecessors = predecessors
+		# Watched objects by name, and the levels of the objects each
+		# of them reaches.
+		self.__watched = {}
+		self.__levels = {}
+	
+
+	def watch(self, name, ref):
+		"""
+		Start watching the given object under the given name.
+		"""
+		self.__watched[name] = ref
+		self.__levels[name] = self.__search(ref)
+	
+
+	def unwatch(self, name):
+		self.__watched.pop(name, None)
+		self.__levels.pop(name, None)
+	
+
+	def watched(self):
+		"""
+		Names of the watched objects.
+		"""
+		return self.__watched.keys()
+	
+
+	def watches(self, name):
+		return name in self.__watched
+	
+
+	def active(self):
+		"""
+		Whether any object is watched.
+		"""
+		return bool(self.__watched)
+	
+
+	def rebuild(self, watched):
+		"""
+		Start over with the given mapping of names to objects, for
+		example because the store renamed its references.
+		"""
+		self.__watched = {}
+		self.__levels = {}
+		for name, ref in watched.iteritems():
+			self.watch(name, ref)
+	
+
+	def includes(self, name, ref):
+		"""
+		Whether the object watched under the given name reaches ref.
+		"""
+		return ref in self.__levels.get(name, ())
+	
+
+	def reaches(self):
+		"""
+		Pairs of names (source, target) such that the watched object
+		source reaches the watched object target.
+		"""
+		return [
+			(source, target)
+			for source, levels in self.__levels.iteritems()
+			for target, ref in self.__watched.iteritems()
+			if source != target and ref in levels
+		]
+	
+
+	def update(self, removed, added):
+		"""
+		Account for the removed and added references, given as lists of
+		pairs (holder, ref).  The graph must include all of them already.
+		Returns the pairs of names (source, target) of watched objects
+		that reach each other now but did not before.
+		"""
+		before = set(self.reaches())
+		for source, levels in self.__levels.iteritems():
+			root = self.__watched[source]
+			for holder, ref in removed:
+				if holder in levels and ref in levels and ref != root:
+					self.__detach(levels, root, ref)
+			for holder, ref in added:
+				if holder in levels and ref is not None and not ref in levels:
+					levels[ref] = levels[holder] + 1
+					self.__extend(levels, [ref])
+		
+		return [ pair for pair in self.reaches() if not pair in before ]
+	
+
+	def removed(self, ref, successors):
+		"""
+		Account for an object that left the store, given the references
+		it held.  The graph must not include the object any more.
+		"""
+		for source, levels in self.__levels.iteritems():
+			if not ref in levels:
+				continue
+			root = self.__watched[source]
+			del levels[ref]
+			if ref == root:
+				levels.clear()
+				levels[root] = 0
+				continue
+			
+			# The objects that ref held lost a predecessor.
+			for successor in successors:
+				if successor in levels and successor != root:
+					self.__detach(levels, root, successor)
+	
+
+	def stale(self):
+		"""
+		Names of the watched objects whose sets differ from a search
+		from scratch; empty unless the updates are wrong.
+		"""
+		return [
+			name for name, levels in self.__levels.iteritems()
+			if set(levels) != set( self.__search(self.__watched[name]) )
+		]
+	
+
+	def __search(self, root):
+		levels = { root: 0 }
+		self.__extend(levels, [root])
+		return levels
+	
+
+	def __extend(self, levels, frontier):
+		"""
+		Add all objects reachable from the frontier that are not in the
+		set yet.
+		"""
+		while frontier:
+			nextFrontier = []
+			for ref in frontier:
+				for successor in self.__successors(ref):
+					if successor is None or successor in levels:
+						continue
+					levels[successor] = levels[ref] + 1
+					nextFrontier.append(successor)
+			frontier = nextFrontier
+	
+
+	def __supported(self, levels, ref, orphans):
+		level = levels[ref]
+		for p in self.__predecessors(ref):
+			if p in levels and levels[p] < level and not p in orphans:
+				return True
+		return False
+	
+
+	def __detach(self, levels, root, ref):
+		"""
+		The object ref lost a predecessor; restore the supports.
+		"""
+		if self.__supported(levels, ref, ()):
+			return
+		
+		# Objects whose supports all depend on ref.
+		orphans = set([ ref ])
+		work = [ ref ]
+		while work:
+			for successor in self.__successors( work.pop() ):
+				if successor in levels and successor != root and \
+					not successor in orphans and \
+					not self.__supported(levels, successor, orphans):
+					orphans.add(successor)
+					work.append(successor)
+		
+		for orphan in orphans:
+			del levels[orphan]
+		
+		# Put back the orphans that other objects still reach.
+		frontier = []
+		for orphan in orphans:
+			supports = [
+				levels[p] for p in self.__predecessors(orphan)
+				if p in levels
+			]
+			if supports and not orphan in levels:
+				levels[orphan] = min(supports) + 1
+				frontier.append(orphan)
+		self.__extend(levels, frontier)
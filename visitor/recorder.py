@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import gzip
+import struct
+
+from interpreter import InterpreterVisitor, INAME, RULE_NAMES
+from machine import AbstractMachine
+
+
+# ================
+# Execution Traces
+# ================
+#
+# A trace records every change of the store and, after each step, the rule
+# that fired and the frame object pointer.  Replaying the records rebuilds
+# the store of any step without executing the program.
+#
+# The trace numbers objects in the order they were put into the store,
+# starting from 1; 0 stands for nil.  The numbers never change, even if
+# the store hands out a reference again or compaction renames it.  Names of
+# variables, methods and classes are numbered in the order they first
+# appear; a NAME record introduces each of them.  All numbers are variable
+# length integers of seven bits per byte, lowest first.  The records are:
+#
+#   STEP  rule, name of the called method or created class (0 if none),
+#         frame object pointer
+#   NAME  length and UTF-8 encoding of the next name
+#   PUT   number of methods and their names, number of variables and
+#         pairs of their names and values; the object receives the next
+#         object number
+#   SET   object, number of variables and pairs of their names and values
+#   FREE  object
+#
+# A trace file starts with MAGIC and consists of blocks of whole records,
+# each preceded by its length as a four byte integer.  Readers therefore
+# never need to look beyond the block at hand.  Compressed traces are gzip
+# files of the same content.
+
+MAGIC = "CLTRACE1"
+
+STEP, NAME, PUT, SET, FREE = range(1, 6)
+
+# Internalised names cannot collide with names of Class programs, which
+# never contain colons.
+_internalNames = {
+	INAME.PREV: "int:PREV",
+	INAME.CLASS: "int:CLASS",
+}
+_internalValues = dict([ (n, v) for v, n in _internalNames.iteritems() ])
+
+_blockLength = struct.Struct("<I")
+
+
+class TraceWriter(object):
+	"""
+	Writes the records of a trace to a file.  Records collect in a
+	buffer that goes to the file as a block once it is full.
+	"""
+	
+	def __init__(self, fileName, compress=False, bufferSize=64 * 1024):
+		if compress:
+			self.__file = gzip.open(fileName, "wb")
+		else:
+			self.__file = open(fileName, "wb")
+		self.__file.write(MAGIC)
+		self.__buffer = bytearray()
+		self.__bufferSize = bufferSize
+		self.__names = {}
+	
+
+	def step(self, rule, name, fop):
+		buffer = self.__buffer
+		nameNumber = 0
+		if name is not None:
+			nameNumber = self.__name(name)
+		buffer.append(STEP)
+		_putNumber(buffer, rule)
+		_putNumber(buffer, nameNumber)
+		_putNumber(buffer, fop)
+		if len(buffer) >= self.__bufferSize:
+			self.flush()
+	
+
+	def put(self, methods, state):
+		"""
+		Record a new object with the given method names and state.  The
+		state is a list of pairs of names and object numbers.
+		"""
+		numbers = [ self.__name(m) for m in methods ]
+		state = [ (self.__name(x), value) for x, value in state ]
+		buffer = self.__buffer
+		buffer.append(PUT)
+		_putNumber(buffer, len(numbers))
+		for number in numbers:
+			_putNumber(buffer, number)
+		self.__putState(state)
+	
+
+	def set(self, obj, state):
+		state = [ (self.__name(x), value) for x, value in state ]
+		buffer = self.__buffer
+		buffer.append(SET)
+		_putNumber(buffer, obj)
+		self.__putState(state)
+	
+
+	def free(self, obj):
+		self.__buffer.append(FREE)
+		_putNumber(self.__buffer, obj)
+	
+
+	def flush(self):
+		if self.__buffer:
+			self.__file.write( _blockLength.pack(len(self.__buffer)) )
+			self.__file.write( str(self.__buffer) )
+			self.__buffer = bytearray()
+	
+
+	def close(self):
+		self.flush()
+		self.__file.close()
+	
+
+	def __name(self, name):
+		try:
+			return self.__names[name]
+		except KeyError:
+			pass
+		
+		number = len(self.__names) + 1
+		self.__names[name] = number
+		text = _internalNames.get(name, name).encode("utf-8")
+		self.__buffer.append(NAME)
+		_putNumber(self.__buffer, len(text))
+		self.__buffer.extend(text)
+		return number
+	
+
+	def __putState(self, state):
+		buffer = self.__buffer
+		_putNumber(buffer, len(state))
+		for name, value in state:
+			_putNumber(buffer, name)
+			_putNumber(buffer, value)
+
+
+def _putNumber(buffer, n):
+	while n >= 0x80:
+		buffer.append( (n & 0x7f) | 0x80 )
+		n >>= 7
+	buffer.append(n)
+
+
+
+class Recorder(object):
+	"""
+	Mix-in for Interpreters that writes a trace of the execution to a
+	TraceWriter; see record().
+	
+	Engines that run the whole program in a single step(), such as the
+	big-step evaluator, yield no records per transition.
+	"""
+	
+	__trace = None
+	
+	def record(self, writer):
+		"""
+		Write the trace to the given TraceWriter, starting with the
+		next step.  The recording must start before the first step.
+		"""
+		self.__trace = writer
+		# Object numbers by reference.
+		self.__numbers = {}
+		self.__objects = 0
+	
+
+	def step(self):
+		super(Recorder, self).step()
+		if self.__trace:
+			rule, name = self._fired
+			self.__trace.step(rule, name, self.__numbers.get(self._fop, 0))
+	
+
+	def _put(self, obj):
+		ref = super(Recorder, self)._put(obj)
+		if self.__trace:
+			self.__objects += 1
+			self.__numbers[ref] = self.__objects
+			self.__trace.put(obj.methods(), self.__state(
+				[ (x, obj.variable(x)) for x in obj.variables() ]
+			))
+		return ref
+	
+
+	def _setv(self, state, ref):
+		super(Recorder, self)._setv(state, ref)
+		if self.__trace:
+			self.__trace.set(
+				self.__numbers[ref], self.__state(state.iteritems())
+			)
+	
+
+	def _free(self, ref):
+		super(Recorder, self)._free(ref)
+		if self.__trace:
+			self.__trace.free( self.__numbers.pop(ref) )
+	
+
+	def _remapReferences(self, mapping):
+		super(Recorder, self)._remapReferences(mapping)
+		if self.__trace:
+			self.__numbers = dict([
+				(mapping.get(ref), number)
+				for ref, number in self.__numbers.iteritems()
+			])
+	
+
+	def __state(self, state):
+		numbers = self.__numbers
+		return [
+			(x, value is not None and numbers[value] or 0)
+			for x, value in state
+		]
+
+
+
+class Replay(object):
+	"""
+	Rebuilds the store from a trace file.
+	
+	The store maps object numbers to pairs of the object's method names
+	and its state, which maps variable names to object numbers or None.
+	Internalised names are INAME values, as in the interpreter.
+	"""
+	
+	def __init__(self, fileName):
+		file = open(fileName, "rb")
+		if file.read(2) == "\x1f\x8b":
+			file.close()
+			file = gzip.open(fileName, "rb")
+		else:
+			file.seek(0)
+		if file.read(len(MAGIC)) != MAGIC:
+			file.close()
+			raise ValueError("'%s' is not a trace file." % fileName)
+		
+		self.__file = file
+		self.__names = [None]
+		self.__objects = 0
+		self.__block = bytearray()
+		self.__position = 0
+		
+		self.store = {}
+		self.fop = None
+		self.steps = 0
+		# Number of times each rule fired, by rule name.
+		self.rules = {}
+	
+
+	def run(self, steps=None):
+		"""
+		Apply the records up to the end of the given step, or up to
+		the end of the trace if steps is None or beyond it.  Returns
+		whether the trace has more steps.
+		"""
+		while steps is None or self.steps < steps:
+			if self.__position == len(self.__block) and not self.__readBlock():
+				return False
+			self.__apply()
+		return self.__position < len(self.__block) or self.__readBlock()
+	
+
+	def close(self):
+		self.__file.close()
+	
+
+	def __readBlock(self):
+		header = self.__file.read(_blockLength.size)
+		if len(header) < _blockLength.size:
+			return False
+		length, = _blockLength.unpack(header)
+		self.__block = bytearray( self.__file.read(length) )
+		self.__position = 0
+		return True
+	
+
+	def __number(self):
+		block = self.__block
+		position = self.__position
+		n = 0
+		shift = 0
+		while True:
+			byte = block[position]
+			position += 1
+			n |= (byte & 0x7f) << shift
+			if byte < 0x80:
+				break
+			shift += 7
+		self.__position = position
+		return n
+	
+
+	def __state(self):
+		names = self.__names
+		state = {}
+		for i in xrange( self.__number() ):
+			name = names[ self.__number() ]
+			state[name] = self.__number() or None
+		return state
+	
+
+	def __apply(self):
+		"""
+		Apply the record at the current position; the block must hold
+		at least one more record.
+		"""
+		kind = self.__block[self.__position]
+		self.__position += 1
+		
+		if kind == STEP:
+			rule = RULE_NAMES[ self.__number() ]
+			self.__number()
+			self.fop = self.__number() or None
+			self.steps += 1
+			self.rules[rule] = self.rules.get(rule, 0) + 1
+		
+		elif kind == NAME:
+			length = self.__number()
+			end = self.__position + length
+			name = str( self.__block[self.__position:end] ).decode("utf-8")
+			self.__position = end
+			self.__names.append( _internalValues.get(name, name) )
+		
+		elif kind == PUT:
+			methods = [
+				self.__names[ self.__number() ]
+				for i in xrange( self.__number() )
+			]
+			self.__objects += 1
+			self.store[self.__objects] = (methods, self.__state())
+		
+		elif kind == SET:
+			obj = self.__number()
+			self.store[obj][1].update( self.__state() )
+		
+		elif kind == FREE:
+			del self.store[ self.__number() ]
+		
+		else:
+			raise ValueError("Invalid trace record %i." % kind)
+
+
+
+class RecordingInterpreterVisitor(Recorder, InterpreterVisitor):
+	"""
+	Interprets a program represented by a tree of Constructs and writes
+	a trace of the execution.
+	"""
+	pass
+
+
+
+class RecordingAbstractMachine(Recorder, AbstractMachine):
+	"""
+	Executes a compiled program and writes a trace of the execution.
+	"""
+	pass
+
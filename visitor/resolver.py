@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from visitor import Visitor
+from interpreter import INAME
+
+
+# ================
+# Scope Resolution
+# ================
+#
+# Scoping in Class is static: the declaration that a variable refers to
+# follows from the program text.  Inside a method or constructor, the
+# scopes are, by level:
+#
+#   0  the member variables of the class, held by the object itself,
+#   1  the parameters and self, held by the container that rule [call] or
+#      [new] declares,
+#   2  and above, the variables of the enclosing blocks, innermost last,
+#      each held by the container that rule [block] declares.
+#
+# Objects and containers lay out their variables in sorted order (see
+# ClassObject), so a variable's slot in its container is the position of
+# its name among the sorted names of its scope.  Frames grow in the same
+# way: a method's frame starts with the sorted member variables and the
+# internal names, and every declaration appends the new names in sorted
+# order; names that shadow others keep their slot.  The resolver follows
+# these steps and annotates each variable with its scope and frame slot.
+# The interpreters then read a variable through two slots instead of two
+# lookups by name; see Interpreter._lookup().
+#
+# Variables that no declaration introduces keep no annotation.  They fail
+# when they are used, as before, but the resolver reports them at once.
+
+class ScopeResolverVisitor(Visitor):
+	"""
+	Annotates the variables of a program with the declaration they
+	refer to; see resolveProgram().
+	"""
+
+	def __init__(self):
+		Visitor.__init__(self)
+		self.__scopes = []
+		self.__frame = []
+		self.__context = None
+		self.__problems = []
+
+
+	def resolveProgram(self, prog):
+		"""
+		Annotate all variables of the program and return a list of
+		messages about the variables that are undefined where they are
+		used.
+		"""
+		return self.resolveParts(prog.classDeclarations, prog.initialStatement)
+
+
+	def resolveParts(self, classDeclarations, initialStatement=None):
+		"""
+		Like resolveProgram(), but only for the given class declarations
+		and, unless it is None, the initial statement.  Scopes never
+		extend across class declarations, so the parts of a program
+		resolve independently.
+		"""
+		self.__problems = []
+		for DecC in classDeclarations:
+			DecC.accept(self)
+
+		if initialStatement is not None:
+			# The initial frame has no variables.
+			self.__scopes = []
+			self.__frame = [INAME.PREV, INAME.CLASS]
+			self.__context = "the initial statement"
+			initialStatement.accept(self)
+		return self.__problems
+
+
+	def visitClassDeclaration(self, dc):
+		className = dc.className.name
+		self.__members = _sortedNames([ Dv.var for Dv in dc.memberVars ])
+
+		self.__context = "the constructor of class '%s'" % className
+		self.__resolveBody(dc.constructor.parameters, dc.constructor.body)
+		for Dm in dc.methods:
+			self.__context = "method '%s' of class '%s'" % (
+				Dm.methodName.name, className )
+			self.__resolveBody(Dm.parameters, Dm.body)
+
+
+	def __resolveBody(self, parameters, body):
+		"""
+		Resolve the variables of a method or constructor body, whose
+		frame _framefrom() and _declare() build.
+		"""
+		binding = _sortedNames(parameters + ["self"])
+		self.__scopes = [ self.__members, binding ]
+		self.__frame = _extended(
+			_extended([], self.__members + [INAME.PREV, INAME.CLASS]),
+			binding
+		)
+		body.accept(self)
+
+
+	def visitBlock(self, block):
+		declared = _sortedNames([ Dv.var for Dv in block.declaredVars ])
+		outerFrame = self.__frame
+		self.__scopes.append(declared)
+		self.__frame = _extended(outerFrame, declared)
+		try:
+			block.sequence.accept(self)
+		finally:
+			self.__scopes.pop()
+			self.__frame = outerFrame
+
+
+	def visitVariable(self, var):
+		var.scope = None
+		var.frameSlot = None
+		for level in range(len(self.__scopes) - 1, -1, -1):
+			names = self.__scopes[level]
+			if var.name in names:
+				var.scope = (level, names.index(var.name))
+				var.frameSlot = self.__frame.index(var.name)
+				return
+		self.__problems.append(
+			"Variable '%s' is undefined in %s." % (var.name, self.__context)
+		)
+
+
+	def visitBoolEq(self, beq):
+		beq.var1.accept(self)
+		beq.var2.accept(self)
+
+	def visitBoolNeq(self, bneq):
+		bneq.var1.accept(self)
+		bneq.var2.accept(self)
+
+
+	def visitVarExpression(self, varexpr):
+		varexpr.var.accept(self)
+
+	def visitNew(self, new):
+		for a in new.arguments:
+			a.accept(self)
+
+	def visitCall(self, call):
+		call.target.accept(self)
+		for a in call.arguments:
+			a.accept(self)
+
+
+	def visitAssign(self, ass):
+		# The target is a Name, but resolves like a variable.
+		self.visitVariable(ass.target)
+		ass.rhs.accept(self)
+
+	def visitReturn(self, ret):
+		ret.var.accept(self)
+
+	def visitSequence(self, seq):
+		for S in seq.statements:
+			S.accept(self)
+
+	def visitIfThenElse(self, ite):
+		ite.bool.accept(self)
+		ite.trueStatement.accept(self)
+		ite.falseStatement.accept(self)
+
+	def visitWhile(self, whil):
+		whil.bool.accept(self)
+		whil.bodyStatement.accept(self)
+
+
+
+def _sortedNames(names):
+	"""
+	The distinct names of the given Names, Variables or strings in the
+	order of their slots.
+	"""
+	return sorted(set([ getattr(x, "name", x) for x in names ]))
+
+
+def _extended(frame, names):
+	"""
+	The layout of the given frame after declaring the given names.
+	"""
+	return frame + sorted([ x for x in set(names) if x not in frame ])
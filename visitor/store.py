@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2008--2012  Peter Dinges <pdinges@acm.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# ======
+# Stores
+# ======
+#
+# The store maps references to ClassObjects (section 3.1.2).  Interpreters
+# access it like a dictionary; additionally, every store hands out unused
+# references through new() and converts references to and from the
+# addresses the user sees.
+
+from itertools import izip
+
+class Reference(object):
+	"""
+	Identifiers for ClassObjects.
+	"""
+	pass
+
+
+
+# Snapshots
+#
+# Checkpoints keep many snapshots of the same store, and consecutive ones
+# differ in few objects.  A snapshot therefore splits the mapping from
+# references to objects into small buckets by the references' hashes, and
+# the buckets into groups; it shares every bucket and every group in which
+# nothing changed with the snapshot before.  The store remembers the
+# snapshot that its contents derive from and the references it changed
+# since.  Taking a snapshot, comparing one with the store, or restoring one
+# then looks at one pointer per group and at the buckets that changed, not
+# at every object.
+
+def _spread(ref):
+	"""
+	The reference's hash with its bits mixed, so that the low bits
+	differ even for the memory addresses of equal-sized objects.
+	"""
+	h = hash(ref)
+	return h ^ (h >> 3) ^ (h >> 11)
+
+
+
+class Snapshot(object):
+	"""
+	The contents of a store at some point in time.  The groups are
+	tuples of buckets, which are dictionaries from references to
+	objects; the state holds whatever else the store needs to hand out
+	the same references again.
+	"""
+	
+	def __init__(self, groups, state=None):
+		self.groups = groups
+		self.mask = len(groups) * SnapshotStore.GROUP_SIZE - 1
+		self.state = state
+	
+	def get(self, ref):
+		"""
+		The object under the given reference, or None.
+		"""
+		i = _spread(ref) & self.mask
+		return self.groups[i / SnapshotStore.GROUP_SIZE] \
+			[i % SnapshotStore.GROUP_SIZE].get(ref)
+	
+	def references(self):
+		refs = set()
+		for group in self.groups:
+			for bucket in group:
+				refs.update(bucket)
+		return refs
+
+
+
+class SnapshotStore(object):
+	"""
+	Snapshots that share structure; see above.  Stores add every
+	reference whose object they set or remove to _dirty, and they
+	implement _lookup(), _assign(), _state() and _setState().
+	"""
+	
+	# Number of objects per bucket that snapshots aim at, and number of
+	# buckets per group.
+	BUCKET_SIZE = 8
+	GROUP_SIZE = 32
+	
+	# The snapshot the contents derive from, and the references changed
+	# since; both are None until the first snapshot.
+	__base = None
+	_dirty = None
+	
+	def snapshot(self):
+		"""
+		Returns the store's contents in a form that restore() accepts.
+		The snapshot shares the objects with the store and the unchanged
+		buckets with the previous snapshot.
+		"""
+		base = self.__base
+		count = 1
+		while count * self.GROUP_SIZE * self.BUCKET_SIZE < len(self):
+			count *= 2
+		
+		if base is None or \
+			not count / 2 <= len(base.groups) <= count * 2:
+			# Start over with the number of groups that fits the size.
+			groups = [
+				[ {} for i in xrange(self.GROUP_SIZE) ]
+				for j in xrange(count)
+			]
+			mask = count * self.GROUP_SIZE - 1
+			for ref, obj in self.iteritems():
+				i = _spread(ref) & mask
+				groups[i / self.GROUP_SIZE][i % self.GROUP_SIZE][ref] = obj
+		else:
+			# Copy the groups and buckets that changed, once each.
+			groups = list(base.groups)
+			copiedGroups = set()
+			copiedBuckets = set()
+			for ref in self._dirty:
+				i = _spread(ref) & base.mask
+				group, slot = divmod(i, self.GROUP_SIZE)
+				if not group in copiedGroups:
+					groups[group] = list(groups[group])
+					copiedGroups.add(group)
+				if not i in copiedBuckets:
+					groups[group][slot] = dict(groups[group][slot])
+					copiedBuckets.add(i)
+				bucket = groups[group][slot]
+				obj = self._lookup(ref)
+				if obj is None:
+					bucket.pop(ref, None)
+				else:
+					bucket[ref] = obj
+		
+		self.__base = Snapshot(
+			tuple([ tuple(group) for group in groups ]), self._state()
+		)
+		self._dirty = set()
+		return self.__base
+	
+	def changes(self, snapshot):
+		"""
+		Returns the references whose objects differ between the store
+		and the given snapshot.
+		"""
+		base = self.__base
+		if base is None or len(base.groups) != len(snapshot.groups):
+			refs = snapshot.references()
+			refs.update(self.iterkeys())
+		else:
+			# The store holds the base with the changes since.
+			refs = set(self._dirty)
+			for ourGroup, theirGroup in izip(base.groups, snapshot.groups):
+				if ourGroup is theirGroup:
+					continue
+				for ours, theirs in izip(ourGroup, theirGroup):
+					if ours is theirs:
+						continue
+					for ref, obj in ours.iteritems():
+						if not theirs.get(ref) is obj:
+							refs.add(ref)
+					for ref in theirs:
+						if not ref in ours:
+							refs.add(ref)
+		return [
+			ref for ref in refs
+			if not self._lookup(ref) is snapshot.get(ref)
+		]
+	
+	def restore(self, snapshot):
+		"""
+		Reset the store to the given snapshot.  References handed out
+		afterwards are the same as after taking the snapshot.
+		"""
+		changes = self.changes(snapshot)
+		self._setState(snapshot.state)
+		for ref in changes:
+			self._assign(ref, snapshot.get(ref))
+		self.__base = snapshot
+		self._dirty = set()
+	
+	def _forgetSnapshots(self):
+		"""
+		The contents no longer derive from the last snapshot, for
+		example because all references changed.
+		"""
+		self.__base = None
+
+
+
+class DictStore(SnapshotStore, dict):
+	"""
+	A store that uses a fresh Python object as reference for each object.
+	Addresses are the references' memory locations and therefore differ
+	between runs.
+	"""
+	
+	def new(self):
+		"""
+		Returns an unused reference.
+		"""
+		return Reference()
+	
+	def address(self, ref):
+		"""
+		The address of the given reference.
+		"""
+		return id(ref)
+	
+	def name(self, ref):
+		"""
+		Human-readable representation of the reference's address.
+		"""
+		return "0x%x" % id(ref)
+	
+	def reference(self, address):
+		"""
+		Returns the reference with the given address; raises a KeyError
+		if there is none.
+		"""
+		# There should be exactly one object in the store that has the
+		# given address.
+		refs = [ r for r in self.iterkeys() if id(r) == address ]
+		if not refs:
+			raise KeyError(address)
+		return refs[0]
+	
+	def compact(self):
+		"""
+		References do not leave gaps; there is nothing to do.
+		"""
+		return None
+	
+	def __setitem__(self, ref, obj):
+		if self._dirty is not None:
+			self._dirty.add(ref)
+		dict.__setitem__(self, ref, obj)
+	
+	def __delitem__(self, ref):
+		if self._dirty is not None:
+			self._dirty.add(ref)
+		dict.__delitem__(self, ref)
+	
+
+	# Snapshots
+	
+	def _lookup(self, ref):
+		return dict.get(self, ref)
+	
+	def _assign(self, ref, obj):
+		if obj is None:
+			dict.pop(self, ref, None)
+		else:
+			dict.__setitem__(self, ref, obj)
+	
+	def _state(self):
+		return None
+	
+	def _setState(self, state):
+		pass
+
+
+
+class ArrayStore(SnapshotStore):
+	"""
+	A store that keeps objects in a growable array.  References are the
+	integer indices into this array, which makes them their own
+	addresses.  Indices of removed objects go onto a free list and are
+	handed out again by new().  Hence, the same program run always yields
+	the same references.
+	"""
+	
+	def __init__(self):
+		# Unused slots hold None.  The free list is a chain of pairs
+		# (reference, rest), which snapshots share.
+		self.__objects = []
+		self.__free = None
+		self.__size = 0
+	
+	def new(self):
+		"""
+		Returns an unused reference.
+		"""
+		if self.__free:
+			ref, self.__free = self.__free
+			return ref
+		self.__objects.append(None)
+		return len(self.__objects) - 1
+	
+	def address(self, ref):
+		return ref
+	
+	def name(self, ref):
+		return "%i" % ref
+	
+	def reference(self, address):
+		if not address in self:
+			raise KeyError(address)
+		return address
+	
+	def compact(self):
+		"""
+		Moves all objects to the beginning of the array so that the
+		array has no gaps.  Returns a dictionary that maps the old
+		references to the new ones; all references held by objects in
+		the store are updated accordingly.  Any other references the
+		caller holds must be translated by the caller.
+		
+		The array holds updated copies afterwards; the objects themselves
+		stay as they are, because snapshots may share them.
+		"""
+		mapping = {}
+		objects = []
+		for ref, obj in enumerate(self.__objects):
+			if obj is not None:
+				mapping[ref] = len(objects)
+				objects.append( obj.copy() )
+		
+		for obj in objects:
+			obj.update(dict([
+				(x, mapping.get( obj.variable(x) ))
+				for x in obj.variables()
+			]))
+		
+		self.__objects = objects
+		self.__free = None
+		self._forgetSnapshots()
+		return mapping
+	
+
+	# Snapshots
+	
+	def _lookup(self, ref):
+		if ref < len(self.__objects):
+			return self.__objects[ref]
+		return None
+	
+	def _assign(self, ref, obj):
+		if ref < len(self.__objects):
+			self.__objects[ref] = obj
+	
+	def _state(self):
+		return (len(self.__objects), self.__free, self.__size)
+	
+	def _setState(self, state):
+		length, self.__free, self.__size = state
+		del self.__objects[length:]
+		self.__objects.extend( [None] * (length - len(self.__objects)) )
+	
+
+	# Dictionary interface
+	
+	def __getitem__(self, ref):
+		try:
+			obj = self.__objects[ref]
+		except (IndexError, TypeError):
+			raise KeyError(ref)
+		if obj is None:
+			raise KeyError(ref)
+		return obj
+	
+	def __setitem__(self, ref, obj):
+		if self.__objects[ref] is None:
+			self.__size += 1
+		self.__objects[ref] = obj
+		if self._dirty is not None:
+			self._dirty.add(ref)
+	
+	def __delitem__(self, ref):
+		self[ref]
+		self.__objects[ref] = None
+		self.__free = (ref, self.__free)
+		self.__size -= 1
+		if self._dirty is not None:
+			self._dirty.add(ref)
+	
+	def __contains__(self, ref):
+		return type(ref) == int \
+			and 0 <= ref < len(self.__objects) \
+			and self.__objects[ref] is not None
+	
+	def __len__(self):
+		return self.__size
+	
+	def __iter__(self):
+		return self.iterkeys()
+	
+	def has_key(self, ref):
+		return ref in self
+	
+	def iterkeys(self):
+		for ref, obj in enumerate(self.__objects):
+			if obj is not None:
+				yield ref
+	
+	def keys(self):
+		return list(self.iterkeys())
+	
+	def iteritems(self):
+		for ref, obj in enumerate(self.__objects):
+			if obj is not None:
+				yield ref, obj
+	
+	def items(self):
+		return list(self.iteritems())